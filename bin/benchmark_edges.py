@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Benchmarks the computation of the edge map used by segment_edges.
+
+Reports the wall time and the peak memory allocated by each call. Run from the
+root of the repository:
+
+    python -m bin.benchmark_edges [image ...]
+
+If no images are given, a synthetic image of 5000 x 5000 pixels, the size
+used for segmenting drawer scans, is made by tiling the test images.
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from inselect.lib.segment import edge_map
+
+
+TESTDATA = Path(__file__).parent.parent / 'inselect' / 'tests' / 'test_data'
+
+
+def drawer_sized_image(width=5000, height=5000):
+    "Returns an image of width x height made by tiling the test images"
+    tiles = [cv2.imread(str(TESTDATA / name))
+             for name in ('pinned.jpg', 'barcodes.jpg', 'shapes.png')]
+    tile_height = min(t.shape[0] for t in tiles)
+    tiles = [t[:tile_height] for t in tiles]
+    row = np.hstack(tiles)
+    rows = np.vstack([row] * (1 + height // tile_height))
+    return np.ascontiguousarray(
+        np.tile(rows, (1, 1 + width // row.shape[1], 1))[:height, :width]
+    )
+
+
+def benchmark(image, repeats, **kwargs):
+    """Returns a tuple (best wall time in seconds, peak memory allocated in
+    bytes) of repeats calls to edge_map
+    """
+    times = []
+    peak = 0
+    for _ in range(repeats):
+        tracemalloc.start()
+        start = time.perf_counter()
+        edge_map(image, **kwargs)
+        times.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('image', nargs='*', type=Path)
+    parser.add_argument('-n', '--repeats', type=int, default=5)
+    args = parser.parse_args(args)
+
+    if args.image:
+        images = [(str(p), cv2.imread(str(p))) for p in args.image]
+    else:
+        images = [('synthetic drawer', drawer_sized_image())]
+
+    for name, image in images:
+        for label, kwargs in (('lab', {}),
+                              ('gray', {'lab_based': False}),
+                              ('lab, no line filter', {'line_filter': 0})):
+            elapsed, peak = benchmark(image, args.repeats, **kwargs)
+            print('{0} {1} [{2}]: {3:.3f}s, peak [{4:.1f}] MB'.format(
+                name, image.shape[1::-1], label, elapsed, peak / 1024 ** 2
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Benchmarks the validation and export of documents with many boxes.
+
+Times validate_document, DocumentExport.crop_fnames and
+DocumentExport.export_csv for documents of between 10 and 3,000 boxes,
+reading items through InselectDocument.items_view and, for comparison,
+through a deep copy of the items on every access, as was previously the
+case. Also times the conversion of normalised boxes to pixels one at a
+time, with InselectImage.from_normalised, and all at once, with
+InselectImage.from_normalised_array on InselectDocument.boxes. Run from the
+root of the repository:
+
+    python -m bin.benchmark_items
+"""
+import argparse
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+import numpy as np
+
+from inselect.lib.document import InselectDocument
+from inselect.lib.document_export import DocumentExport
+from inselect.lib.rect import Rect
+from inselect.lib.user_template import UserTemplate
+from inselect.lib.validate_document import validate_document
+
+
+TESTDATA = Path(__file__).parent.parent / 'inselect' / 'tests' / 'test_data'
+
+COUNTS = (10, 100, 1000, 3000)
+
+
+class CopyingDocument(InselectDocument):
+    "A document whose items_view is a deep copy of items, as previously"
+    @property
+    def items_view(self):
+        return self.items
+
+
+def document(cls, n, seed=0):
+    "Returns an instance of cls with n boxes on the shapes test image"
+    rng = np.random.RandomState(seed)
+    items = []
+    for index in range(n):
+        left, top = rng.uniform(0, 0.9, 2)
+        items.append({
+            'rect': Rect(float(left), float(top), 0.1, 0.1),
+            'rotation': 0,
+            'fields': {
+                'catalogNumber': str(index),
+                'Taxonomy': 'Insecta',
+                'Location': 'Drawer {0}'.format(index // 100),
+            },
+        })
+    return cls(scanned_path=TESTDATA / 'shapes.png', items=items)
+
+
+def timed(fn, repeats, *args):
+    "Returns the best time in seconds of repeats calls to fn"
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--repeats', type=int, default=3)
+    args = parser.parse_args(args)
+
+    template = UserTemplate.load(TESTDATA / 'test.inselect_template')
+    export = DocumentExport(template)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        csv = Path(tempdir) / 'export.csv'
+        operations = (
+            ('validate', lambda doc: validate_document(doc, template)),
+            ('crop_fnames', lambda doc: list(export.crop_fnames(doc))),
+            ('export_csv', lambda doc: export.export_csv(doc, csv)),
+        )
+        for n in COUNTS:
+            view, copying = document(InselectDocument, n), document(
+                CopyingDocument, n
+            )
+            for name, fn in operations:
+                after = timed(fn, args.repeats, view)
+                before = timed(fn, args.repeats, copying)
+                print('[{0}] boxes {1}: {2:.4f}s, copying items: {3:.4f}s '
+                      '({4:.1f}x)'.format(n, name, after, before,
+                                          before / after))
+
+            rects = [i['rect'] for i in view.items_view]
+            before = timed(lambda: list(view.scanned.from_normalised(rects)),
+                           args.repeats)
+            after = timed(
+                lambda: view.scanned.from_normalised_array(view.boxes.rects),
+                args.repeats
+            )
+            print('[{0}] boxes from_normalised_array: {1:.4f}s, '
+                  'from_normalised: {2:.4f}s ({3:.1f}x)'.format(
+                      n, after, before, before / after
+                  ))
+
+
+if __name__ == '__main__':
+    main()
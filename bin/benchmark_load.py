@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Benchmarks scanning a directory of documents for those without boxes.
+
+Writes documents with and without boxes to a temporary directory and times
+finding those without boxes by loading each document, by loading each
+lazily and by reading only the header of each. Run from the root of the
+repository:
+
+    python -m bin.benchmark_load [--documents 20000] [--items 100]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+from inselect.lib.document import InselectDocument
+
+
+TESTDATA = Path(__file__).parent.parent / 'inselect' / 'tests' / 'test_data'
+
+
+def write_documents(dir, n_documents, n_items):
+    """Writes n_documents to dir, every other one with n_items boxes, each
+    with the shapes test image
+    """
+    source = InselectDocument.load(TESTDATA / 'shapes.inselect')
+    properties = {k: InselectDocument._format_datetime(v)
+                  if k in {'Saved on', 'Created on'} else v
+                  for k, v in source.properties.items()}
+    items = [dict(item, rect=tuple(item['rect']))
+             for item in source.items] * (n_items // source.n_items + 1)
+    for index in range(n_documents):
+        path = dir / 'doc_{0}{1}'.format(index, InselectDocument.EXTENSION)
+        doc = {
+            'inselect version': InselectDocument.FILE_VERSIONS[-1],
+            'scanned extension': '.png',
+            'items': items[:n_items] if index % 2 else [],
+            'properties': properties,
+        }
+        # As written by InselectDocument.save
+        with path.open('w', newline='\n', encoding='utf8') as f:
+            f.write(json.dumps(doc, ensure_ascii=False, indent=4,
+                               separators=(',', ': '), sort_keys=True))
+        image = path.with_suffix('.png')
+        try:
+            os.link(str(TESTDATA / 'shapes.png'), str(image))
+        except OSError:
+            shutil.copy(str(TESTDATA / 'shapes.png'), str(image))
+
+
+def without_boxes(paths, n_items):
+    "Returns the number of paths for which n_items returns zero"
+    return sum(1 for path in paths if not n_items(path))
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=100)
+    args = parser.parse_args(args)
+
+    methods = (
+        ('load', lambda p: InselectDocument.load(p).n_items),
+        ('load lazily', lambda p: InselectDocument.load(p, lazy=True).n_items),
+        ('load_header', lambda p: InselectDocument.load_header(p).n_items),
+    )
+    with tempfile.TemporaryDirectory() as tempdir:
+        tempdir = Path(tempdir)
+        write_documents(tempdir, args.documents, args.items)
+        paths = sorted(tempdir.glob('*' + InselectDocument.EXTENSION))
+        times = []
+        for name, n_items in methods:
+            start = time.perf_counter()
+            count = without_boxes(paths, n_items)
+            times.append(time.perf_counter() - start)
+            print('{0:<12} [{1}] of [{2}] without boxes in {3:.2f}s '
+                  '({4:.1f}x)'.format(name, count, len(paths), times[-1],
+                                      times[0] / times[-1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Compares coarse-to-fine segmentation with full-resolution segmentation.
+
+Reports the wall time of each and how well the boxes found by
+segment_edges_pyramid match those found by segment_edges. Run from the root
+of the repository:
+
+    python -m bin.benchmark_pyramid [image ...]
+
+If no images are given, the test images and a synthetic, sparsely populated
+drawer are used.
+"""
+import argparse
+import sys
+import time
+
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from inselect.lib.segment import segment_edges, segment_edges_pyramid
+from inselect.lib.segment_document import SEGMENTATION_PREFERRED_WIDTH
+
+from .benchmark_segmentation import match_boxes
+
+
+TESTDATA = Path(__file__).parent.parent / 'inselect' / 'tests' / 'test_data'
+
+def sparse_drawer(width=4096, height=4096):
+    """Returns a white image of width x height with a few copies of the shapes
+    test image
+    """
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    shapes = cv2.imread(str(TESTDATA / 'shapes.png'))
+    h, w = shapes.shape[:2]
+    for x, y in ((200, 300), (2500, 900), (1200, 3000)):
+        image[y:y + h, x:x + w] = shapes
+    return image
+
+
+def timed(fn, *args, **kwargs):
+    "Returns a tuple (boxes, elapsed seconds) of fn(*args, **kwargs)"
+    start = time.perf_counter()
+    rects, display = fn(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    return [tuple(int(round(v)) for v in r[:4]) for r in rects], elapsed
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('image', nargs='*', type=Path)
+    args = parser.parse_args(args)
+
+    if args.image:
+        images = [(p.name, cv2.imread(str(p))) for p in args.image]
+    else:
+        images = [(name, cv2.imread(str(TESTDATA / name)))
+                  for name in ('shapes.png', 'pinned.jpg', 'barcodes.jpg')]
+        images.append(('sparse drawer', sparse_drawer()))
+
+    for name, image in images:
+        height, width = image.shape[:2]
+        if width == SEGMENTATION_PREFERRED_WIDTH:
+            resize = False
+        else:
+            # As SegmentDocument.segment
+            factor = float(SEGMENTATION_PREFERRED_WIDTH) / width
+            resize = (int(height * factor), SEGMENTATION_PREFERRED_WIDTH)
+
+        full, full_elapsed = timed(segment_edges, image, resize=resize)
+        pyramid, pyramid_elapsed = timed(segment_edges_pyramid, image,
+                                         resize=resize)
+        precision, recall, mean_iou = match_boxes(full, pyramid)
+        print('{0}: full [{1}] boxes in {2:.2f}s, pyramid [{3}] boxes in '
+              '{4:.2f}s ({5:.1f}x); precision {6:.2f}, recall {7:.2f}'.format(
+                  name, len(full), full_elapsed, len(pyramid),
+                  pyramid_elapsed, full_elapsed / pyramid_elapsed, precision,
+                  recall
+              ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""Benchmarks the speed and accuracy of segmentation.
+
+Runs segmentation stages over a corpus of Inselect documents and reports,
+for each document and stage, the wall time, peak resident memory and the
+precision, recall and mean intersection over union (IoU) of the boxes found
+against the document's boxes. Run from the root of the repository:
+
+    python -m bin.benchmark_segmentation [--json results.json] [path ...]
+
+paths are Inselect documents or directories of them; the test documents are
+used if none are given. Each stage is run in a new process, so that peak
+memory use is that of the stage alone.
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import time
+
+from datetime import datetime
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import inselect
+
+from inselect.lib.document import InselectDocument
+from inselect.lib.rect import Rect, RectArray
+from inselect.lib.segment import (segment_edges, segment_grabcut,
+                                  segment_watershed)
+from inselect.lib.segment_document import SegmentDocument
+from inselect.lib.walk import find_files
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+TESTDATA = Path(__file__).parent.parent / 'inselect' / 'tests' / 'test_data'
+
+# Boxes are considered to match if their intersection over union is at least
+# this
+IOU_THRESHOLD = 0.5
+
+
+def match_boxes(expected, actual, threshold=IOU_THRESHOLD):
+    """Matches each box in actual to at most one box in expected, greedily by
+    IoU. Returns a tuple (precision, recall, mean IoU of matched boxes).
+    """
+    matrix = RectArray(expected).iou(actual)
+    rows, columns = np.nonzero(matrix >= threshold)
+    pairs = sorted(zip(matrix[rows, columns].tolist(), rows.tolist(),
+                       columns.tolist()), reverse=True)
+    matched_expected, matched_actual, ious = set(), set(), []
+    for value, i, j in pairs:
+        if i not in matched_expected and j not in matched_actual:
+            matched_expected.add(i)
+            matched_actual.add(j)
+            ious.append(value)
+    precision = len(ious) / len(actual) if actual else float(not expected)
+    recall = len(ious) / len(expected) if expected else float(not actual)
+    return precision, recall, (sum(ious) / len(ious) if ious else 0.0)
+
+
+def _preferred_resize(image):
+    "The resize argument to segment_edges used by SegmentDocument.segment"
+    from inselect.lib.segment_document import SEGMENTATION_PREFERRED_WIDTH
+
+    height, width = image.shape[:2]
+    if width == SEGMENTATION_PREFERRED_WIDTH:
+        return False
+    else:
+        factor = float(SEGMENTATION_PREFERRED_WIDTH) / width
+        return (int(height * factor), SEGMENTATION_PREFERRED_WIDTH)
+
+
+def _segment_edges(doc, image):
+    return segment_edges(image, resize=_preferred_resize(image))[0]
+
+
+def _segment_grabcut(doc, image):
+    return segment_grabcut(image)[0]
+
+
+def _segment_watershed(doc, image):
+    return segment_watershed(image)[0]
+
+
+def _segment_document(doc, image, **kwargs):
+    doc, display = SegmentDocument().segment(doc, **kwargs)
+    return [tuple(r) for r in doc.scanned.from_normalised(
+        [item['rect'] for item in doc.items]
+    )]
+
+
+def _segment_document_pyramid(doc, image):
+    return _segment_document(doc, image, pyramid=True)
+
+
+# Map from name to function (doc, image) that returns a list of boxes
+# (x, y, w, h) in pixels of the scanned image
+STAGES = {
+    'segment_edges': _segment_edges,
+    'segment_grabcut': _segment_grabcut,
+    'segment_watershed': _segment_watershed,
+    'segment_document': _segment_document,
+    'segment_document_pyramid': _segment_document_pyramid,
+}
+
+DEFAULT_STAGES = ('segment_edges', 'segment_grabcut', 'segment_watershed',
+                  'segment_document')
+
+
+def _max_rss_bytes():
+    "The peak resident set size of this process in bytes, or None"
+    if resource:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on Mac OS X
+        return maxrss if 'darwin' == sys.platform else 1024 * maxrss
+    else:
+        return None
+
+
+def run_stage(path, stage):
+    """Runs stage on the document at path. Returns a dict of results.
+    """
+    doc = InselectDocument.load(path)
+    image = doc.scanned.array
+    expected = [tuple(r) for r in doc.scanned.from_normalised(
+        [item['rect'] for item in doc.items]
+    )]
+    rss_before = _max_rss_bytes()
+
+    start = time.perf_counter()
+    actual = STAGES[stage](doc, image)
+    elapsed = time.perf_counter() - start
+
+    rss_after = _max_rss_bytes()
+    actual = [tuple(int(round(v)) for v in Rect(*r[:4])) for r in actual]
+    precision, recall, mean_iou = match_boxes(expected, actual)
+    return {
+        'document': str(path),
+        'stage': stage,
+        'image_shape': list(image.shape),
+        'seconds': elapsed,
+        'peak_rss_bytes': rss_after,
+        'stage_rss_bytes': (rss_after - rss_before) if resource else None,
+        'n_expected': len(expected),
+        'n_found': len(actual),
+        'precision': precision,
+        'recall': recall,
+        'mean_iou': mean_iou,
+    }
+
+
+def _run_stage(args):
+    return run_stage(*args)
+
+
+def benchmark(paths, stages, in_process=False):
+    """Generator of dicts of results of running each of stages on each of the
+    Inselect documents in paths
+    """
+    jobs = [(path, stage) for path in paths for stage in stages]
+    if in_process:
+        for job in jobs:
+            yield run_stage(*job)
+    else:
+        # A new process for each job so that peak memory is that of the job
+        with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+            for result in pool.imap(_run_stage, jobs):
+                yield result
+
+
+def _documents(paths):
+    "Generator of paths of Inselect documents in paths"
+    for path in paths:
+        if path.is_dir():
+            pattern = '*' + InselectDocument.EXTENSION
+            yield from sorted(find_files(path, [pattern], recursive=True))
+        else:
+            yield path
+
+
+def _mb(value):
+    return '{0:.0f}'.format(value / 1024 ** 2) if value is not None else '-'
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', nargs='*', type=Path,
+                        help='Inselect documents or directories of them')
+    parser.add_argument(
+        '-s', '--stages', default=','.join(DEFAULT_STAGES),
+        help='Comma-separated stages to run, from {0}; defaults to '
+        '{1}'.format(','.join(sorted(STAGES)), ','.join(DEFAULT_STAGES))
+    )
+    parser.add_argument('--json', type=Path,
+                        help='Write results to this JSON file')
+    parser.add_argument('--in-process', action='store_true',
+                        help='Run stages in this process; peak memory is '
+                        'then cumulative')
+    args = parser.parse_args(args)
+
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    unknown = set(stages).difference(STAGES)
+    if unknown:
+        parser.error('Unknown stages [{0}]'.format(', '.join(sorted(unknown))))
+
+    paths = list(_documents(args.path or [TESTDATA]))
+
+    print('{0:<24}{1:<26}{2:>9}{3:>9}{4:>9}{5:>6}{6:>6}{7:>6}'.format(
+        'document', 'stage', 'seconds', 'peak MB', 'stage MB', 'P', 'R',
+        'IoU'
+    ))
+    results = []
+    for result in benchmark(paths, stages, args.in_process):
+        results.append(result)
+        print('{0:<24}{1:<26}{2:>9.2f}{3:>9}{4:>9}{5:>6.2f}{6:>6.2f}'
+              '{7:>6.2f}'.format(
+                  Path(result['document']).name, result['stage'],
+                  result['seconds'], _mb(result['peak_rss_bytes']),
+                  _mb(result['stage_rss_bytes']), result['precision'],
+                  result['recall'], result['mean_iou']
+              ))
+
+    if args.json:
+        with args.json.open('w', encoding='utf8') as outfile:
+            json.dump({
+                'inselect_version': inselect.__version__,
+                'opencv_version': cv2.__version__,
+                'numpy_version': np.__version__,
+                'python_version': platform.python_version(),
+                'platform': platform.platform(),
+                'run_on': datetime.utcnow().isoformat(),
+                'results': results,
+            }, outfile, indent=4)
+        print('Wrote [{0}]'.format(args.json))
+
+
+if __name__ == '__main__':
+    main()
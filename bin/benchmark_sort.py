@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Benchmarks the sorting of boxes by sort_document_items.
+
+Reports the time taken to import and make the first call in a new process,
+and the time taken to sort between 10 and 5,000 boxes. If scikit-learn and
+SciPy are installed, the previous implementation, which used their kernel
+density estimation, is also timed and its order is checked against that of
+sort_document_items. Run from the root of the repository:
+
+    python -m bin.benchmark_sort
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+from importlib.util import find_spec
+
+import numpy as np
+
+from inselect.lib.rect import Rect
+from inselect.lib.sort_document_items import sort_document_items
+
+
+COUNTS = (10, 100, 1000, 5000)
+
+COLD_START = """
+import time
+start = time.perf_counter()
+from inselect.lib.rect import Rect
+from {0} import {1} as sort
+sort([{{'rect': Rect(0.1, 0.1, 0.1, 0.1)}},
+      {{'rect': Rect(0.5, 0.5, 0.1, 0.1)}}], False)
+print(time.perf_counter() - start)
+"""
+
+
+def _sklearn_do_kde(values):
+    "The previous implementation of _do_kde, which used scikit-learn"
+    from scipy.signal import argrelmin
+    from sklearn.neighbors import KernelDensity
+
+    RESCALE = 100
+    values = np.array([int(v * RESCALE) for v in values]).reshape(-1, 1)
+    kde = KernelDensity().fit(values)
+    samples = np.linspace(0, RESCALE)
+    evaluations = kde.score_samples(samples.reshape(-1, 1))
+    minima = argrelmin(evaluations)
+    bins = np.append(samples[minima], RESCALE)
+    return np.digitize(values.reshape(len(values)), bins, right=True)
+
+
+def sklearn_sort_document_items(items, by_columns):
+    "The previous implementation of sort_document_items"
+    rects = [i['rect'] for i in items]
+    x_bins = _sklearn_do_kde(r.x_centre for r in rects)
+    y_bins = _sklearn_do_kde(r.y_centre for r in rects)
+    if by_columns:
+        keys = zip(x_bins, y_bins, (r.left for r in rects))
+    else:
+        keys = zip(y_bins, x_bins, (r.left for r in rects))
+    return [item for item, key in sorted(zip(items, keys),
+                                         key=lambda v: v[1])]
+
+
+def sklearn_available():
+    "Returns True if scikit-learn and SciPy are installed"
+    return all(find_spec(name) for name in ('scipy', 'sklearn'))
+
+
+def drawer_items(n, seed=0):
+    """Returns a list of n items with boxes in a jittered grid, as in a drawer
+    of specimens
+    """
+    rng = np.random.RandomState(seed)
+    side = int(np.ceil(np.sqrt(n)))
+    size = 0.8 / side
+    cells = rng.permutation(side * side)[:n]
+    x = (cells % side) / side + rng.normal(0, size / 20, n)
+    y = (cells // side) / side + rng.normal(0, size / 20, n)
+    return [{'rect': Rect(float(left), float(top), size, size), 'id': index}
+            for index, (left, top) in enumerate(zip(np.clip(x, 0, 1 - size),
+                                                    np.clip(y, 0, 1 - size)))]
+
+
+def cold_start(module, function, repeats):
+    """Returns the best time in seconds to import function from module and
+    sort two boxes with it in a new process
+    """
+    times = []
+    for _ in range(repeats):
+        output = subprocess.check_output(
+            [sys.executable, '-c', COLD_START.format(module, function)]
+        )
+        times.append(float(output))
+    return min(times)
+
+
+def timed(fn, repeats, *args):
+    "Returns a tuple (best time in seconds, result) of repeats calls to fn"
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--repeats', type=int, default=5)
+    args = parser.parse_args(args)
+
+    reference = sklearn_available()
+    print('Import and first sort in a new process: {0:.3f}s'.format(
+        cold_start('inselect.lib.sort_document_items', 'sort_document_items',
+                   args.repeats)
+    ))
+    if reference:
+        print('    scikit-learn: {0:.3f}s'.format(
+            cold_start('bin.benchmark_sort', 'sklearn_sort_document_items',
+                       args.repeats)
+        ))
+
+    for n in COUNTS:
+        items = drawer_items(n)
+        for by_columns in (False, True):
+            elapsed, result = timed(sort_document_items, args.repeats, items,
+                                    by_columns)
+            msg = '[{0}] boxes by {1}: {2:.4f}s'.format(
+                n, 'columns' if by_columns else 'rows', elapsed
+            )
+            if reference:
+                sklearn_elapsed, expected = timed(
+                    sklearn_sort_document_items, args.repeats, items,
+                    by_columns
+                )
+                same = [i['id'] for i in expected] == [i['id'] for i in result]
+                msg += ', scikit-learn: {0:.4f}s ({1:.0f}x), {2}'.format(
+                    sklearn_elapsed, sklearn_elapsed / elapsed,
+                    'same order' if same else 'DIFFERENT ORDER'
+                )
+            print(msg)
+
+
+if __name__ == '__main__':
+    main()
@@ -24,7 +24,7 @@ python -c "from gouda.engines import LibDMTXEngine; assert LibDMTXEngine.availab
 echo Report startup time and check for non-essential binary imports
 mkdir build
 time python -v -m inselect.scripts.inselect --quit &> build/startup_log
-for module in cv2 numpy libdmtx scipy sklearn zbar; do
+for module in cv2 numpy libdmtx zbar; do
     if grep -q $module build/startup_log; then
         echo Non-essential binary $module imported on startup
         exit 1
@@ -78,13 +78,8 @@ if [[ "$OSTYPE" == "darwin"* ]]; then
     pyinstaller --onefile --exclude-module cv2 --exclude-module numpy \
         $EXCLUDE_CMD_LINE inselect/scripts/export_metadata.py
 
-    pyinstaller --onefile $EXCLUDE_CMD_LINE \
-        --hidden-import sklearn.neighbors.typedefs \
-        --hidden-import sklearn.neighbors.dist_metrics \
-        inselect/scripts/segment.py
-
     # Other scripts
-    for script in ingest save_crops; do
+    for script in ingest pipeline prune_pixel_cache save_crops segment; do
         rm -rf $script.spec
         pyinstaller --onefile $EXCLUDE_CMD_LINE inselect/scripts/$script.py
     done
@@ -22,7 +22,7 @@ a = Analysis(
     datas=[
         ('inselect/gui/inselect.qss', ''),
     ],
-    hiddenimports=['sklearn.neighbors.typedefs'],
+    hiddenimports=[],
     hookspath=[],
     runtime_hooks=[],
     excludes=os.getenv('EXCLUDE_MODULES', '').split(' '),
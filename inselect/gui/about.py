@@ -23,8 +23,6 @@ def _environment():
     """
     import cv2
     import numpy as np
-    import scipy
-    import sklearn
 
     # Bit depth of interpreter
     python_bit_depth = platform.architecture()[0]
@@ -42,8 +40,6 @@ def _environment():
         ('OpenCV', cv2.__version__),
         ('PyQt5', QtCore.PYQT_VERSION_STR),
         ('Qt',  QtCore.qVersion()),
-        ('scikit-learn', sklearn.__version__),
-        ('SciPy', scipy.__version__),
     ]
 
     return '\n'.join(['{0} {1}<br/>'.format(i, v) for i, v in versions])
@@ -534,8 +534,10 @@ class MainWindow(QMainWindow):
             )
 
     def run_save_crops(self, export, progress):
-        progress('Loading full-resolution scanned image')
-        self.document.scanned.array
+        if self.document.scanned.mapped is None:
+            # Crops cannot be read directly from the file
+            progress('Loading full-resolution scanned image')
+            self.document.scanned.array
 
         progress('Saving crops')
         export.save_crops(self.document, progress)
@@ -38,9 +38,10 @@ class SegmentPlugin(Plugin):
 
     def __call__(self, progress):
         debug_print('SegmentPlugin.__call__')
-        doc, display = SegmentDocument(self.sort_choice).segment(
-            self.document, callback=progress
-        )
+        # Edge maps are kept for subsequent subsegmentation
+        doc, display = SegmentDocument(
+            self.sort_choice, cache_edge_maps=True
+        ).segment(self.document, callback=progress)
 
         self.items, self.display = doc.items, display
 
@@ -2,6 +2,7 @@ import traceback
 
 from PyQt5 import QtCore
 
+from inselect.lib.profiling import Profile
 from inselect.lib.utils import debug_print
 
 from .progress_dialog import ProgressDialog
@@ -13,7 +14,9 @@ class OperationCancelledError(Exception):
 
 class WorkerThread(QtCore.QThread):
     """Runs a callable in its own thread and shows a progress box to the user
-    while the callable runs.
+    while the callable runs. The callable is given an instance of Profile
+    that wraps progress(); the stages that it times are available in
+    self.profile.
     """
 
     # Emitted when the operation has either finished or been cancelled, and
@@ -36,6 +39,9 @@ class WorkerThread(QtCore.QThread):
         # The current message
         self._message = None
 
+        # Spans timed by the operation
+        self.profile = Profile(self.progress)
+
         # A progress box to show feedback while the operation runs and to allow
         # the user to cancel.
         self._progress_box = ProgressDialog(parent)
@@ -61,11 +67,13 @@ class WorkerThread(QtCore.QThread):
     def run(self):
         try:
             debug_print('WorkerThread.run enter')
-            self._operation(self.progress)
+            self._operation(self.profile)
 
             # Call progress in order to catch pending cancel request
             self.progress()
 
+            if self.profile.events:
+                debug_print(self.profile.summary())
             self.completed.emit(False, '')
             debug_print('WorkerThread.run exit')
         except OperationCancelledError:
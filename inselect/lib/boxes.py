@@ -0,0 +1,58 @@
+from types import MappingProxyType
+
+from .inselect_error import InselectError
+from .rect import Rect, RectArray
+
+# Warning: lazy load of numpy via local imports
+
+
+class Boxes(object):
+    """The boxes of a document in columns: rects, an array of shape (n, 4) of
+    normalised (left, top, width, height), rotation, an array of n ints, and
+    fields, a tuple of n read-only dicts. The arrays are read-only.
+    """
+    def __init__(self, rects, rotation, fields):
+        import numpy as np
+
+        rects = np.array(rects, dtype=np.float64).reshape(-1, 4)
+        rotation = np.array(rotation, dtype=np.int64).reshape(-1)
+        fields = tuple(MappingProxyType(f) for f in fields)
+        if not len(rects) == len(rotation) == len(fields):
+            msg = ('Lengths of rects [{0}], rotation [{1}] and fields [{2}] '
+                   'differ')
+            raise InselectError(msg.format(len(rects), len(rotation),
+                                           len(fields)))
+        else:
+            rects.flags.writeable = rotation.flags.writeable = False
+            self.rects, self.rotation, self.fields = rects, rotation, fields
+
+    @classmethod
+    def from_items(cls, items):
+        "Returns a new instance of Boxes of the list of dicts of items"
+        return cls([tuple(i['rect']) for i in items],
+                   [i.get('rotation', 0) for i in items],
+                   [i.get('fields', {}) for i in items])
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __repr__(self):
+        return 'Boxes [{0}]'.format(len(self))
+
+    @property
+    def coordinates(self):
+        "An array of shape (n, 4) of normalised (left, top, right, bottom)"
+        return RectArray(self.rects).coordinates
+
+    @property
+    def nbytes(self):
+        "The number of bytes of the rects and rotation arrays"
+        return self.rects.nbytes + self.rotation.nbytes
+
+    def items(self):
+        "Returns a list of dicts of items"
+        return [{'rect': Rect(*rect), 'rotation': rotation,
+                 'fields': dict(fields)}
+                for rect, rotation, fields in zip(self.rects.tolist(),
+                                                  self.rotation.tolist(),
+                                                  self.fields)]
@@ -2,12 +2,17 @@ import json
 import pytz
 import re
 
+from collections import namedtuple
 from copy import deepcopy
 from datetime import datetime
+from functools import partial
 from itertools import chain
+from operator import itemgetter
 from pathlib import Path
+from types import MappingProxyType
 
-from .image import InselectImage
+from .boxes import Boxes
+from .image import ImageInfo, InselectImage
 from .inselect_error import InselectError
 from .utils import debug_print, user_name
 from .rect import Rect
@@ -15,6 +20,16 @@ from .rect import Rect
 # Warning: lazy load of cv2 via local imports
 
 
+# What can be learned about a document without parsing its items or
+# examining its images. images is a dict {'scanned': ImageInfo,
+# 'thumbnail': ImageInfo} of the images as they were when the document was
+# saved.
+DocumentHeader = namedtuple(
+    'DocumentHeader',
+    ['path', 'version', 'scanned_path', 'n_items', 'properties', 'images']
+)
+
+
 class InselectDocument(object):
     """An Inselect document.
 
@@ -41,14 +56,31 @@ class InselectDocument(object):
     THUMBNAIL_MAX_WIDTH = 16384
     THUMBNAIL_DEFAULT_WIDTH = 4096
     THUMBNAIL_SUFFIX = '_thumbnail.jpg'
+    EDGE_MAPS_SUFFIX = '_edges.npz'
 
     # Matches filenames that are thumbnail images
     LOOKS_LIKE_THUMBNAIL = re.compile('.+{0}'.format(THUMBNAIL_SUFFIX))
 
+    # save() writes members of the document in order of name, one per line,
+    # indented by four spaces, and items indented by eight spaces, with '\n'
+    # line endings. Strings cannot contain newlines, so these match only the
+    # starts of members and of items.
+    _MEMBER = re.compile(rb'^ {4}"([^"\n]+)": ', re.MULTILINE)
+    _MEMBER_START = '\n    "{0}": '
+    # Between consecutive items. Searching for this is faster than searching
+    # for the start of each item, which is mostly spaces.
+    _BETWEEN_ITEMS = b'\n        },\n        {'
+    # Members other than items, in order
+    _MEMBERS = ('images', 'inselect version', 'properties',
+                'scanned extension')
+
     # Format for serializing datetime objects.
     # Conforms to http://www.ietf.org/rfc/rfc3339.txt
     DT_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 
+    # Datetimes as written by _format_datetime
+    _DT = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)Z\Z')
+
     @classmethod
     def _format_datetime(cls, v):
         """Returns string representation of v
@@ -59,20 +91,29 @@ class InselectDocument(object):
     def _parse_datetime(cls, v):
         """Returns datetime of v
         """
-        return datetime.strptime(v, cls.DT_FORMAT).replace(tzinfo=pytz.timezone("UTC"))
+        # Much faster than strptime
+        match = cls._DT.match(v)
+        if match:
+            dt = datetime(*map(int, match.groups()))
+        else:
+            dt = datetime.strptime(v, cls.DT_FORMAT)
+        return dt.replace(tzinfo=pytz.timezone("UTC"))
 
     # TODO LH __eq__, __ne__?
     # TODO LH Store Rect instances within items
     # TODO LH Validate rotation?
 
     def __init__(self, scanned=None, scanned_path=None, thumbnail=None,
-                 items=None, properties=None):
+                 items=None, properties=None, images=None):
         """Scanned - InselectImage or None
         scanned_path - Path or None
         thumbnail - InselectImage or None
         items - list of dicts
         properties - dict
+        images - dict {'scanned': ImageInfo, 'thumbnail': ImageInfo} of
+        images that are not given as instances of InselectImage
         """
+        images = images if images else {}
         items = self._preprocess_items(items if items else [])
 
         # TODO Validate metadata fields
@@ -85,7 +126,8 @@ class InselectDocument(object):
             else:
                 self._scanned = scanned
         elif scanned_path:
-            self._scanned = InselectImage(scanned_path)
+            self._scanned = InselectImage(scanned_path,
+                                          info=images.get('scanned'))
         else:
             raise InselectError('Either scanned or scanned_path should be given')
 
@@ -96,12 +138,14 @@ class InselectDocument(object):
                 self._thumbnail = thumbnail
         else:
             self._thumbnail = InselectImage(
-                self.thumbnail_path_of_scanned(self._scanned.path)
+                self.thumbnail_path_of_scanned(self._scanned.path),
+                info=images.get('thumbnail')
             )
 
         # Need either thumbnail or scanned
         if self._scanned.available or self._thumbnail.available:
             self._items = items
+            self._items_view = self._boxes = None
             self._properties = properties if properties else {}
         else:
             raise InselectError('Either scanned and/or thumbnail should be given')
@@ -131,7 +175,7 @@ class InselectDocument(object):
 
     def __repr__(self):
         s = "InselectDocument ['{0}'] [{1} items]"
-        return s.format(str(self._scanned.path), len(self._items))
+        return s.format(str(self._scanned.path), self.n_items)
 
     @property
     def scanned(self):
@@ -149,14 +193,68 @@ class InselectDocument(object):
     def crops_dir(self):
         return self._scanned.path.parent / (self._scanned.path.stem + '_crops')
 
+    @property
+    def edge_maps_path(self):
+        "The path of the edge maps written by SegmentDocument"
+        return self._scanned.path.parent / '{0}{1}'.format(
+            self._scanned.path.stem, self.EDGE_MAPS_SUFFIX
+        )
+
     @property
     def items(self):
         "Returns a list of dicts of items"
         return deepcopy(self._items)
 
+    @property
+    def items_view(self):
+        """A tuple of read-only mappings of items, for code that reads but
+        does not alter items. Each item's fields are also read-only. Cheaper
+        than items, which copies every item on every access.
+        """
+        # self._items is replaced, never altered, by set_items so the view
+        # can be built once and shared
+        if self._items_view is None:
+            self._items_view = tuple(
+                MappingProxyType(dict(i, fields=MappingProxyType(i['fields'])))
+                for i in self._items
+            )
+        return self._items_view
+
+    @property
+    def boxes(self):
+        """An instance of Boxes - the rects, rotations and fields of items in
+        columns, for vectorised operations on all boxes
+        """
+        if self._boxes is None:
+            self._boxes = Boxes.from_items(self._items)
+        return self._boxes
+
     @property
     def n_items(self):
-        return len(self._items)
+        if self._read_items:
+            # Not yet read
+            return self._n_unread_items
+        else:
+            return len(self._items)
+
+    @property
+    def _items(self):
+        # The items of documents loaded lazily are read when first needed
+        if self._read_items:
+            read_items, self._read_items = self._read_items, None
+            self._item_list = self._preprocess_items(read_items())
+            debug_print('Read [{0}] items'.format(len(self._item_list)))
+        return self._item_list
+
+    @_items.setter
+    def _items(self, items):
+        self._read_items = None
+        self._item_list = items
+
+    def _defer_items(self, read_items, n_items):
+        # Items will be the list returned by the function read_items
+        self._read_items, self._n_unread_items = read_items, n_items
+        self._items_view = self._boxes = None
 
     @property
     def properties(self):
@@ -167,6 +265,7 @@ class InselectDocument(object):
         items = deepcopy(items)
         items = self._preprocess_items(items)
         self._items = items
+        self._items_view = self._boxes = None
 
     def _preprocess_items(self, items):
         # Returns items with tuples of boxes replaced with Rect instances and
@@ -209,23 +308,72 @@ class InselectDocument(object):
                 raise InselectError(msg.format(doc.document_path))
             else:
                 doc._create_and_load_thumbnail(thumbnail_width_pixels)
+                # The scan has just been read to create the thumbnail, so is
+                # likely to be cached - record digests now so that later
+                # changes to the images can be detected by verify
+                doc._scanned.verify()
+                doc._thumbnail.verify()
                 doc.save()
                 return doc
 
     @classmethod
-    def load(cls, path):
-        "Returns a new InselectDocument"
+    def load(cls, path, lazy=False):
+        """Returns a new InselectDocument. If lazy is True, items are read
+        when they are first needed, so documents can be loaded cheaply to
+        inspect their properties or n_items.
+        """
         debug_print('Loading from [{0}]'.format(path))
 
+        header, read_items = cls._read(path)
+        if lazy:
+            doc = cls(scanned_path=header.scanned_path,
+                      properties=header.properties, images=header.images)
+            doc._defer_items(read_items, header.n_items)
+        else:
+            items = read_items()
+            msg = 'Loaded [{0}] items from [{1}]'
+            debug_print(msg.format(len(items), path))
+            doc = cls(scanned_path=header.scanned_path, items=items,
+                      properties=header.properties, images=header.images)
+        return doc
+
+    @classmethod
+    def load_header(cls, path):
+        """Returns a DocumentHeader of the document at path. Does not examine
+        the document's images and, if the document was written by save, does
+        not parse its items.
+        """
+        return cls._read(path)[0]
+
+    @classmethod
+    def _read(cls, path):
+        """Returns a tuple (DocumentHeader, items) for the document at path.
+        items is a function that returns the list of items.
+        """
         path = Path(path)
 
-        # Sniff the first few bytes - file must look like a json document
         with path.open('rb') as infile:
-            if not re.match(b'^{[ (\n)|(\r\n)]*"', infile.read(20)):
-                raise InselectError('Not an inselect document')
+            data = infile.read()
 
-        with path.open(encoding='utf8') as infile:
-            doc = json.load(infile)
+        # Sniff the first few bytes - file must look like a json document
+        if not re.match(b'^{[ (\n)|(\r\n)]*"', data[:20]):
+            raise InselectError('Not an inselect document')
+
+        members = cls._members(data)
+        if members:
+            # Parse all members other than items
+            members, items = members
+            doc = {k: json.loads(v) for k, v in members.items()}
+            if data.find(b'{', items.start, items.stop) < 0:
+                n_items = 0
+            else:
+                n_items = 1 + data.count(cls._BETWEEN_ITEMS, items.start,
+                                         items.stop)
+            items = partial(json.loads, data[items])
+        else:
+            doc = json.loads(data.decode('utf8'))
+            n_items = len(doc.get('items', []))
+            items = partial(itemgetter('items'), doc)
 
         v = doc.get('inselect version')
 
@@ -235,17 +383,7 @@ class InselectDocument(object):
             raise InselectError('Unsupported version [{0}]'.format(v))
         else:
             if 1 == v:
-                # Version 1 contained just three illustrative fields -
-                # convert these to Darwin Core fields
-                for item in doc['items']:
-                    fields = item['fields']
-                    if fields.get('Taxonomic group'):
-                        fields['scientificName'] = fields.pop('Taxonomic group')
-                    if fields.get('Location'):
-                        fields['otherCatalogNumbers'] = fields.pop('Location')
-                    if fields.get('Specimen number'):
-                        fields['catalogNumber'] = fields.pop('Specimen number')
-                    item['fields'] = fields
+                items = partial(cls._convert_version_1_items, items)
 
             scanned = path.with_suffix(doc['scanned extension'])
 
@@ -255,11 +393,96 @@ class InselectDocument(object):
             for dt in {'Saved on', 'Created on'}.intersection(properties.keys()):
                 properties[dt] = cls._parse_datetime(properties[dt])
 
-            msg = 'Loaded [{0}] items from [{1}]'
-            debug_print(msg.format(len(doc['items']), path))
+            images = cls._images(doc.get('images', {}))
+
+            header = DocumentHeader(path, v, scanned, n_items, properties,
+                                    images)
+            return header, items
 
-            return cls(scanned_path=scanned, items=doc['items'],
-                       properties=properties)
+    @classmethod
+    def _images(cls, images):
+        """Returns a dict {name: ImageInfo} of the dict images, as written by
+        save. Invalid values are ignored.
+        """
+        result = {}
+        for name in ('scanned', 'thumbnail'):
+            if name in images:
+                try:
+                    result[name] = ImageInfo(**images[name])
+                except TypeError:
+                    debug_print('Ignoring invalid info for [{0}]'.format(name))
+        return result
+
+    @classmethod
+    def _convert_version_1_items(cls, read_items):
+        "Returns the list of items returned by read_items, converted"
+        # Version 1 contained just three illustrative fields - convert these
+        # to Darwin Core fields
+        items = read_items()
+        for item in items:
+            fields = item['fields']
+            if fields.get('Taxonomic group'):
+                fields['scientificName'] = fields.pop('Taxonomic group')
+            if fields.get('Location'):
+                fields['otherCatalogNumbers'] = fields.pop('Location')
+            if fields.get('Specimen number'):
+                fields['catalogNumber'] = fields.pop('Specimen number')
+            item['fields'] = fields
+        return items
+
+    @classmethod
+    def _members(cls, data):
+        """Returns a tuple (members, items) if the bytes data are laid out as
+        save writes documents, otherwise None. members is a dict
+        {name: UTF-8 JSON of value} of the members other than items. items is
+        the slice of data that is the JSON array of items.
+        """
+        def member_start(name):
+            return cls._MEMBER_START.format(name).encode('utf8')
+
+        # Other line endings, e.g. '\r\n' from a checkout that converts line
+        # endings, would not be matched by _BETWEEN_ITEMS, giving the wrong
+        # number of items. Strings cannot contain a literal '\r', so any '\r'
+        # is a line ending.
+        if b'\r' in data:
+            return None
+
+        # Items, which make up most of the data, are found by searching from
+        # either end of the data and are not copied. Only the data either
+        # side of them is examined line by line.
+        data = data.rstrip()
+        head = data.find(member_start('items'))
+        tail = min((t for t in (data.rfind(member_start(name), max(head, 0))
+                                for name in cls._MEMBERS if name > 'items')
+                    if t > head),
+                   default=-1)
+        if head < 0 or tail < 0 or not data.endswith(b'}'):
+            return None
+
+        start, end = head + len(member_start('items')), tail
+        while end > start and data[end - 1] in b' \t\r\n,':
+            end -= 1
+        if not (data.startswith(b'[', start) and
+                data.endswith(b']', start, end)):
+            return None
+
+        members = {}
+        for before, other in ((b'{', data[:1 + head]),
+                              (b'', data[1 + tail:-1])):
+            matches = list(cls._MEMBER.finditer(other))
+            if not matches or before != other[:matches[0].start()].strip():
+                return None
+            ends = [m.start() for m in matches[1:]] + [len(other)]
+            for m, e in zip(matches, ends):
+                name = m.group(1).decode('utf8')
+                if name in members or name not in cls._MEMBERS:
+                    return None
+                members[name] = other[m.end():e].rstrip().rstrip(b',')
+
+        if {'inselect version', 'scanned extension'}.issubset(members):
+            return members, slice(start, end)
+        else:
+            return None
 
     def save(self):
         "Saves to self.document_path"
@@ -280,11 +503,22 @@ class InselectDocument(object):
         for dt in {'Saved on', 'Created on'}.intersection(properties.keys()):
             properties[dt] = self._format_datetime(properties[dt])
 
+        # Record the images so that they need not be opened to learn their
+        # dimensions. Their contents are not read - SHA-256 digests are
+        # those computed by InselectImage.verify, when the document was
+        # created, or None.
+        images = {
+            name: image.info._asdict() for name, image in
+            (('scanned', self._scanned), ('thumbnail', self._thumbnail))
+            if image.available
+        }
+
         doc = {
             'inselect version': self.FILE_VERSIONS[-1],
             'scanned extension': self._scanned.path.suffix,
             'items': items,
             'properties': properties,
+            'images': images,
         }
 
         # Tips from SO about reading and writing utf-8 encoded files with sorted
@@ -301,14 +535,13 @@ class InselectDocument(object):
     @property
     def crops(self):
         "Iterate over cropped object image arrays"
-        return self._scanned.crops((i['rect'] for i in self._items),
-                                   (i.get('rotation', 0) for i in self._items))
+        return self._scanned.crops(self.boxes.rects,
+                                   self.boxes.rotation.tolist())
 
     def save_crops_from_image(self, image, crop_paths, progress=None):
         "Saves images cropped from image to dir. dir must exist."
-        boxes = (i['rect'] for i in self._items)
-        rotation = (i.get('rotation', 0) for i in self._items)
-        image.save_crops(boxes, crop_paths, rotation, progress)
+        image.save_crops(self.boxes.rects, crop_paths,
+                         self.boxes.rotation.tolist(), progress)
 
     def _create_and_load_thumbnail(self, width):
         "Create thumbnail image"
@@ -320,10 +553,14 @@ class InselectDocument(object):
         msg = 'Creating [{0}] with width of [{1}] pixels'
         debug_print(msg.format(p, width))
 
-        img = self._scanned.array
+        # Decode no more pixels than are needed
+        img = self._scanned.reduced(width)
         factor = float(width) / img.shape[1]
         debug_print('Resizing to [{0}] pixels wide'.format(width))
-        thumbnail = cv2.resize(img, (0, 0), fx=factor, fy=factor)
+        # Area interpolation gives the best results when shrinking
+        interpolation = cv2.INTER_AREA if factor < 1 else cv2.INTER_LINEAR
+        thumbnail = cv2.resize(img, (0, 0), fx=factor, fy=factor,
+                               interpolation=interpolation)
         debug_print('Writing to [{0}]'.format(p))
         # TODO Copy EXIF tags?
         res = cv2.imwrite(str(p), thumbnail)
@@ -331,8 +568,8 @@ class InselectDocument(object):
             msg = 'Unable to write thumbnail [{0}]'
             raise InselectError(msg.format(p))
 
-        # Load it
-        self._thumbnail = InselectImage(p)
+        # Retain the array, rather than reading the file that was just written
+        self._thumbnail = InselectImage(p, thumbnail)
 
     @property
     def metadata_fields(self):
@@ -25,7 +25,7 @@ class DocumentExport(object):
         """
         fnames = (
             self._template.format_label(1 + index, box['fields'])
-            for index, box in enumerate(document.items)
+            for index, box in enumerate(document.items_view)
         )
 
         # Set of fnames that have been yielded
@@ -1,27 +1,84 @@
+import hashlib
+import os
 import warnings
 
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from itertools import count, chain, repeat
 from pathlib import Path
 
 from PIL import Image
 
+from inselect.lib import pixel_cache
 from inselect.lib.inselect_error import InselectError
 from inselect.lib.utils import debug_print
-from inselect.lib.rect import Rect
+from inselect.lib.rect import Rect, RectArray
 
 # Warning: lazy load of cv2 and numpy via local imports
 
 
+# Map from PIL raw mode of uncompressed pixels to a tuple (number of channels,
+# slice that puts channels in order B G R)
+_MAPPABLE_RAW_MODES = {
+    'BGR': (3, slice(None)),
+    'RGB': (3, slice(None, None, -1)),
+    'L': (1, slice(None)),
+}
+
+# TIFF orientation tag
+_TIFF_ORIENTATION = 274
+
+
+def _contiguous_rows(tile, width, height, row_bytes):
+    """True if the PIL tile list describes full-width strips of rows, each of
+    the same raw layout, that are in order and follow each other in the file
+    with no gaps, so that all rows can be mapped as one array. This is the
+    case for single-strip images and for most multi-strip uncompressed TIFFs.
+    """
+    decoder, extents, offset, args = tile[0]
+    if 1 < len(tile) and 1 != args[2]:
+        # Bottom-up rows in more than one strip
+        return False
+    top = 0
+    for t_decoder, t_extents, t_offset, t_args in tile:
+        left, t_top, right, bottom = t_extents
+        if (decoder != t_decoder or args != t_args or
+                (0, width, top) != (left, right, t_top) or
+                offset + top * row_bytes != t_offset):
+            return False
+        top = bottom
+    return height == top
+
+# The dimensions, size, modification time and SHA-256 hex digest of an image
+# file, as recorded in Inselect documents. The digest is None if it has not
+# been computed by InselectImage.verify.
+ImageInfo = namedtuple('ImageInfo',
+                       ['width', 'height', 'size_bytes', 'mtime', 'sha256'])
+
+
 class InselectImage(object):
     """Simple representation of an inselect image
     """
 
     # TODO LH __eq__, __ne__?
 
-    def __init__(self, path):
+    def __init__(self, path, array=None, info=None):
+        """path - the image file
+        array - None or np.array of the pixels in path, if they are already
+        in memory. self.array is a read-only view of it; array itself is not
+        altered.
+        info - None or an ImageInfo of path, as previously recorded
+        """
         # path might not be a valid file at this point
         self._path = Path(path)
-        self._array = None
+        if array is not None:
+            array = array.view()
+            array.flags.writeable = False
+        self._array = array
+        # None if not yet examined, False if the file cannot be memory-mapped
+        self._mapped = None
+        self._info = info
 
     def __repr__(self):
         return "InselectImage('{0}')".format(str(self._path))
@@ -50,21 +107,104 @@ class InselectImage(object):
 
     @property
     def array(self):
-        """Lazy-load np.array of the colour image array, with channels stored in
-        order B G R
+        """Lazy-load read-only np.array of the colour image array, with
+        channels stored in order B G R. The array is read-only whether it was
+        given to the constructor, decoded from the file or, if the pixel cache
+        is enabled, loaded from the cache; callers that alter pixels should
+        take a copy.
         """
         import cv2
+        import numpy as np
+
         if self._array is None:
             self.assert_is_file()
-            p = str(self._path)
-            debug_print('Reading from image file [{0}]'.format(p))
-            image = cv2.imread(p)
+            cache = pixel_cache.default_cache()
+            image = cache.get(self._path) if cache else None
             if image is None:
-                raise InselectError('[{0}] could not be read as an image'.format(p))
+                p = str(self._path)
+                debug_print('Reading from image file [{0}]'.format(p))
+                image = cv2.imread(p)
+                if image is None:
+                    raise InselectError('[{0}] could not be read as an image'.format(p))
+                elif cache:
+                    cache.put(self._path, image)
             else:
-                self._array = image
+                # A plain array backed by the cache's memory map
+                image = image.view(np.ndarray)
+            image.flags.writeable = False
+            self._array = image
         return self._array
 
+    def reduced(self, min_width):
+        """Returns np.array of the colour image array, with channels stored in
+        order B G R, decoded at the smallest of 1/8, 1/4 or 1/2 scale that is
+        at least min_width pixels wide, or at full scale. JPEG files are
+        decoded at reduced scale without decoding at full scale, which is much
+        faster. The returned array is not retained.
+        """
+        import cv2
+
+        if self._array is not None:
+            return self._array
+
+        self.assert_is_file()
+        width = self.dimensions[0]
+        flags = ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                 (4, cv2.IMREAD_REDUCED_COLOR_4),
+                 (2, cv2.IMREAD_REDUCED_COLOR_2))
+        scale, flag = next(
+            ((s, f) for s, f in flags if width // s >= min_width), (1, None)
+        )
+        if 1 == scale:
+            return self.array
+        else:
+            p = str(self._path)
+            msg = 'Reading from image file [{0}] at 1/{1} scale'
+            debug_print(msg.format(p, scale))
+            image = cv2.imread(p, flag)
+            # The image might be narrower than expected if it is rotated by
+            # its EXIF orientation
+            if image is None or image.shape[1] < min_width:
+                return self.array
+            else:
+                return image
+
+    @property
+    def mapped(self):
+        """A read-only view of a memory map of the pixels in the file, with
+        channels in order B G R, or None if the file's pixels are not stored
+        as uncompressed 8-bit rows (for example, JPEG and compressed TIFF
+        files). Uncompressed TIFFs stored in several strips are mapped if the
+        strips are in order and contiguous. Slicing the view reads only the
+        rows that are needed; the file is not decoded.
+        """
+        import numpy as np
+
+        if self._mapped is None:
+            self._mapped = False
+            self.assert_is_file()
+            pil = self.pil_image
+            tile = pil.tile
+            orientation = getattr(pil, 'tag_v2', {}).get(_TIFF_ORIENTATION, 1)
+            if tile and 1 == orientation:
+                decoder, extents, offset, args = tile[0]
+                width, height = pil.size
+                if 'raw' == decoder and args[0] in _MAPPABLE_RAW_MODES:
+                    raw_mode, stride, direction = args[:3]
+                    channels, order = _MAPPABLE_RAW_MODES[raw_mode]
+                    stride = stride if stride else width * channels
+                    if _contiguous_rows(tile, width, height, stride):
+                        debug_print('Memory-mapping [{0}]'.format(self._path))
+                        rows = np.memmap(str(self._path), dtype=np.uint8,
+                                         mode='r', offset=offset,
+                                         shape=(height, stride))
+                        pixels = rows[:, :width * channels].reshape(
+                            height, width, channels
+                        )
+                        # Rows of some formats (e.g., BMP) are stored bottom-up
+                        self._mapped = pixels[::direction, :, order]
+        return self._mapped if self._mapped is not False else None
+
     def from_normalised(self, boxes):
         """Generator function that yields instances of Rect
         """
@@ -73,6 +213,22 @@ class InselectImage(object):
             yield Rect(int(round(w * left)), int(round(h * top)),
                        int(round(w * width)), int(round(h * height)))
 
+    def from_normalised_array(self, boxes):
+        """Returns an array of shape (n, 4) of ints of the pixel boxes
+        (left, top, width, height) of the n normalised boxes, which can be an
+        array or an iterable. Rounds as from_normalised does.
+        """
+        w, h = self.dimensions
+        return RectArray(boxes).from_normalised(w, h).array.astype(int)
+
+    def to_normalised_array(self, boxes):
+        """Returns an array of shape (n, 4) of floats of the normalised boxes
+        (left, top, width, height) of the n pixel boxes, which can be an array
+        or an iterable
+        """
+        w, h = self.dimensions
+        return RectArray(boxes).to_normalised(w, h).array
+
     def to_normalised(self, boxes):
         """Generator function that yields instances of Rect
         """
@@ -94,27 +250,44 @@ class InselectImage(object):
         elif isinstance(rotation, int):
             rotation = repeat(rotation)
 
-        h, w = self.array.shape[:2]
-        for box, rotate in zip(self.from_normalised(normalised), rotation):
-            x0, y0, x1, y1 = box.coordinates
-            x_in_bounds = [0 <= x0 <= w, 0 <= x1 <= w]
-            y_in_bounds = [0 <= y0 <= h, 0 <= y1 <= h]
+        # Read regions directly from the file, without decoding all of it, if
+        # the file is uncompressed and has not already been decoded
+        if self._array is None and self.mapped is not None:
+            source = self.mapped
+        else:
+            source = self.array
+
+        # Pixel coordinates and bounds checks of all boxes
+        h, w = source.shape[:2]
+        coordinates = RectArray(
+            self.from_normalised_array(normalised)
+        ).coordinates.astype(int)
+        x, y = coordinates[:, 0::2], coordinates[:, 1::2]
+        boxes = zip(coordinates.tolist(), ((0 <= x) & (x <= w)).tolist(),
+                    ((0 <= y) & (y <= h)).tolist(), rotation)
+        for (x0, y0, x1, y1), x_in_bounds, y_in_bounds, rotate in boxes:
             if all(chain(x_in_bounds, y_in_bounds)):
                 # View
-                crop = self.array[y0:y1, x0:x1]
+                crop = source[y0:y1, x0:x1]
             else:
                 # Box is out of bounds -create a new array, all zeroes (black)
                 crop_w, crop_h = x1 - x0, y1 - y0
-                crop = np.zeros((crop_h, crop_w, self.array.shape[2]),
-                                dtype=self.array.dtype)
+                crop = np.zeros((crop_h, crop_w, source.shape[2]),
+                                dtype=source.dtype)
                 if any(x_in_bounds) and any(y_in_bounds):
                     # Partial overlap
-                    overlapping = self.array[max(y0, 0):min(y1, h),
-                                             max(x0, 0):min(x1, w)]
+                    overlapping = source[max(y0, 0):min(y1, h),
+                                         max(x0, 0):min(x1, w)]
                     dest_y, dest_x = max(0, 0 - y0), max(0, 0 - x0)
                     crop[dest_y:(dest_y + overlapping.shape[0]),
                          dest_x:(dest_x + overlapping.shape[1])] = overlapping
 
+            if source is not self._array:
+                # Copy out of the memory map, in the same form as self.array
+                crop = np.ascontiguousarray(crop)
+                if 1 == crop.shape[2]:
+                    crop = cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR)
+
             if 0 != rotate % 90:
                 msg = 'Rotation is not a multiple of 90: [{0}]'
                 raise ValueError(msg.format(rotate))
@@ -134,23 +307,47 @@ class InselectImage(object):
 
             yield crop
 
-    def save_crops(self, normalised, paths, rotation=None, progress=None):
+    def save_crops(self, normalised, paths, rotation=None, progress=None,
+                   threads=None):
         """Saves crops given in normalised to paths.
         Rotation should be the number of clockwise degrees by which the crops
         should be rotated.
+        Crops are encoded and written by a pool of threads - threads defaults
+        to the number of CPUs. progress is called from the calling thread. If
+        more than one crop could not be written, the error for the first of
+        them is raised.
         """
         # TODO Copy EXIF tags?
-        # TODO Make read-only?
         import cv2
-        self.assert_is_file()
-        for index, crop, path in zip(count(), self.crops(normalised, rotation), paths):
-            if progress:
-                progress('Writing crop {0}'.format(1 + index))
+
+        def write(path, crop):
+            # cv2 releases the GIL while encoding
             if not cv2.imwrite(str(path), crop):
                 raise InselectError('Unable to write crop [{0}]'.format(path))
             else:
                 debug_print('Wrote crop [{0}]'.format(path))
 
+        self.assert_is_file()
+        threads = threads if threads else (os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            # Futures in the order in which they were submitted. The number of
+            # outstanding crops, and therefore memory use, is bounded.
+            pending = deque()
+            try:
+                crops = zip(count(), self.crops(normalised, rotation), paths)
+                for index, crop, path in crops:
+                    if progress:
+                        progress('Writing crop {0}'.format(1 + index))
+                    pending.append(pool.submit(write, path, crop))
+                    if len(pending) > 2 * threads:
+                        pending.popleft().result()
+                while pending:
+                    pending.popleft().result()
+            finally:
+                # Do not write outstanding crops if an error occurred
+                for future in pending:
+                    future.cancel()
+
     @property
     def size_bytes(self):
         "The integer size of this file in bytes"
@@ -172,5 +369,66 @@ class InselectImage(object):
         if self._array is not None:
             # Get directly from the array
             return self._array.shape[1], self._array.shape[0]
+        elif self.recorded_info:
+            # Without opening the file
+            return self.recorded_info.width, self.recorded_info.height
         else:
             return self.pil_image.size
+
+    @property
+    def recorded_info(self):
+        """The ImageInfo given to the constructor, if the file's size and
+        modification time are as recorded in it, otherwise None. The file is
+        stat'ed each time, so that it can be replaced while this object is in
+        use; its contents are not read.
+        """
+        if self._info:
+            try:
+                stat = self._path.stat()
+            except OSError:
+                valid = False
+            else:
+                valid = (self._info.size_bytes == stat.st_size and
+                         self._info.mtime == stat.st_mtime)
+            if not valid:
+                debug_print('Recorded info for [{0}] is out of date'.format(
+                    self._path
+                ))
+                self._info = None
+        return self._info
+
+    @property
+    def info(self):
+        """An ImageInfo of the file - recorded_info, if available, otherwise
+        computed from a stat of the file and its dimensions. The file's
+        contents are not read, so that saving a document does not block on
+        large images - the SHA-256 digest is that of recorded_info, if
+        available, otherwise None until computed by verify. New documents
+        have their images verified when they are created.
+        """
+        if not self.recorded_info:
+            self.assert_is_file()
+            debug_print('Computing info for [{0}]'.format(self._path))
+            stat = self._path.stat()
+            width, height = self.dimensions
+            self._info = ImageInfo(width, height, stat.st_size, stat.st_mtime,
+                                   None)
+        return self._info
+
+    def verify(self):
+        """Returns True if the SHA-256 digest of the file is that in info. The
+        file is read in full. If info has no digest, the computed digest is
+        kept in info, so that it is recorded when the document is next saved,
+        and True is returned.
+        """
+        info = self.info
+        debug_print('Computing SHA-256 of [{0}]'.format(self._path))
+        sha256 = hashlib.sha256()
+        with self._path.open('rb') as infile:
+            for chunk in iter(partial(infile.read, 2 ** 20), b''):
+                sha256.update(chunk)
+        if info.sha256 is None:
+            self._info = info._replace(sha256=sha256.hexdigest())
+            return True
+        else:
+            return info.sha256 == sha256.hexdigest()
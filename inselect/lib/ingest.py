@@ -32,18 +32,30 @@ def ingest_image(source, dest_dir,
 
     An exception is raised if the destination image exists.
     An exception is raised if the Inselect document already exists.
+    If the document cannot be created, the image is moved back to source.
     """
     dest = dest_dir / source.name
+    document_path = dest.with_suffix(InselectDocument.EXTENSION)
     if source != dest and dest.is_file():
         raise InselectError('Destination image [{0}] exists'.format(dest))
+    elif document_path.is_file():
+        # Checked before the image is moved so that it is left in place
+        msg = 'Document file [{0}] already exists'
+        raise InselectError(msg.format(document_path))
     else:
         debug_print('Ingesting [{0}] to [{1}]'.format(source, dest))
 
         if source != dest:
             source.rename(dest)
 
-        # Raises if the document already exists
-        doc = InselectDocument.new_from_scan(dest, thumbnail_width_pixels)
+        try:
+            # Raises if the document already exists
+            doc = InselectDocument.new_from_scan(dest, thumbnail_width_pixels)
+        except Exception:
+            if source != dest and not source.exists():
+                debug_print('Moving [{0}] back to [{1}]'.format(dest, source))
+                dest.rename(source)
+            raise
 
         if default_metadata_items:
             debug_print('Adding [{0}] default metadata items'.format(
@@ -0,0 +1,146 @@
+"""A record of the batch processing stages that have been completed for
+documents, used to avoid repeating work when a batch is re-run
+"""
+import hashlib
+import re
+import sqlite3
+
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+from .document import InselectDocument
+from .utils import debug_print
+
+
+# The state of a document and its images and a digest of the settings used
+# by the stage
+Fingerprint = namedtuple('Fingerprint', ['document_hash', 'scanned_mtime',
+                                         'thumbnail_mtime', 'settings'])
+
+# Matches the scanned extension in the bytes of an Inselect document
+_SCANNED_EXTENSION = re.compile(b'"scanned extension":\\s*"([^"]*)"')
+
+
+def _mtime(path):
+    "Returns the integer modification time of path in ns, or None"
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def settings_digest(template=None, engine=None):
+    """Returns a digest of the settings that affect the output of a stage -
+    the contents of the template file at template and the name of the barcode
+    engine
+    """
+    digest = hashlib.sha1()
+    if template:
+        digest.update(Path(template).read_bytes())
+    digest.update(b'\0')
+    if engine:
+        digest.update(engine.encode('utf8'))
+    return digest.hexdigest()
+
+
+def fingerprint(document_path, settings=None):
+    """Returns a Fingerprint of the Inselect document at document_path and of
+    its scanned and thumbnail images. The document is not parsed. settings
+    should be a value returned by settings_digest.
+    """
+    document_path = Path(document_path)
+    data = document_path.read_bytes()
+    match = _SCANNED_EXTENSION.search(data)
+    if match:
+        scanned = document_path.with_suffix(match.group(1).decode('utf8'))
+        scanned_mtime = _mtime(scanned)
+    else:
+        scanned_mtime = None
+    thumbnail = InselectDocument.thumbnail_path_of_scanned(document_path)
+    return Fingerprint(hashlib.sha1(data).hexdigest(), scanned_mtime,
+                       _mtime(thumbnail), settings)
+
+
+class Manifest(object):
+    """A SQLite database of stages that have been completed for documents.
+
+    A stage is complete for a document if it was recorded as complete and
+    neither the document, its images nor the stage's settings have changed
+    since.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._connection = sqlite3.connect(str(self.path), timeout=60)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS stages ('
+                'document TEXT NOT NULL, '
+                'stage TEXT NOT NULL, '
+                'document_hash TEXT NOT NULL, '
+                'scanned_mtime INTEGER, '
+                'thumbnail_mtime INTEGER, '
+                'completed_on TEXT NOT NULL, '
+                'settings TEXT, '
+                'PRIMARY KEY (document, stage))'
+            )
+            columns = [
+                row[1] for row in
+                self._connection.execute('PRAGMA table_info(stages)')
+            ]
+            if 'settings' not in columns:
+                # Manifest written before settings were recorded
+                self._connection.execute(
+                    'ALTER TABLE stages ADD COLUMN settings TEXT'
+                )
+
+    def __repr__(self):
+        return "Manifest('{0}')".format(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    @classmethod
+    def _key(cls, document_path):
+        return str(Path(document_path).resolve())
+
+    def is_complete(self, document_path, stage, settings=None):
+        """Returns True if stage has been completed for the document at
+        document_path with the same settings and neither the document nor its
+        images have changed since
+        """
+        row = self._connection.execute(
+            'SELECT document_hash, scanned_mtime, thumbnail_mtime, settings '
+            'FROM stages WHERE document=? AND stage=?',
+            (self._key(document_path), stage)
+        ).fetchone()
+        if row and Fingerprint(*row) == fingerprint(document_path, settings):
+            debug_print('[{0}] complete for [{1}]'.format(stage, document_path))
+            return True
+        else:
+            return False
+
+    def completed(self, document_path, stage, settings=None):
+        """Records that stage has been completed for the document at
+        document_path with settings. Should be called after any changes to the
+        document have been saved.
+        """
+        debug_print('Recording [{0}] complete for [{1}]'.format(
+            stage, document_path
+        ))
+        with self._connection:
+            f = fingerprint(document_path, settings)
+            self._connection.execute(
+                'INSERT OR REPLACE INTO stages (document, stage, '
+                'document_hash, scanned_mtime, thumbnail_mtime, settings, '
+                'completed_on) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (self._key(document_path), stage) + f +
+                (datetime.utcnow().strftime(InselectDocument.DT_FORMAT),)
+            )
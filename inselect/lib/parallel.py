@@ -0,0 +1,90 @@
+"""Running a function over many inputs in a pool of worker processes
+"""
+import concurrent.futures
+
+from contextlib import contextmanager
+from functools import partial
+from itertools import islice
+
+from . import utils
+
+
+def _call(debug_print, fn, arg):
+    # Worker processes do not necessarily inherit module state from the parent
+    # (they are spawned, not forked, on Windows and Mac OS X)
+    utils.DEBUG_PRINT = debug_print
+    return fn(arg)
+
+
+def _completed_future(fn, arg):
+    "Returns a concurrent.futures.Future holding the result of fn(arg)"
+    future = concurrent.futures.Future()
+    try:
+        future.set_result(fn(arg))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+@contextmanager
+def worker_pool(jobs=1):
+    """Context manager that yields a pool of jobs worker processes, to be
+    passed to imap_completed, or None if jobs is 1. The pool is shut down on
+    exit.
+    """
+    if jobs < 1:
+        raise ValueError('jobs should be at least 1')
+    elif 1 == jobs:
+        yield None
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            yield pool
+
+
+def imap_completed(fn, args, jobs=1, pool=None):
+    """Generator function that calls fn(arg) for each arg in the iterable args
+    and yields tuples (arg, future) in the order in which calls complete.
+    Callers should call future.result() to obtain the return value of fn, or
+    to have the exception raised by fn re-raised.
+
+    If jobs is 1, calls are made in this process, one at a time. Otherwise
+    calls are made in a pool of jobs worker processes; fn, each arg and each
+    return value must be picklable. args is consumed lazily - no more than
+    2 * jobs calls are outstanding at any time.
+
+    If pool, as yielded by worker_pool, is given, calls are made in it and it
+    is not shut down, so that the cost of starting workers is paid once by
+    callers that call imap_completed repeatedly.
+    """
+    if jobs < 1:
+        raise ValueError('jobs should be at least 1')
+    elif pool is not None:
+        yield from _imap_pool(pool, fn, args, jobs)
+    elif 1 == jobs:
+        for arg in args:
+            yield arg, _completed_future(fn, arg)
+    else:
+        with worker_pool(jobs) as pool:
+            yield from _imap_pool(pool, fn, args, jobs)
+
+
+def _imap_pool(pool, fn, args, jobs):
+    "Implementation of imap_completed for the concurrent.futures.Executor pool"
+    fn = partial(_call, utils.DEBUG_PRINT, fn)
+    args = iter(args)
+    # Map from future to arg
+    pending = {pool.submit(fn, arg): arg for arg in islice(args, 2 * jobs)}
+    try:
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                yield pending.pop(future), future
+            # Top-up the pool
+            for arg in islice(args, len(done)):
+                pending[pool.submit(fn, arg)] = arg
+    finally:
+        # Do not start outstanding calls if the caller bailed out
+        for future in pending:
+            future.cancel()
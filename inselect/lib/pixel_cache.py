@@ -0,0 +1,193 @@
+"""An opt-in, on-disk cache of decoded image pixels.
+
+Decoded arrays are written to .npy files and subsequently loaded as read-only
+memory maps, which is much faster than decoding large JPEG and TIFF files.
+Entries are keyed by the image's path, modification time and size, so an
+altered image is decoded afresh. The cache is bounded in size - least
+recently used entries are removed first.
+
+The cache is enabled by setting the INSELECT_PIXEL_CACHE environment variable
+to the path of a directory.
+"""
+import hashlib
+import os
+import tempfile
+
+from pathlib import Path
+
+from .utils import debug_print
+
+# Warning: lazy load of numpy via local imports
+
+
+CACHE_DIR_ENV = 'INSELECT_PIXEL_CACHE'
+MAX_BYTES_ENV = 'INSELECT_PIXEL_CACHE_MAX_BYTES'
+
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+
+# The instance of PixelCache returned by default_cache(); False if not yet
+# configured
+_DEFAULT = False
+
+
+class PixelCache(object):
+    """A directory of decoded image arrays
+    """
+
+    EXTENSION = '.npy'
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        # The total size of entries when the directory was last scanned plus
+        # the sizes of entries written since; None until the first put()
+        self._recorded_bytes = None
+
+    def __repr__(self):
+        return "PixelCache('{0}', {1})".format(self.directory, self.max_bytes)
+
+    def _entry(self, path):
+        "Returns the path of the cache entry for the image file at path"
+        path = Path(path).resolve()
+        stat = path.stat()
+        key = '{0}|{1}|{2}'.format(path, stat.st_mtime_ns, stat.st_size)
+        digest = hashlib.sha1(key.encode('utf8')).hexdigest()
+        return self.directory / '{0}{1}'.format(digest, self.EXTENSION)
+
+    def get(self, path):
+        """Returns a read-only memory-mapped array of the pixels of the image
+        file at path or None if the image is not in the cache or the cache
+        could not be read
+        """
+        import numpy as np
+
+        try:
+            entry = self._entry(path)
+            array = np.load(str(entry), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        else:
+            debug_print('Loaded [{0}] from pixel cache'.format(path))
+            # Record the use of the entry - the modification time is used to
+            # order entries for eviction
+            try:
+                os.utime(str(entry))
+            except OSError as e:
+                # For example, a cache that is shared or read-only
+                debug_print('Unable to record use of [{0}]: [{1}]'.format(
+                    entry, e
+                ))
+            return array
+
+    def put(self, path, array):
+        """Writes array, the decoded pixels of the image file at path, to the
+        cache and prunes the cache to self.max_bytes if the recorded total
+        size of the cache exceeds it. Returns True if array was written.
+        Errors, for example from a read-only or full cache directory, are
+        reported by debug_print and otherwise ignored - the cache is only an
+        optimisation.
+        """
+        import numpy as np
+
+        temp = None
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            entry = self._entry(path)
+            # Write to a temporary file and rename, so that concurrent readers
+            # never see a partial entry
+            fd, temp = tempfile.mkstemp(suffix='.tmp',
+                                        dir=str(self.directory))
+            with os.fdopen(fd, 'wb') as outfile:
+                np.save(outfile, array)
+            # An existing entry, for example one that could not be read by
+            # get(), is replaced and so no longer counts towards the total
+            try:
+                replaced_bytes = entry.stat().st_size
+            except OSError:
+                replaced_bytes = 0
+            os.replace(temp, str(entry))
+            temp = None
+            debug_print('Wrote [{0}] to pixel cache'.format(path))
+            if self._recorded_bytes is None:
+                # Includes the new entry
+                self._recorded_bytes = self.size_bytes
+            else:
+                self._recorded_bytes += entry.stat().st_size - replaced_bytes
+            if self._recorded_bytes > self.max_bytes:
+                self.prune()
+            return True
+        except OSError as e:
+            debug_print('Unable to write [{0}] to pixel cache: [{1}]'.format(
+                path, e
+            ))
+            return False
+        finally:
+            if temp:
+                try:
+                    os.unlink(temp)
+                except OSError:
+                    pass
+
+    def entries(self):
+        """Returns a list of tuples (path, size in bytes) of cache entries,
+        least recently used first
+        """
+        entries = []
+        if self.directory.is_dir():
+            for entry in self.directory.glob('*' + self.EXTENSION):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    # Removed by another process
+                    pass
+                else:
+                    entries.append((stat.st_mtime, entry, stat.st_size))
+        return [(entry, size) for mtime, entry, size in sorted(entries)]
+
+    @property
+    def size_bytes(self):
+        "The total size of cache entries in bytes"
+        return sum(size for entry, size in self.entries())
+
+    def prune(self, max_bytes=None):
+        """Removes least recently used entries until the total size of the
+        cache is no more than max_bytes, which defaults to self.max_bytes.
+        Returns a tuple (number of entries removed, number of bytes removed).
+        The directory is scanned, so entries written by other processes are
+        counted.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(size for entry, size in entries)
+        n_removed = bytes_removed = 0
+        for entry, size in entries:
+            if total - bytes_removed <= max_bytes:
+                break
+            else:
+                debug_print('Removing [{0}] from pixel cache'.format(entry))
+                try:
+                    entry.unlink()
+                except OSError:
+                    # Removed by another process
+                    pass
+                n_removed += 1
+                bytes_removed += size
+        self._recorded_bytes = total - bytes_removed
+        return n_removed, bytes_removed
+
+
+def default_cache():
+    """Returns the instance of PixelCache given by the INSELECT_PIXEL_CACHE
+    and INSELECT_PIXEL_CACHE_MAX_BYTES environment variables, or None if
+    INSELECT_PIXEL_CACHE is not set
+    """
+    global _DEFAULT
+    if _DEFAULT is False:
+        directory = os.environ.get(CACHE_DIR_ENV)
+        if directory:
+            max_bytes = int(os.environ.get(MAX_BYTES_ENV, DEFAULT_MAX_BYTES))
+            _DEFAULT = PixelCache(directory, max_bytes)
+            debug_print('Using [{0}]'.format(_DEFAULT))
+        else:
+            _DEFAULT = None
+    return _DEFAULT
@@ -0,0 +1,190 @@
+"""Timing the stages of long-running operations, such as segmentation.
+
+Operations that take a callback - a callable that is polled at regular
+intervals and that might be given progress messages - can time their stages
+using span():
+
+    with span(callback, 'findContours') as s:
+        contours, hierarchy = _find_contours(...)
+        s.array('edges', edges)
+        s.set(contours=len(contours))
+
+span() does nothing unless callback has a span method, such as an instance
+of Profile, so operations can be instrumented without cost to callers that
+are not interested in timings.
+"""
+import json
+import os
+import threading
+import time
+
+from pathlib import Path
+
+from .utils import debug_print
+
+
+class Span(object):
+    """A stage of an operation. Operations can record information about the
+    stage, such as the sizes of arrays, with set() and array().
+    """
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def set(self, **kwargs):
+        "Records kwargs"
+        self.args.update(kwargs)
+
+    def array(self, name, array):
+        "Records the shape, dtype and size of array"
+        self.args[name] = {
+            'shape': list(array.shape),
+            'dtype': str(array.dtype),
+            'bytes': int(array.nbytes),
+        }
+
+
+class _NullSpan(object):
+    "A Span that does not record anything"
+    def set(self, **kwargs):
+        pass
+
+    def array(self, name, array):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(callback, name, **args):
+    """Returns a context manager that times the stage of an operation given by
+    name, if callback has a span method, or that does nothing if it does not.
+    The context manager's target is an instance of Span, which is initialised
+    with args.
+    """
+    fn = getattr(callback, 'span', None)
+    return fn(name, **args) if fn else _NULL_SPAN
+
+
+class _SpansOnly(object):
+    "A callback that records spans but that ignores messages"
+    def __init__(self, span):
+        self.span = span
+
+    def __call__(self, *args, **kwargs):
+        pass
+
+
+def spans_only(callback):
+    """Returns a callback that records spans in callback, if callback has a
+    span method, and that ignores messages and polls. Returns None if
+    callback does not have a span method. Used for work, such as work in
+    other threads, that should not report progress.
+    """
+    fn = getattr(callback, 'span', None)
+    return _SpansOnly(fn) if fn else None
+
+
+class _Timer(object):
+    "Context manager that records a Span in a Profile"
+    def __init__(self, profile, name, args):
+        self.profile = profile
+        self.span = Span(name, args)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, *args):
+        self.profile._record(self.span, self.start, time.perf_counter())
+
+
+class Profile(object):
+    """A callback that records the spans of an operation. Calls are passed to
+    callback, if given, so an instance can wrap an existing callback, such as
+    the progress method of a WorkerThread.
+
+    Spans are recorded as events in the Trace Event Format used by Chrome's
+    about:tracing and by Perfetto. Events are plain dicts, so they can be
+    returned from worker processes and added to a Profile with extend().
+    Instances are thread-safe.
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._events = []
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        if self.callback:
+            return self.callback(*args, **kwargs)
+
+    def span(self, name, **args):
+        """Returns a context manager that times the stage given by name and
+        that returns an instance of Span
+        """
+        return _Timer(self, name, args)
+
+    def _record(self, span, start, end):
+        event = {
+            'name': span.name,
+            'ph': 'X',
+            # Microseconds
+            'ts': 1e6 * start,
+            'dur': 1e6 * (end - start),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': span.args,
+        }
+        with self._lock:
+            self._events.append(event)
+
+    @property
+    def events(self):
+        "A list of dicts, in the order in which spans finished"
+        with self._lock:
+            return list(self._events)
+
+    def extend(self, events):
+        "Adds events, such as those recorded in another process"
+        with self._lock:
+            self._events.extend(events)
+
+    def totals(self):
+        """Returns a list of tuples (name, count, total seconds), in
+        descending order of total seconds
+        """
+        totals = {}
+        for event in self.events:
+            count, seconds = totals.get(event['name'], (0, 0.0))
+            totals[event['name']] = (1 + count, seconds + event['dur'] / 1e6)
+        return sorted(((name, count, seconds) for name, (count, seconds) in
+                       totals.items()), key=lambda v: v[2], reverse=True)
+
+    def summary(self):
+        "Returns a str table of totals()"
+        lines = ['{0:<24}{1:>8}{2:>12}'.format('span', 'count', 'seconds')]
+        lines.extend('{0:<24}{1:>8}{2:>12.3f}'.format(*total)
+                     for total in self.totals())
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        "Returns a dict in the Trace Event Format"
+        return {'traceEvents': self.events, 'displayTimeUnit': 'ms'}
+
+    def write(self, path):
+        """Writes a JSON file in the Trace Event Format, which can be loaded
+        into Chrome's about:tracing or https://ui.perfetto.dev
+        """
+        path = Path(path)
+        trace = self.chrome_trace()
+        debug_print('Writing [{0}] spans to [{1}]'.format(
+            len(trace['traceEvents']), path
+        ))
+        with path.open('w', encoding='utf8') as outfile:
+            json.dump(trace, outfile, indent=1)
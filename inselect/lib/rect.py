@@ -1,5 +1,7 @@
 import collections
+import numbers
 
+# Warning: lazy load of numpy via local imports
 
 # Simple representations of Points and rectangles
 Point = collections.namedtuple('Point', ['x', 'y'])
@@ -74,3 +76,145 @@ class Rect(collections.namedtuple('Rect', ['left', 'top', 'width', 'height'])):
 
     def __ne__(self, other):
         return not self == other
+
+
+class RectArray(object):
+    """Many rects, held in an array of shape (n, 4) of (left, top, width,
+    height), with the operations of Rect applied to all of them at once
+    """
+    def __init__(self, rects):
+        """rects - a RectArray, an array or an iterable of (left, top, width,
+        height)
+        """
+        import numpy as np
+
+        if isinstance(rects, RectArray):
+            rects = rects.array
+        elif not isinstance(rects, np.ndarray):
+            rects = [tuple(r) for r in rects]
+        self.array = np.array(rects, dtype=np.float64).reshape(-1, 4)
+
+    def __len__(self):
+        return len(self.array)
+
+    def __iter__(self):
+        "Generator of instances of Rect"
+        return map(Rect._make, self.array.tolist())
+
+    def __getitem__(self, index):
+        "An instance of Rect if index is an integer, otherwise a RectArray"
+        if isinstance(index, numbers.Integral):
+            return Rect._make(self.array[index].tolist())
+        else:
+            return RectArray(self.array[index])
+
+    def __repr__(self):
+        return 'RectArray [{0}]'.format(len(self))
+
+    @property
+    def left(self):
+        return self.array[:, 0]
+
+    @property
+    def top(self):
+        return self.array[:, 1]
+
+    @property
+    def width(self):
+        return self.array[:, 2]
+
+    @property
+    def height(self):
+        return self.array[:, 3]
+
+    @property
+    def area(self):
+        "An array of the products of width and height"
+        return self.width * self.height
+
+    @property
+    def coordinates(self):
+        "An array of shape (n, 4) of (left, top, right, bottom)"
+        coordinates = self.array.copy()
+        coordinates[:, 2:] += self.array[:, :2]
+        return coordinates
+
+    @property
+    def x_centre(self):
+        "An array of left + width / 2"
+        return self.left + self.width / 2
+
+    @property
+    def y_centre(self):
+        "An array of top + height / 2"
+        return self.top + self.height / 2
+
+    @property
+    def centres(self):
+        "An array of shape (n, 2) of (x, y)"
+        import numpy as np
+        return np.column_stack((self.x_centre, self.y_centre))
+
+    def padded(self, percent):
+        "Returns a new RectArray with percentage padding applied"
+        offsets = self.array[:, 2:] * float(percent) / 100.0
+        padded = self.array.copy()
+        padded[:, :2] -= offsets
+        padded[:, 2:] += 2 * offsets
+        return RectArray(padded)
+
+    def intersect(self, other):
+        """Returns a new RectArray of self intersected to be within other - a
+        Rect, which applies to every rect, or a RectArray or an array of shape
+        (n, 4), the rects of which are intersected pairwise with those of self
+        """
+        import numpy as np
+
+        if isinstance(other, Rect):
+            other = np.array([other.coordinates], dtype=np.float64)
+        elif isinstance(other, (RectArray, np.ndarray)):
+            other = RectArray(other)
+            if len(other) != len(self):
+                msg = 'Cannot intersect [{0}] rects with [{1}] rects'
+                raise ValueError(msg.format(len(self), len(other)))
+            other = other.coordinates
+        else:
+            msg = 'Cannot intersect with [{0}]'
+            raise TypeError(msg.format(type(other).__name__))
+
+        coordinates = self.coordinates
+        left_top = np.maximum(coordinates[:, :2], other[:, :2])
+        right_bottom = np.minimum(coordinates[:, 2:], other[:, 2:])
+        return RectArray(np.hstack((left_top, right_bottom - left_top)))
+
+    def to_normalised(self, width, height):
+        """Returns a new RectArray of self, in pixels of an image of width and
+        height, normalised to the image
+        """
+        width, height = float(width), float(height)
+        return RectArray(self.array / (width, height, width, height))
+
+    def from_normalised(self, width, height):
+        """Returns a new RectArray of self, normalised, in pixels of an image
+        of width and height, rounded to the nearest pixel
+        """
+        import numpy as np
+        return RectArray(np.round(self.array * (width, height, width, height)))
+
+    def iou(self, other):
+        """Returns an array of shape (len(self), len(other)) of the
+        intersection over union of each rect in self with each in other.
+        Pairs that do not overlap have zero.
+        """
+        import numpy as np
+
+        other = RectArray(other)
+        a, b = self.coordinates[:, None], other.coordinates[None]
+        left_top = np.maximum(a[..., :2], b[..., :2])
+        right_bottom = np.minimum(a[..., 2:], b[..., 2:])
+        width, height = np.moveaxis(right_bottom - left_top, -1, 0)
+        overlaps = (width > 0) & (height > 0)
+        intersection = np.where(overlaps, width * height, 0.0)
+        union = self.area[:, None] + other.area[None] - intersection
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(overlaps, intersection / union, 0.0)
@@ -1,5 +1,10 @@
+import os
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from random import randint
 
+from .profiling import span, spans_only
+from .rect import RectArray
 from .utils import debug_print
 
 # Warning: lazy load of cv2 and numpy via local imports
@@ -9,6 +14,20 @@ from .utils import debug_print
 # from skimage.morphology import watershed
 USE_OPENCV_WATERSHED = True
 
+# Tiles, in pixels, used by segment_edges_tiled()
+DEFAULT_TILE_SIZE = 2048
+DEFAULT_TILE_OVERLAP = 256
+
+# The width of the coarse level used by segment_edges_pyramid()
+DEFAULT_COARSE_WIDTH = 1024
+
+# The largest window, in pixels, on which segment_grabcut() runs GrabCut
+DEFAULT_GRABCUT_MAX_PIXELS = 2 * 1024 ** 2
+
+# Contours wider or taller than this proportion of the image might be
+# containers, such as drawer subdivisions
+CONTAINER_PROPORTION = 0.35
+
 
 def _find_contours(*args, **kwargs):
     """Wrapper around cv2.findContours. Returns a tuple (contours, hierarchy).
@@ -19,58 +38,97 @@ def _find_contours(*args, **kwargs):
     res = cv2.findContours(*args, **kwargs)
     return res[-2:]
 
-def _right_sized(contour, image, container_filter=True, size_filter=True):
-    """Checks if contour size and shape is that of an object of interest.
+def _contour_stats(contours):
+    """Returns a tuple of arrays (x, y, w, h, area) of the bounding rects and
+    areas of each of contours, as given by cv2.boundingRect and
+    cv2.contourArea. Computed for all contours at once.
+    """
+    import numpy as np
+
+    lengths = np.array([len(c) for c in contours])
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.int64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    xs, ys = points[:, 0], points[:, 1]
+
+    x = np.minimum.reduceat(xs, starts)
+    y = np.minimum.reduceat(ys, starts)
+    w = np.maximum.reduceat(xs, starts) - x + 1
+    h = np.maximum.reduceat(ys, starts) - y + 1
+
+    # Shoelace formula, with each point joined to the next point of the same
+    # contour and the last point joined to the first
+    following = np.arange(1, len(points) + 1)
+    following[starts + lengths - 1] = starts
+    cross = xs * ys[following] - xs[following] * ys
+    area = np.abs(np.add.reduceat(cross, starts)) / 2.0
+    return x, y, w, h, area
+
+
+def _right_sized(contours, image, container_filter=True, size_filter=True,
+                 shape=None):
+    """Checks if contour sizes and shapes are those of objects of interest.
 
     Parameters
     ----------
-    contour : cv2.Contour
-        Contour to be analysed.
-    image_size : tuple
-        Dimensions of operating image.
+    contours : list of cv2.Contour
+        Contours to be analysed.
+    image : ndarray
+        Operating image.
     container_filter : boolean
         Filters with simple heuristic for container contours. These are
         contours containing other segments such as insect cabinet subdivisions.
     size_filter : boolean
         Filters large objects.
+    shape : tuple
+        Optional (height, width) against which sizes are judged. Defaults to
+        the shape of image.
 
     Returns
     -------
-    result : boolean
-        Object is of correct sizing.
+    (result, rects) : (N,) boolean array, (N, 4) array
+        Objects are of correct sizing and bounding rects (x, y, w, h).
     """
-    import cv2
+    import numpy as np
+
+    x, y, w, h, contour_area = _contour_stats(contours)
+    result = _is_right_sized(w, h, contour_area, shape or image.shape,
+                             container_filter, size_filter)
+    return result, np.column_stack((x, y, w, h))
+
+
+def _is_right_sized(w, h, contour_area, image_size, container_filter=True,
+                    size_filter=True):
+    """Returns a boolean array that is True where the bounding rects of
+    width w and height h, of contours of contour_area, are of objects of
+    interest in an image of image_size (height, width). See _right_sized.
+    contour_area is not used if container_filter is False.
+    """
+    import numpy as np
 
-    image_size = image.shape
-    x, y, w, h = cv2.boundingRect(contour)
     area = image_size[0] * image_size[1]
-    if w > h:
-        ratio = float(w) / h
-    else:
-        ratio = float(h) / w
+    ratio = np.maximum(w, h) / np.minimum(w, h)
 
-    # compares contour area to bounding rectangle area
-    fill_ratio = cv2.contourArea(contour) / (w * h)
     # filter very long narrow objects and small objects
-    is_right_shape = ratio < 8 and w * h > area / 8E3
-    # filter to remove containers that are a) large and b) contains
-    # too much or too little contour area in bounding box
-    is_container = (not 0.1 < fill_ratio < 0.8 and
-                    (w > image_size[1] * 0.35 or
-                     h > image_size[0] * 0.35))
-    is_too_large = (w > image_size[1] * 0.85 and h > image_size[0] * 0.85)
-    debug = False
-    if debug and (w > image_size[1] * 0.35 or h > image_size[0] * 0.35):
-        debug_print(w, h, fill_ratio, is_container)
-        cv2.imshow('im', image[y:y+h, x:x+w])
-        cv2.waitKey(0)
-
-    return is_right_shape and not (container_filter and is_container) and \
-        not (size_filter and is_too_large)
-
-
-def _process_contours(image, contours, hierarchy, callback, index=0,
-                      size_filter=True):
+    is_right_shape = (ratio < 8) & (w * h > area / 8E3)
+    is_too_large = (w > image_size[1] * 0.85) & (h > image_size[0] * 0.85)
+
+    result = is_right_shape
+    if container_filter:
+        # compares contour area to bounding rectangle area
+        fill_ratio = contour_area / (w * h)
+        # filter to remove containers that are a) large and b) contains
+        # too much or too little contour area in bounding box
+        is_container = (~((0.1 < fill_ratio) & (fill_ratio < 0.8)) &
+                        ((w > image_size[1] * CONTAINER_PROPORTION) |
+                         (h > image_size[0] * CONTAINER_PROPORTION)))
+        result &= ~is_container
+    if size_filter:
+        result &= ~is_too_large
+    return result
+
+
+def _process_contours(image, contours, hierarchy, callback, size_filter=True,
+                      shape=None):
     """Traverse a hierachy of contours (contours containing contours) and
     returns bounding boxes of the smallest possible objects that still remain
     of interest.
@@ -85,46 +143,137 @@ def _process_contours(image, contours, hierarchy, callback, index=0,
         Hierarchy of contours.
     callback: Callable
         A callable that will be called at regular intervals.
-    index : int
-        Start of contour index.
     size_filter : boolean
         Filters large objects.
+    shape : tuple
+        Optional (height, width) against which sizes are judged.
     """
-    import cv2
+    import numpy as np
+
+    if not len(contours):
+        return []
 
-    result = []
-    while index >= 0:
-        callback()
-        next, previous, child, parent = hierarchy[0][index]
-        if _right_sized(contours[index], image, size_filter=size_filter):
-            rect = cv2.boundingRect(contours[index])
-            rect += (contours[index],)
-            result.append(rect)
+    right_sized, rects = _right_sized(contours, image, size_filter=size_filter,
+                                      shape=shape)
+
+    callback()
+
+    # A contour is of interest if it is right-sized and none of its ancestors
+    # are - the hierarchy is not descended below contours of interest.
+    # Resolved one level of the hierarchy per iteration.
+    parent = hierarchy[0][:, 3]
+    has_parent = parent >= 0
+    blocked = np.zeros_like(right_sized)
+    while True:
+        covered = right_sized | blocked
+        updated = has_parent & covered[parent]
+        if np.array_equal(updated, blocked):
+            break
         else:
-            if child != -1:
-                rects = _process_contours(image, contours, hierarchy,
-                                          callback, index=child,
-                                          size_filter=size_filter)
-                result.extend(rects)
-        index = next
-    return result
+            blocked = updated
+            callback()
+
+    # findContours lists contours depth-first, which is the order in which
+    # the hierarchy was traversed by the previous, recursive implementation
+    indices = np.flatnonzero(right_sized & ~blocked)
+    return [tuple(rects[i].tolist()) + (contours[i],) for i in indices]
 
 
 # alternate process, may be useful if we abandon hierarchical contours later
 def _process_contours_iterate(image, contours, hierarchy, index=0,
                               size_filter=True):
+    import numpy as np
+
+    if not len(contours):
+        return []
+
+    right_sized, rects = _right_sized(contours, image, size_filter=size_filter)
+    return [tuple(rects[i].tolist()) + (contours[i],)
+            for i in np.flatnonzero(right_sized)]
+
+
+def _integrals(gray):
+    """Returns a tuple of float64 arrays (sum, sqsum) - the summed-area tables
+    of gray and of its square, as given by cv2.integral2
+    """
     import cv2
 
-    result = []
-    for contour in contours:
-        if right_sized(contour, image.shape, size_filter=size_filter):
-            rect = cv2.boundingRect(contour)
-            rect += (contour,)
-            result.append(rect)
-    return result
+    return cv2.integral2(gray, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+
+
+def _variances(integrals, rects):
+    """Returns an array of the variance of the pixels within each of rects
+    (x, y, w, h, ...), as given by np.var, computed from integrals, a tuple
+    (sum, sqsum) as returned by _integrals. The variance of an empty rect is
+    nan.
+    """
+    import numpy as np
+
+    total, sqsum = integrals
+    if not len(rects):
+        return np.empty(0)
+
+    height, width = total.shape[0] - 1, total.shape[1] - 1
+    rects = np.array([r[:4] for r in rects], dtype=np.intp).reshape(-1, 4)
+    # Clipped to the image, as slicing would be
+    x0 = np.clip(rects[:, 0], 0, width)
+    y0 = np.clip(rects[:, 1], 0, height)
+    x1 = np.clip(rects[:, 0] + rects[:, 2], 0, width)
+    y1 = np.clip(rects[:, 1] + rects[:, 3], 0, height)
+    n = (x1 - x0) * (y1 - y0)
+
+    def sums(table):
+        return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = sums(total) / n
+        return sums(sqsum) / n - mean * mean
+
+
+def _sobel(channel):
+    """Returns a tuple of float32 arrays (d/dx, d/dy) of channel
+    """
+    import cv2
+
+    return (cv2.Sobel(channel, cv2.CV_32F, 1, 0, None, 1),
+            cv2.Sobel(channel, cv2.CV_32F, 0, 1, None, 1))
+
+
+def _threshold_scaled(values, threshold):
+    """Returns a binary uint8 image of the float32 array values, scaled to
+    between 0 and 255 and thresholded. values is overwritten.
+    """
+    import cv2
+    import numpy as np
+
+    max_value = np.max(values)
+    if max_value:
+        # Equivalent to (255 * values / max_value) without temporaries
+        np.multiply(values, 255, out=values)
+        np.divide(values, max_value, out=values)
+    scaled = values.astype(np.uint8)
+    _, scaled = cv2.threshold(scaled, threshold, 255, cv2.THRESH_BINARY,
+                              dst=scaled)
+    return scaled
+
+
+def _gradient_magnitude(channel):
+    """Returns a float32 array of the magnitude of the gradient of channel
+    """
+    import cv2
 
+    v_edges, h_edges = _sobel(channel)
+    return cv2.magnitude(v_edges, h_edges, v_edges)
 
-def remove_lines(image):
+
+def _edge_magnitude(channel, threshold):
+    """Returns a binary uint8 image of the thresholded, scaled magnitude of the
+    gradient of channel
+    """
+    return _threshold_scaled(_gradient_magnitude(channel), threshold)
+
+
+def remove_lines(image, gray=None):
     """Removes long horizontal and vertical edges. Operates on the vertical and
     horizontal sobel images.
 
@@ -132,6 +281,9 @@ def remove_lines(image):
     ----------
     image : (M, N, 3) array
         Operating image.
+    gray : (M, N) array
+        Optional grayscale conversion of image, if it has already been
+        computed.
 
     Returns
     -------
@@ -141,27 +293,26 @@ def remove_lines(image):
     import cv2
     import numpy as np
 
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    v_edges = cv2.Sobel(gray, cv2.CV_32F, 1, 0, None, 1)
-    h_edges = cv2.Sobel(gray, cv2.CV_32F, 0, 1, None, 1)
-    mag = np.abs(v_edges)
+    if gray is None:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    v_edges, h_edges = _sobel(gray)
     mask = np.zeros(gray.shape, dtype=np.uint8)
     # set line width as 20th of the average image width-height
     linewidth = ((image.shape[0] + image.shape[1]) / 2) / 20
     threshold = 20
-    mag2 = (255*mag/np.max(mag)).astype(np.uint8)
-    _, mag2 = cv2.threshold(mag2, threshold, 255, cv2.THRESH_BINARY)
-    contours, hierarchy = _find_contours(mag2.copy(),
+    mag2 = _threshold_scaled(np.abs(v_edges, out=v_edges), threshold)
+    del v_edges
+    # mag2 is not used after findContours, which alters it in OpenCV < 3.2
+    contours, hierarchy = _find_contours(mag2,
                                          cv2.RETR_EXTERNAL,
                                          cv2.CHAIN_APPROX_SIMPLE)
     for contour in contours:
         _, _, w, h = cv2.boundingRect(contour)
         if h > image.shape[0] / 4 and w < linewidth:
             cv2.drawContours(mask, [contour], -1, 255, -1)
-    mag = np.abs(h_edges)
-    mag2 = (255*mag/np.max(mag)).astype(np.uint8)
-    _, mag2 = cv2.threshold(mag2, threshold, 255, cv2.THRESH_BINARY)
-    contours, hierarchy = _find_contours(mag2.copy(),
+    mag2 = _threshold_scaled(np.abs(h_edges, out=h_edges), threshold)
+    del h_edges
+    contours, hierarchy = _find_contours(mag2,
                                          cv2.RETR_EXTERNAL,
                                          cv2.CHAIN_APPROX_SIMPLE)
     for contour in contours:
@@ -171,11 +322,229 @@ def remove_lines(image):
     return mask
 
 
+def _blurred_gray(image, callback):
+    """Returns a tuple of uint8 arrays (gray, blurred gray) of image
+    """
+    import cv2
+
+    with span(callback, 'blur') as s:
+        unblurred = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(unblurred, (3, 3), 3)
+        s.array('gray', gray)
+    return unblurred, gray
+
+
+def _edge_channels(image, gray, threshold, lab_based, callback):
+    """Returns a list of tuples (channel, threshold) of the uint8 channels in
+    which edges are detected and the threshold applied to each
+    """
+    import cv2
+
+    if not lab_based:
+        return [(gray, threshold)]
+    else:
+        with span(callback, 'lab') as s:
+            image2 = cv2.GaussianBlur(image, (3, 3), 3)
+            lab_image = cv2.cvtColor(image2, cv2.COLOR_BGR2LAB)
+            del image2
+            s.array('lab', lab_image)
+        # L and B components
+        return [(cv2.extractChannel(lab_image, 0), 10),
+                (cv2.extractChannel(lab_image, 2), 40)]
+
+
+def _filter_lines(edges, image, unblurred, callback):
+    "Removes long horizontal and vertical lines from edges"
+    import numpy as np
+
+    with span(callback, 'line removal') as s:
+        mask = remove_lines(image, unblurred)
+        # mask is either 0 or 255
+        np.bitwise_and(edges, np.bitwise_not(mask, out=mask), out=edges)
+        s.array('mask', mask)
+
+
+def edge_map(image, threshold=12, lab_based=True, line_filter=1,
+             callback=None):
+    """Computes the binary edge image used by segment_edges.
+
+    Parameters
+    ----------
+    image : (M, N, 3) array
+        Image to process.
+    threshold : int
+        Edge threshold, used only if lab_based is False.
+    lab_based: boolean
+        Considers edges in the LAB colour space, else in the gray scale.
+    line_filter: Boolean
+        Remove long line segment edges.
+    callback: Callable or None
+        If given, will be polled at regular intervals. Stages are timed if
+        callback has a span method - see inselect.lib.profiling.
+
+    Returns
+    -------
+    (edges, gray) : (M, N) uint8 array, (M, N) uint8 array
+        Edges and the blurred grayscale image.
+    """
+    import numpy as np
+
+    callback = callback or (lambda *args, **kwargs: None)
+
+    unblurred, gray = _blurred_gray(image, callback)
+    channels = _edge_channels(image, gray, threshold, lab_based, callback)
+
+    callback()
+
+    with span(callback, 'sobel') as s:
+        edges = None
+        for channel, channel_threshold in channels:
+            channel_edges = _edge_magnitude(channel, channel_threshold)
+            if edges is None:
+                edges = channel_edges
+            else:
+                np.bitwise_or(edges, channel_edges, out=edges)
+            del channel_edges
+            callback()
+        del channels
+        s.array('edges', edges)
+
+    if line_filter:
+        _filter_lines(edges, image, unblurred, callback)
+
+    return edges, gray
+
+
+class EdgeMaps(object):
+    """The gradient magnitudes and blurred grayscale image from which
+    segment_edges() detects objects, as computed by edge_maps(). Edges of any
+    window of the image can be computed from the maps much faster than from
+    the image, so an instance can be reused to segment many windows of the
+    same image.
+    """
+    def __init__(self, magnitudes, thresholds, gray):
+        # (C, M, N) float32 array of the gradient magnitudes of C channels
+        self.magnitudes = magnitudes
+        # C thresholds applied to the scaled magnitudes
+        self.thresholds = tuple(thresholds)
+        # (M, N) uint8 array
+        self.gray = gray
+
+    def __repr__(self):
+        return 'EdgeMaps({0}, {1})'.format(self.shape, self.thresholds)
+
+    @property
+    def shape(self):
+        "Tuple (height, width)"
+        return self.gray.shape
+
+    def crop(self, window):
+        """Returns a new instance of EdgeMaps of window (x, y, w, h). Arrays
+        are views of those of this instance.
+        """
+        x, y, w, h = window
+        return EdgeMaps(self.magnitudes[:, y:y + h, x:x + w],
+                        self.thresholds, self.gray[y:y + h, x:x + w])
+
+    def edges(self):
+        """Returns a binary uint8 image of edges, as computed by edge_map()
+        without line filtering. Magnitudes are scaled to the strongest
+        gradient in the maps, so the edges of a window are those of
+        segmenting the window itself, other than in its outermost pixels.
+        """
+        import numpy as np
+
+        edges = np.zeros(self.shape, dtype=np.uint8)
+        for magnitude, threshold in zip(self.magnitudes, self.thresholds):
+            # _threshold_scaled overwrites its argument
+            channel_edges = _threshold_scaled(np.array(magnitude), threshold)
+            np.bitwise_or(edges, channel_edges, out=edges)
+        return edges
+
+    def save(self, file, key=()):
+        """Writes the maps and key, a tuple of ints that identifies the
+        image, to file, a path or a file object, in compressed .npz format.
+
+        Magnitudes are written as uint16, scaled to the strongest gradient of
+        each channel, so the maps take about 2 bytes per pixel rather than 9.
+        Edges of windows of the loaded maps are almost always exactly those of
+        the original maps, but can differ in a few pixels.
+        """
+        import numpy as np
+
+        scaled = np.empty(self.magnitudes.shape, dtype=np.uint16)
+        for index, magnitude in enumerate(self.magnitudes):
+            magnitude = np.array(magnitude)
+            max_value = np.max(magnitude)
+            if max_value:
+                np.multiply(magnitude, 65535, out=magnitude)
+                np.divide(magnitude, max_value, out=magnitude)
+            scaled[index] = np.rint(magnitude, out=magnitude)
+        np.savez_compressed(file, magnitudes=scaled,
+                            thresholds=np.array(self.thresholds),
+                            gray=self.gray,
+                            key=np.array(key, dtype=np.int64))
+
+    @classmethod
+    def load(cls, file, key=None):
+        """Returns a new instance of EdgeMaps read from a file written by
+        save(), or None if key is given and is not the key that was saved
+        """
+        import numpy as np
+
+        with np.load(file) as maps:
+            if key is not None and tuple(maps['key'].tolist()) != tuple(key):
+                return None
+            else:
+                return cls(maps['magnitudes'].astype(np.float32),
+                           maps['thresholds'].tolist(), maps['gray'])
+
+
+def edge_maps(image, threshold=12, lab_based=True, callback=None):
+    """Computes the gradient magnitudes from which segment_edges detects
+    edges.
+
+    Parameters
+    ----------
+    image : (M, N, 3) array
+        Image to process.
+    threshold : int
+        Edge threshold, used only if lab_based is False.
+    lab_based: boolean
+        Considers edges in the LAB colour space, else in the gray scale.
+    callback: Callable or None
+        If given, will be polled at regular intervals. Stages are timed if
+        callback has a span method - see inselect.lib.profiling.
+
+    Returns
+    -------
+    maps : EdgeMaps
+    """
+    import numpy as np
+
+    callback = callback or (lambda *args, **kwargs: None)
+
+    unblurred, gray = _blurred_gray(image, callback)
+    del unblurred
+    channels = _edge_channels(image, gray, threshold, lab_based, callback)
+
+    callback()
+
+    with span(callback, 'sobel') as s:
+        magnitudes = np.empty((len(channels),) + gray.shape, dtype=np.float32)
+        for index, (channel, channel_threshold) in enumerate(channels):
+            magnitudes[index] = _gradient_magnitude(channel)
+            callback()
+        s.array('magnitudes', magnitudes)
+
+    return EdgeMaps(magnitudes, [t for c, t in channels], gray)
+
+
 # Values passed to segment_edges() before iss102 reorganisation
 # variance_threshold=100, resize=(5000, 5000), size_filter=1, line_filter=1
 def segment_edges(image, window=None, threshold=12, lab_based=True,
                   variance_threshold=100, resize=False, size_filter=1,
-                  line_filter=1, callback=None):
+                  line_filter=1, callback=None, shape=None, maps=None):
     """Segments an image based on edge intensities.
 
     Parameters
@@ -193,8 +562,16 @@ def segment_edges(image, window=None, threshold=12, lab_based=True,
     line_filter: Boolean
         Remove long line segment edges.
     callback: Callable or None
-        If given, should be a callable that takes no arguments. It will be
-        polled at regular intervals.
+        If given, should be a callable that takes an optional message. It will
+        be polled at regular intervals. Stages are timed if callback has a
+        span method - see inselect.lib.profiling.
+    shape : tuple
+        Optional (height, width) against which the sizes of objects are
+        judged. Defaults to the shape of the (resized) image.
+    maps : EdgeMaps
+        Optional edge maps of image, as returned by edge_maps(), from which
+        edges are computed rather than from image. Cannot be used with
+        resize.
 
     Returns
     -------
@@ -204,6 +581,9 @@ def segment_edges(image, window=None, threshold=12, lab_based=True,
     import cv2
     import numpy as np
 
+    if maps is not None and resize:
+        raise ValueError('maps cannot be used with resize')
+
     if not callback:
         def swallow(*args, **kwargs):
             pass
@@ -212,79 +592,57 @@ def segment_edges(image, window=None, threshold=12, lab_based=True,
     callback('Preparing to segment')
 
     if window:
-        subimage = np.array(image)
         x, y, w, h = window
-        image = subimage[y:y + h, x:x + w]
+        image = image[y:y + h, x:x + w]
+        if maps is not None:
+            maps = maps.crop(window)
 
     original_height, original_width = image.shape[:2]
     if resize:
-        image = cv2.resize(image, resize)
+        with span(callback, 'resize') as s:
+            image = cv2.resize(image, resize)
+            s.array('image', image)
 
     callback()
 
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    gray = cv2.GaussianBlur(gray, (3, 3), 3)
-    display = gray.copy()
-    if not lab_based:
-        v_edges = cv2.Sobel(gray, cv2.CV_32F, 1, 0, None, 1)
-        h_edges = cv2.Sobel(gray, cv2.CV_32F, 0, 1, None, 1)
-        mag = np.sqrt(v_edges ** 2 + h_edges ** 2)
-        mag2 = (255*mag/np.max(mag)).astype(np.uint8)
-        _, mag2 = cv2.threshold(mag2, threshold, 255, cv2.THRESH_BINARY)
+    if maps is None:
+        mag2, gray = edge_map(image, threshold, lab_based, line_filter,
+                              callback)
+    elif maps.shape != image.shape[:2]:
+        raise ValueError('maps should be of the same size as image')
     else:
-        image2 = cv2.GaussianBlur(image, (3, 3), 3)
-        lab_image = cv2.cvtColor(image2, cv2.COLOR_BGR2LAB)
-        # L component
-
-        callback()
-
-        channel = np.array(lab_image[:, :, 0])
-        v_edges = cv2.Sobel(channel, cv2.CV_32F, 1, 0, None, 1)
-        h_edges = cv2.Sobel(channel, cv2.CV_32F, 0, 1, None, 1)
-        mag = np.sqrt(v_edges ** 2 + h_edges ** 2)
-        mag0 = (255*mag/np.max(mag)).astype(np.uint8)
-        threshold = 10
-
-        callback()
-
-        _, mag0 = cv2.threshold(mag0, threshold, 255, cv2.THRESH_BINARY)
-        # B component
-        channel = np.array(lab_image[:, :, 2])
-        v_edges = cv2.Sobel(channel, cv2.CV_32F, 1, 0, None, 1)
-        h_edges = cv2.Sobel(channel, cv2.CV_32F, 0, 1, None, 1)
-
-        callback()
-
-        mag = np.sqrt(v_edges ** 2 + h_edges ** 2)
-        mag2 = (255*mag/np.max(mag)).astype(np.uint8)
-        threshold = 40
-        _, mag2 = cv2.threshold(mag2, threshold, 255, cv2.THRESH_BINARY)
-        mag2 = mag0 | mag2
-    if line_filter:
-        mask = remove_lines(image)
-        mag2[mask == 255] = 0
+        with span(callback, 'edges from maps') as s:
+            mag2, gray = maps.edges(), maps.gray
+            s.array('edges', mag2)
+        if line_filter:
+            unblurred = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            _filter_lines(mag2, image, unblurred, callback)
 
     callback('Detecting contours')
 
     display = np.dstack((mag2, mag2, mag2))
-    contours, hierarchy = _find_contours(mag2.copy(),
-                                         cv2.RETR_TREE,
-                                         cv2.CHAIN_APPROX_SIMPLE)
+    with span(callback, 'findContours') as s:
+        contours, hierarchy = _find_contours(mag2,
+                                             cv2.RETR_TREE,
+                                             cv2.CHAIN_APPROX_SIMPLE)
+        s.set(contours=len(contours))
 
     callback('Processing contours')
 
-    rects = _process_contours(display, contours, hierarchy,
-                              callback, size_filter=size_filter)
+    with span(callback, 'contour processing') as s:
+        rects = _process_contours(display, contours, hierarchy, callback,
+                                  size_filter=size_filter, shape=shape)
+        s.set(rects=len(rects))
 
     callback()
 
     if variance_threshold:
-        new_rects = []
-        for rect in rects:
-            im = gray[rect[1]:rect[1]+rect[3], rect[0]:rect[0]+rect[2]]
-            if np.var(im) > variance_threshold:
-                new_rects.append(rect)
-        rects = new_rects
+        with span(callback, 'variance filter') as s:
+            if rects:
+                variances = _variances(_integrals(gray), rects)
+                rects = [rect for rect, variance in zip(rects, variances)
+                         if variance > variance_threshold]
+            s.set(rects=len(rects))
     if window:
         new_rects = []
         for rect in rects:
@@ -305,6 +663,483 @@ def segment_edges(image, window=None, threshold=12, lab_based=True,
     return rects, display
 
 
+def _tile_starts(length, tile_size, overlap):
+    """Returns a list of the starts of tiles of tile_size along an axis of
+    length, each overlapping the next by at least overlap
+    """
+    if length <= tile_size:
+        return [0]
+    else:
+        starts = list(range(0, length - tile_size, tile_size - overlap))
+        starts.append(length - tile_size)
+        return starts
+
+
+def _tile_cores(starts, length, tile_size):
+    """Returns a list of tuples (start, end) of the parts of each tile that
+    are closer to its centre than to that of any other tile, split half-way
+    across the overlap between neighbouring tiles
+    """
+    seams = [(next_start + start + tile_size) // 2
+             for start, next_start in zip(starts, starts[1:])]
+    return list(zip([0] + seams, seams + [length]))
+
+
+def _intersection(a, b):
+    "Returns the rect (x, y, w, h) of the intersection of a and b, or None"
+    left, top = max(a[0], b[0]), max(a[1], b[1])
+    right = min(a[0] + a[2], b[0] + b[2])
+    bottom = min(a[1] + a[3], b[1] + b[3])
+    if right > left and bottom > top:
+        return (left, top, right - left, bottom - top)
+    else:
+        return None
+
+
+def _iou(a, b):
+    "Returns the intersection over union of rects a and b"
+    intersection = _intersection(a, b)
+    if intersection:
+        i = intersection[2] * intersection[3]
+        return float(i) / (a[2] * a[3] + b[2] * b[3] - i)
+    else:
+        return 0.0
+
+
+def _intersection_areas(a, b):
+    """Returns an array of shape (len(a), len(b)) of the areas of the
+    intersections of each rect (x, y, w, h) in a with each in b
+    """
+    import numpy as np
+
+    a, b = RectArray(a).coordinates[:, None], RectArray(b).coordinates[None]
+    sides = np.minimum(a[..., 2:], b[..., 2:]) - np.maximum(a[..., :2],
+                                                            b[..., :2])
+    return np.prod(np.clip(sides, 0, None), axis=-1)
+
+
+def _within(rects, others, fraction=0.9):
+    """Returns a boolean array that is True where at least fraction of the
+    area of each of rects lies within any one of others. The tolerance allows
+    for the small differences between the edges of an object as found in
+    different tiles.
+    """
+    area = rects[:, 2] * rects[:, 3]
+    return (_intersection_areas(rects, others) >=
+            fraction * area[:, None]).any(axis=1)
+
+
+def _merge_tiled_rects(tiles, results, shape, size_filter=True,
+                       fraction=0.9):
+    """Returns a tuple (rects, fragmented). rects is a list of rects
+    (x, y, w, h) of the objects found in tiles. fragmented is an array of
+    shape (n, 4) of the rects of objects that were not wholly within any
+    tile; if there are any, rects is not reliable.
+
+    tiles - a list of tuples (x0, y0, x1, y1, core x0, core y0, core x1,
+    core y1, interior edges)
+    results - a list of integer arrays of shape (n, 4) of the rects found in
+    each tile, in image coordinates
+    shape - the (height, width) of the image
+    size_filter - as for _right_sized
+
+    A rect that does not touch the interior edges of its tile is whole. Whole
+    rects that are found in more than one tile are kept once - preferably
+    from the tile in whose core lies its centre. Rects that are cut by the
+    edges of their tile are merged with the cut rects of other tiles that
+    agree with them within the overlap between the two tiles. Merged rects
+    that are of the shape of objects of interest, as judged by _right_sized,
+    and that do not lie within a whole rect are fragmented - objects larger
+    than the overlap between tiles that cross the edges of tiles.
+
+    Finally, as _process_contours does not descend the hierarchy below
+    contours of interest, whole rects that are details of objects found
+    whole by other tiles are discarded. A rect lies within another if at
+    least fraction of its area does.
+    """
+    import numpy as np
+
+    bounds = np.array([t[:4] for t in tiles], dtype=np.int64)
+    cores = np.array([t[4:8] for t in tiles], dtype=np.int64)
+    interior = np.array([t[8] for t in tiles], dtype=bool)
+    tile_rects = np.hstack((bounds[:, :2], bounds[:, 2:] - bounds[:, :2]))
+
+    rects = np.concatenate(results).reshape(-1, 4)
+    tile = np.repeat(np.arange(len(tiles)), [len(r) for r in results])
+
+    left, top = rects[:, 0], rects[:, 1]
+    right, bottom = left + rects[:, 2], top + rects[:, 3]
+    x0, y0, x1, y1 = bounds[tile].T
+    edges = interior[tile]
+    is_cut = ((edges[:, 0] & (left <= x0)) | (edges[:, 1] & (top <= y0)) |
+              (edges[:, 2] & (right >= x1)) | (edges[:, 3] & (bottom >= y1)))
+    centre_x, centre_y = (left + right) / 2.0, (top + bottom) / 2.0
+    cx0, cy0, cx1, cy1 = cores[tile].T
+    in_core = ((cx0 <= centre_x) & (centre_x < cx1) &
+               (cy0 <= centre_y) & (centre_y < cy1))
+
+    # Whole rects, with those in the core of their tile first
+    whole = np.flatnonzero(~is_cut)
+    whole = whole[np.argsort(~in_core[whole], kind='stable')]
+    duplicates = ((RectArray(rects[whole]).iou(rects[whole]) > 0.5) &
+                  (tile[whole][:, None] != tile[whole][None]))
+    keep = np.zeros(len(whole), dtype=bool)
+    for i in range(len(whole)):
+        keep[i] = not duplicates[i, keep].any()
+    whole = whole[keep]
+
+    fragmented = _fragmented(rects[is_cut], tile[is_cut], tile_rects,
+                             rects[whole], shape, size_filter, fraction)
+
+    # Whole rects that lie within a larger whole rect found by another tile
+    # that contains them but did not find them
+    kept, kept_tile = rects[whole], tile[whole]
+    kept_area = kept[:, 2] * kept[:, 3]
+    within = (_intersection_areas(kept, kept) >=
+              fraction * kept_area[:, None])
+    seen = (_intersection_areas(kept, tile_rects) >=
+            fraction * kept_area[:, None])
+    found = np.zeros((len(kept), len(tiles)), dtype=bool)
+    rows, columns = np.nonzero(RectArray(kept).iou(rects) > 0.5)
+    found[rows, tile[columns]] = True
+    part_of = (within & (kept_tile[:, None] != kept_tile[None]) &
+               seen[:, kept_tile] & ~found[:, kept_tile])
+
+    # Largest first, so that rects are tested only against those returned
+    outermost = np.zeros(len(kept), dtype=bool)
+    for i in np.argsort(-kept_area, kind='stable'):
+        outermost[i] = not part_of[i, outermost].any()
+    return [tuple(r) for r in kept[outermost].tolist()], fragmented
+
+
+def _fragmented(cut, tile, tile_rects, whole, shape, size_filter, fraction):
+    """Returns an array of shape (n, 4) of the rects of objects that are
+    assembled from the rects in cut, found in tiles and cut by their edges,
+    that are of the shape of objects of interest and that do not lie within
+    any of the rects in whole. tile are the indices of the tiles in which
+    the rects in cut were found.
+    """
+    import numpy as np
+
+    # Pairs of overlapping cut rects from different tiles
+    i, j = np.nonzero(np.triu(_intersection_areas(cut, cut) > 0, 1) &
+                      (tile[:, None] != tile[None]))
+
+    # The parts of the rects within the overlap between their tiles
+    overlap = RectArray(tile_rects[tile[i]]).intersect(tile_rects[tile[j]])
+    a = RectArray(cut[i]).intersect(overlap)
+    b = RectArray(cut[j]).intersect(overlap)
+    intersection = a.intersect(b)
+    shared = (np.clip(intersection.width, 0, None) *
+              np.clip(intersection.height, 0, None))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        agree = ((a.width > 0) & (a.height > 0) & (b.width > 0) &
+                 (b.height > 0) & (shared / (a.area + b.area - shared) > 0.5))
+
+    # Union-find of cut rects that are parts of the same object
+    parent = list(range(len(cut)))
+
+    def root(k):
+        while parent[k] != k:
+            parent[k] = parent[parent[k]]
+            k = parent[k]
+        return k
+
+    for first, second in zip(i[agree].tolist(), j[agree].tolist()):
+        parent[root(first)] = root(second)
+
+    _, group = np.unique([root(k) for k in range(len(cut))],
+                         return_inverse=True)
+    n_groups = group.max() + 1 if len(group) else 0
+    left = np.full(n_groups, np.iinfo(np.int64).max)
+    top = left.copy()
+    right = np.full(n_groups, np.iinfo(np.int64).min)
+    bottom = right.copy()
+    np.minimum.at(left, group, cut[:, 0])
+    np.minimum.at(top, group, cut[:, 1])
+    np.maximum.at(right, group, cut[:, 0] + cut[:, 2])
+    np.maximum.at(bottom, group, cut[:, 1] + cut[:, 3])
+    merged = np.column_stack((left, top, right - left, bottom - top))
+
+    # The contours of merged rects are not known, so neither are their fill
+    # ratios - parts of containers are not excluded
+    objects = merged[_is_right_sized(merged[:, 2], merged[:, 3], None, shape,
+                                     container_filter=False,
+                                     size_filter=size_filter)]
+    return objects[~_within(objects, whole, fraction)]
+
+
+def segment_edges_tiled(image, tile_size=DEFAULT_TILE_SIZE,
+                        overlap=DEFAULT_TILE_OVERLAP, threads=None,
+                        callback=None, **kwargs):
+    """Segments an image based on edge intensities by splitting it into
+    overlapping tiles, which are segmented in parallel by segment_edges.
+    Suitable for large images, which can be segmented at full resolution.
+
+    Objects larger than overlap that cross the edges of tiles are not found
+    whole by any tile. If there are any, the image is segmented again with a
+    larger overlap or, if they are too large for that, by segment_edges
+    without tiles.
+
+    Parameters
+    ----------
+    image : (M, N, 3) array
+        Image to process.
+    tile_size : int
+        Width and height of tiles.
+    overlap : int
+        Minimum overlap between adjacent tiles. Objects smaller than this are
+        wholly contained within at least one tile.
+    threads : int
+        Number of tiles to segment at once. Defaults to the number of CPUs.
+        Callers that segment several images at once, in different processes,
+        should share the CPUs between them.
+    callback: Callable or None
+        If given, will be polled at regular intervals.
+    kwargs :
+        Passed to segment_edges.
+
+    Returns
+    -------
+    (rects, display) : list, (M, N, 3) array
+        Region results and visualization image.
+    """
+    import numpy as np
+
+    if not 0 <= overlap < tile_size:
+        msg = 'overlap should be at least 0 and less than tile_size'
+        raise ValueError(msg)
+
+    callback = callback or (lambda *args, **kwargs: None)
+    callback('Preparing to segment')
+
+    height, width = image.shape[:2]
+    x_starts = _tile_starts(width, tile_size, overlap)
+    y_starts = _tile_starts(height, tile_size, overlap)
+    x_cores = _tile_cores(x_starts, width, tile_size)
+    y_cores = _tile_cores(y_starts, height, tile_size)
+    tiles = []
+    for y0, (cy0, cy1) in zip(y_starts, y_cores):
+        for x0, (cx0, cx1) in zip(x_starts, x_cores):
+            x1, y1 = min(width, x0 + tile_size), min(height, y0 + tile_size)
+            interior = (x0 > 0, y0 > 0, x1 < width, y1 < height)
+            tiles.append((x0, y0, x1, y1, cx0, cy0, cx1, cy1, interior))
+
+    debug_print('Segmenting [{0}] tiles of [{1}] pixels'.format(
+        len(tiles), tile_size
+    ))
+
+    # Objects are judged against the size of the whole image. Only the
+    # calling thread reports progress.
+    tile_kwargs = dict(kwargs, shape=(height, width),
+                       callback=spans_only(callback))
+
+    def segment_tile(tile):
+        x0, y0, x1, y1 = tile[:4]
+        with span(callback, 'tile', x=x0, y=y0):
+            rects, display = segment_edges(image[y0:y1, x0:x1],
+                                           **tile_kwargs)
+        rects = np.array([r[:4] for r in rects], dtype=np.int64)
+        return rects.reshape(-1, 4) + (x0, y0, 0, 0), display
+
+    display = np.zeros((height, width, 3), dtype=np.uint8)
+    results = [None] * len(tiles)
+    threads = threads if threads else (os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = {pool.submit(segment_tile, tile): index
+                   for index, tile in enumerate(tiles)}
+        try:
+            for future in as_completed(futures):
+                index = futures[future]
+                results[index], tile_display = future.result()
+                # Visualisation of each tile's core
+                x0, y0, _, _, cx0, cy0, cx1, cy1, _ = tiles[index]
+                display[cy0:cy1, cx0:cx1] = tile_display[
+                    cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0
+                ]
+                callback('Segmented [{0}] of [{1}] tiles'.format(
+                    sum(r is not None for r in results), len(tiles)
+                ))
+        finally:
+            # Do not start outstanding tiles if the callback raised
+            for future in futures:
+                future.cancel()
+
+    callback('Merging tiles')
+    with span(callback, 'merge tiles') as s:
+        rects, fragmented = _merge_tiled_rects(
+            tiles, results, (height, width), kwargs.get('size_filter', 1)
+        )
+        # Objects no larger than overlap are wholly within at least one tile
+        # - these are parts of larger objects or of containers
+        fragmented = fragmented[fragmented[:, 2:].max(axis=1) > overlap]
+        s.set(rects=len(rects), fragmented=len(fragmented))
+
+    if not len(fragmented):
+        return rects, display
+    else:
+        # Enough overlap for the largest of the objects to be wholly within a
+        # tile, with a margin for the blurring of edges
+        largest = int(fragmented[:, 2:].max())
+        needed = int(np.ceil(1.25 * largest))
+        if needed < tile_size:
+            msg = ('[{0}] objects are larger than the overlap of [{1}] pixels '
+                   '- segmenting again with an overlap of [{2}] pixels')
+            debug_print(msg.format(len(fragmented), overlap, needed))
+            return segment_edges_tiled(image, tile_size, needed, threads,
+                                       callback, **kwargs)
+        else:
+            msg = ('Objects of [{0}] pixels are too large for tiles of [{1}] '
+                   'pixels - segmenting whole image')
+            debug_print(msg.format(largest, tile_size))
+            return segment_edges(image, callback=callback, **kwargs)
+
+
+def _merge_windows(windows):
+    """Returns a list of windows (x, y, w, h) in which overlapping windows
+    are replaced by their union
+    """
+    windows = list(windows)
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for window in windows:
+            for index, other in enumerate(result):
+                if _intersection(window, other):
+                    left = min(window[0], other[0])
+                    top = min(window[1], other[1])
+                    right = max(window[0] + window[2], other[0] + other[2])
+                    bottom = max(window[1] + window[3], other[1] + other[3])
+                    result[index] = (left, top, right - left, bottom - top)
+                    merged = True
+                    break
+            else:
+                result.append(window)
+        windows = result
+    return windows
+
+
+def segment_edges_pyramid(image, resize=False,
+                          coarse_width=DEFAULT_COARSE_WIDTH, margin=0.1,
+                          max_coverage=0.5, callback=None, **kwargs):
+    """Segments an image based on edge intensities, coarse to fine. The
+    image is first segmented at a width of coarse_width pixels. Regions
+    around the objects that are found are then segmented at full resolution
+    (or at the size given by resize). Much faster than segment_edges for
+    images in which objects cover a small part of the image. The whole image
+    is segmented at full resolution, as by segment_edges, if the coarse level
+    contains no objects, if any of its objects are large enough to be
+    containers - the objects within which might not be found by refining
+    regions - or if the regions cover more than max_coverage of the image.
+
+    Parameters
+    ----------
+    image : (M, N, 3) array
+        Image to process.
+    resize : tuple or False
+        Optional size to which image is resized for the fine segmentation, as
+        for segment_edges.
+    coarse_width : int
+        Width of the coarse level.
+    margin : float
+        Regions are the coarse objects expanded by this proportion of their
+        size on each side.
+    max_coverage : float
+        Proportion of the image above which regions are not refined.
+    callback: Callable or None
+        If given, will be polled at regular intervals.
+    kwargs :
+        Passed to segment_edges.
+
+    Returns
+    -------
+    (rects, display) : list, (M, N, 3) array
+        Region results and visualization image.
+    """
+    import cv2
+    import numpy as np
+
+    callback = callback or (lambda *args, **kwargs: None)
+    callback('Preparing to segment')
+
+    height, width = image.shape[:2]
+    fine = cv2.resize(image, resize) if resize else image
+    fine_height, fine_width = fine.shape[:2]
+
+    factor = float(coarse_width) / width
+    coarse_height = max(1, int(round(height * factor)))
+    coarse = cv2.resize(image, (coarse_width, coarse_height),
+                        interpolation=cv2.INTER_AREA)
+
+    callback('Segmenting coarse level')
+    with span(callback, 'coarse level') as s:
+        s.array('image', coarse)
+        rects, _ = segment_edges(coarse, callback=spans_only(callback),
+                                 **kwargs)
+
+    if not rects:
+        debug_print('No objects at the coarse level - segmenting whole image')
+        return segment_edges(image, resize=resize, callback=callback, **kwargs)
+    elif any(w > coarse_width * CONTAINER_PROPORTION or
+             h > coarse_height * CONTAINER_PROPORTION
+             for w, h in (r[2:4] for r in rects)):
+        debug_print('Possible containers at the coarse level - segmenting '
+                    'whole image')
+        return segment_edges(image, resize=resize, callback=callback, **kwargs)
+
+    # Regions of interest in the fine image
+    fx = float(fine_width) / coarse_width
+    fy = float(fine_height) / coarse_height
+    windows = []
+    for x, y, w, h in (r[:4] for r in rects):
+        # At least a few coarse pixels of margin
+        dx, dy = max(4, margin * w), max(4, margin * h)
+        left = max(0, int((x - dx) * fx))
+        top = max(0, int((y - dy) * fy))
+        right = min(fine_width, int(np.ceil((x + w + dx) * fx)))
+        bottom = min(fine_height, int(np.ceil((y + h + dy) * fy)))
+        windows.append((left, top, right - left, bottom - top))
+    windows = _merge_windows(windows)
+
+    coverage = (sum(w * h for _, _, w, h in windows) /
+                float(fine_width * fine_height))
+    if coverage > max_coverage:
+        msg = 'Regions cover [{0:.0%}] of the image - segmenting whole image'
+        debug_print(msg.format(coverage))
+        return segment_edges(image, resize=resize, callback=callback, **kwargs)
+
+    msg = 'Refining [{0}] regions covering [{1:.0%}] of the image'
+    debug_print(msg.format(len(windows), coverage))
+
+    # Objects are judged against the size of the whole image
+    kwargs['shape'] = (fine_height, fine_width)
+
+    display = np.zeros((fine_height, fine_width, 3), dtype=np.uint8)
+    fine_rects = []
+    for index, (x, y, w, h) in enumerate(windows):
+        callback('Refining region [{0}] of [{1}]'.format(
+            1 + index, len(windows)
+        ))
+        with span(callback, 'refine region', x=x, y=y, w=w, h=h):
+            window_rects, window_display = segment_edges(
+                fine[y:y + h, x:x + w], callback=spans_only(callback),
+                **kwargs
+            )
+        fine_rects.extend(
+            (r[0] + x, r[1] + y, r[2], r[3]) for r in window_rects
+        )
+        display[y:y + h, x:x + w] = window_display
+
+    if resize:
+        display = cv2.resize(display, (width, height))
+        fx, fy = float(width) / fine_width, float(height) / fine_height
+        fine_rects = [(x * fx, y * fy, w * fx, h * fy)
+                      for x, y, w, h in fine_rects]
+
+    return fine_rects, display
+
+
 def segment_intensity(image, window=None):
     import cv2
     import numpy as np
@@ -337,7 +1172,8 @@ def segment_intensity(image, window=None):
     return rects, display
 
 
-def segment_grabcut(image, window=None, seeds=[]):
+def segment_grabcut(image, window=None, seeds=[], maps=None,
+                    max_pixels=DEFAULT_GRABCUT_MAX_PIXELS):
     """Segments an image using grabcut technique. Initialised with edges.
 
     Parameters
@@ -346,6 +1182,15 @@ def segment_grabcut(image, window=None, seeds=[]):
         Image to process.
     window : tuple, (x, y, w, h)
         Optional subwindow in image.
+    seeds : list
+        Optional points (x, y), relative to the top-left of the window,
+        one in each object to be found.
+    maps : EdgeMaps
+        Optional edge maps of image, as returned by edge_maps(), from which
+        the initial edges are computed rather than from image.
+    max_pixels : int
+        Windows of more than this many pixels are reduced to this many
+        pixels before they are segmented.
 
     Returns
     -------
@@ -356,11 +1201,28 @@ def segment_grabcut(image, window=None, seeds=[]):
     import numpy as np
 
     if window:
-        subimage = np.array(image)
+        # A view - memory is proportional to the window, not to the image
         x, y, w, h = window
-        image = subimage[y:y + h, x:x + w]
+        image = image[y:y + h, x:x + w]
+        if maps is not None:
+            maps = maps.crop(window)
+
+    height, width = image.shape[:2]
+    factor = min(1.0, np.sqrt(float(max_pixels) / (width * height)))
+    if factor < 1:
+        size = (max(1, int(width * factor)), max(1, int(height * factor)))
+        debug_print('Reducing window from [{0}] to [{1}]'.format(
+            (width, height), size
+        ))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        seeds = [(min(size[0] - 1, int(sx * factor)),
+                  min(size[1] - 1, int(sy * factor))) for sx, sy in seeds]
+        # Maps are of the full-resolution window
+        maps = None
+
     rects, display = segment_edges(image, variance_threshold=100,
-                                   line_filter=0, size_filter=0)
+                                   line_filter=0, size_filter=0, maps=maps)
+    # Unblurred, unlike the grayscale image used by segment_edges
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     (k, mag0) = cv2.threshold(gray, 128, 255, cv2.THRESH_BINARY_INV |
                               cv2.THRESH_OTSU)
@@ -373,22 +1235,22 @@ def segment_grabcut(image, window=None, seeds=[]):
         cv2.drawContours(initial, [rect[4]], -1, int(cv2.GC_FGD), -1)
 
     initial[display[:, :, 0] > 0] = cv2.GC_PR_FGD
+    del display, mag0
     bgmodel = np.zeros((1, 65), np.float64)
     fgmodel = np.zeros((1, 65), np.float64)
     mask = initial
     rect = None
     cv2.grabCut(image, mask, rect, bgmodel, fgmodel, 1, cv2.GC_INIT_WITH_MASK)
-    mask2 = np.where((mask == 2) | (mask == 0), 0, 1).astype('uint8')
+    # GC_FGD and GC_PR_FGD are odd, GC_BGD and GC_PR_BGD are even
+    mask2 = np.bitwise_and(mask, 1, out=mask)
 
     contours, hierarchy = _find_contours(mask2.copy(),
                                          cv2.RETR_EXTERNAL,
                                          cv2.CHAIN_APPROX_SIMPLE)
     rects = [cv2.boundingRect(c) for c in contours]
 
-    display = np.dstack(3 * [255 * mask2.astype(np.uint8)])
+    display = np.dstack(3 * [255 * mask2])
     if seeds:
-        DIST_L2 = cv2.cv.CV_DIST_L2 if hasattr(cv2, 'cv') else cv2.DIST_L2
-        distance = cv2.distanceTransform(mask2, DIST_L2, 3)
         markers = np.zeros(mask2.shape, dtype=np.int32)
         markers[mask2 == 0] = 255
         for i, seed in enumerate(seeds):
@@ -398,30 +1260,39 @@ def segment_grabcut(image, window=None, seeds=[]):
             cv2.watershed(display, markers)
         else:
             markers = watershed(mask2, markers, mask=mask2)
+
+        # The bounding boxes of the regions of all seeds in a single pass.
+        # Watershed separates regions with boundaries of -1, so each region
+        # is a 4-connected component.
+        seeded = ((markers > 0) & (markers <= len(seeds))).astype(np.uint8)
+        del markers
+        n, labels, stats, _ = cv2.connectedComponentsWithStats(
+            seeded, connectivity=4, ltype=cv2.CV_32S
+        )
+        del seeded
         new_rects = []
-        for i, seed in enumerate(seeds):
-            mask = np.array(markers == i + 1, dtype=np.uint8)
-            contours, _ = _find_contours(mask,
-                                         cv2.RETR_EXTERNAL,
-                                         cv2.CHAIN_APPROX_SIMPLE)
-            if contours:
-                contours.sort(key=cv2.contourArea)
-                new_rects.append(cv2.boundingRect(contours[0]))
+        for sx, sy in seeds:
+            label = labels[sy, sx]
+            if label:
+                rx, ry, rw, rh = stats[label, :4].tolist()
+                new_rects.append((rx, ry, rw, rh))
                 colour = [randint(100, 255), randint(100, 255), 0]
-                cv2.drawContours(display, [contours[0]], -1, colour, -1)
+                region = display[ry:ry + rh, rx:rx + rw]
+                region[labels[ry:ry + rh, rx:rx + rw] == label] = colour
         rects = new_rects
     if window:
-        new_rects = []
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        for rect in rects:
-            dx, dy = 0, 0
-            new_rect = (rect[0] + x - dx, rect[1] + y - dy,
-                        rect[2] + 2 * dx, rect[3] + 2 * dy)
-
-            im = gray[rect[1]:rect[1]+rect[3], rect[0]:rect[0]+rect[2]]
-            if np.var(im) > 200 and rect[2] * rect[3] > w * h / 4E3:
-                new_rects.append(new_rect)
-        rects = new_rects
+        if rects:
+            variances = _variances(_integrals(gray), rects)
+            rects = [rect for rect, variance in zip(rects, variances)
+                     if variance > 200 and rect[2] * rect[3] > w * h / 4E3]
+    if factor < 1:
+        fx, fy = float(width) / w, float(height) / h
+        rects = [(int(rx * fx), int(ry * fy), int(round(rw * fx)),
+                  int(round(rh * fy))) for rx, ry, rw, rh in rects]
+        display = cv2.resize(display, (width, height),
+                             interpolation=cv2.INTER_NEAREST)
+    if window:
+        rects = [(rx + x, ry + y, rw, rh) for rx, ry, rw, rh in rects]
     return rects, display
 
 
@@ -1,5 +1,12 @@
-from .rect import Rect
-from .segment import segment_edges, segment_grabcut
+import os
+import tempfile
+
+from zipfile import BadZipFile
+
+from .rect import Rect, RectArray
+from .segment import (EdgeMaps, edge_maps, segment_edges,
+                      segment_edges_pyramid, segment_edges_tiled,
+                      segment_grabcut)
 from .sort_document_items import sort_document_items
 from .utils import debug_print
 
@@ -8,20 +15,47 @@ from .utils import debug_print
 
 SEGMENTATION_PREFERRED_WIDTH = 4096
 
+# Map from _image_key() to the EdgeMaps of the most recently segmented image
+_EDGE_MAPS = {}
+
+
+def _image_key(img):
+    "A key that identifies the pixels of the InselectImage img"
+    stat = img.path.stat()
+    return (str(img.path.resolve()), stat.st_mtime_ns, stat.st_size)
+
 
 class SegmentDocument(object):
     """Segments and sub-segments documents, applies padding to rects
     and orders rects.
+
+    If cache_edge_maps is True, the edge maps computed by segment() are kept
+    in memory, and, if save_edge_maps is True, written alongside the
+    document, at a cost of about 2 bytes per pixel. subsegment() crops the
+    kept or saved maps of the image, if there are any, rather than detecting
+    edges afresh.
     """
-    def __init__(self, sort_by_columns=False):
+    def __init__(self, sort_by_columns=False, cache_edge_maps=False,
+                 save_edge_maps=False):
         self.sort_by_columns = sort_by_columns
+        self.cache_edge_maps = cache_edge_maps
+        self.save_edge_maps = save_edge_maps
 
-    def segment(self, doc, resize=None, *args, **kwargs):
+    def segment(self, doc, resize=None, *args, tile_size=None, pyramid=False,
+                **kwargs):
         """Returns doc with items replaced by the result of calling segment_edges().
         The caller is responsible for saving doc.
+
+        If tile_size is given, the full-resolution scan, if available, is
+        segmented in tiles of tile_size pixels by segment_edges_tiled().
+        If pyramid is True, the image is segmented coarse to fine by
+        segment_edges_pyramid().
         """
         debug_print('Segmenting [{0}]'.format(doc))
 
+        if tile_size:
+            return self._segment_tiled(doc, tile_size, **kwargs)
+
         # Document promises that either the thumbnail or scanned image will be
         # available
         if doc.thumbnail.available:
@@ -46,10 +80,45 @@ class SegmentDocument(object):
             debug_print('Image is of the preferred size or larger')
             resize = False
 
-        rects, display_image = segment_edges(
-            img.array, resize=resize, *args, **kwargs
+        if pyramid:
+            fn = segment_edges_pyramid
+        else:
+            fn = segment_edges
+            keep = self.cache_edge_maps or self.save_edge_maps
+            if keep and not resize and not args and not (
+                    {'threshold', 'lab_based'}.intersection(kwargs)):
+                # Edge maps for subsegment(), which uses default parameters
+                # and the image at its original size
+                kwargs['maps'] = edge_maps(img.array,
+                                           callback=kwargs.get('callback'))
+                self._keep_edge_maps(doc, img, kwargs['maps'])
+
+        rects, display_image = fn(img.array, resize=resize, *args, **kwargs)
+
+        return self._new_items(doc, img, rects), display_image
+
+    def _segment_tiled(self, doc, tile_size, **kwargs):
+        """Returns doc with items replaced by the result of calling
+        segment_edges_tiled() on the full-resolution scan
+        """
+        if doc.scanned.available:
+            img = doc.scanned
+            debug_print('Will segment tiles of full-res scan [{0}]'.format(
+                img
+            ))
+        else:
+            img = doc.thumbnail
+            debug_print('Will segment tiles of thumbnail [{0}]'.format(img))
+
+        rects, display_image = segment_edges_tiled(
+            img.array, tile_size, **kwargs
         )
+        return self._new_items(doc, img, rects), display_image
 
+    def _new_items(self, doc, img, rects):
+        """Returns a copy of doc with items replaced by rects, in pixels of
+        img
+        """
         rects = self._post_process_rects(img, rects)
 
         # Create item dicts
@@ -63,7 +132,7 @@ class SegmentDocument(object):
 
         debug_print('Segmented [{0}]'.format(doc))
 
-        return doc, display_image
+        return doc
 
     def subsegment(self, doc, row, seeds, *args, **kwargs):
         """seeds - a list of tuples (x, y) with coordinates relative to
@@ -82,7 +151,8 @@ class SegmentDocument(object):
 
         items = doc.items
         window = next(img.from_normalised([items[row]['rect']]))
-        rects, display = segment_grabcut(img.array, window, seeds)
+        rects, display = segment_grabcut(img.array, window, seeds,
+                                         maps=self._edge_maps(doc, img))
 
         rects = list(self._post_process_rects(img, rects))
 
@@ -108,15 +178,70 @@ class SegmentDocument(object):
 
         return items, display_image
 
+    def _keep_edge_maps(self, doc, img, maps):
+        """Keeps maps, the EdgeMaps of img, in memory if
+        self.cache_edge_maps and writes them to doc.edge_maps_path if
+        self.save_edge_maps
+        """
+        key = _image_key(img)
+        if self.cache_edge_maps:
+            _EDGE_MAPS.clear()
+            _EDGE_MAPS[key] = maps
+        if self.save_edge_maps:
+            path = doc.edge_maps_path
+            debug_print('Writing edge maps to [{0}]'.format(path))
+            # Write to a temporary file and rename, so that readers never see
+            # partial maps
+            fd, temp = tempfile.mkstemp(suffix='.tmp', dir=str(path.parent))
+            try:
+                with os.fdopen(fd, 'wb') as outfile:
+                    maps.save(outfile, key[1:])
+                os.replace(temp, str(path))
+            except Exception:
+                os.unlink(temp)
+                raise
+
+    def _edge_maps(self, doc, img):
+        """Returns the EdgeMaps of img kept in memory or written alongside
+        doc, or None if there are none or they are out of date
+        """
+        key = _image_key(img)
+        maps = _EDGE_MAPS.get(key)
+        if maps is not None:
+            debug_print('Using edge maps in memory')
+            return maps
+        elif doc.edge_maps_path.is_file():
+            try:
+                maps = EdgeMaps.load(str(doc.edge_maps_path), key[1:])
+            except (OSError, ValueError, KeyError, EOFError,
+                    BadZipFile) as e:
+                # Corrupt or truncated maps are computed afresh
+                debug_print('Unable to read edge maps [{0}]'.format(e))
+
+            if maps is not None and maps.shape == img.array.shape[:2]:
+                debug_print('Using edge maps in [{0}]'.format(
+                    doc.edge_maps_path
+                ))
+                return maps
+            else:
+                debug_print('Edge maps in [{0}] are out of date'.format(
+                    doc.edge_maps_path
+                ))
+                return None
+        else:
+            return None
+
     def _post_process_rects(self, img, rects):
-        """Generator of instances of normalised Rect with padding applied
+        """Returns a list of instances of normalised Rect with padding applied
         """
-        # Normalised coords and construct instances of Rect
-        rects = list(Rect(*[int(round(v)) for v in rect[:4]]) for rect in rects)
-        rects = img.to_normalised(rects)
+        import numpy as np
+
+        # Normalised coords of all rects at once
+        rects = RectArray(np.round([tuple(rect[:4]) for rect in rects]))
+        rects = RectArray(img.to_normalised_array(rects.array))
 
         # Apply padding of one percent of height and width
-        rects = (r.padded(percent=1) for r in rects)
+        rects = rects.padded(percent=1)
 
         # Constrain rects to be within image
-        return (r.intersect(Rect(0.0, 0.0, 1.0, 1.0)) for r in rects)
+        return list(rects.intersect(Rect(0.0, 0.0, 1.0, 1.0)))
@@ -1,38 +1,62 @@
+from .rect import RectArray
 
-from operator import itemgetter
+# Warning: lazy load of numpy via local imports
 
-# Warning: lazy load of scipy and sklearn via local imports
+
+# Values, which are normalised, are scaled by this before estimating density
+RESCALE = 100
+
+# The number of points at which density is evaluated
+N_SAMPLES = 50
+
+# The bandwidth of the Gaussian kernel, in rescaled units
+BANDWIDTH = 1.0
+
+
+def _log_density(values, samples):
+    """Returns the log of the Gaussian kernel density estimate of the ints
+    values at each of samples, up to an additive constant. Identical values
+    are counted rather than evaluated individually, so the cost is
+    independent of the number of values.
+    """
+    import numpy as np
+
+    centres, counts = np.unique(values, return_counts=True)
+    # Log-sum-exp, so that samples far from all values are not all zero
+    exponents = (np.log(counts) -
+                 0.5 * ((samples[:, None] - centres) / BANDWIDTH) ** 2)
+    maximum = exponents.max(axis=1)
+    return maximum + np.log(np.exp(exponents - maximum[:, None]).sum(axis=1))
 
 
 def _do_kde(values):
     """Uses kernel denstity estimation to assign values to clusters using
-    minima. Returns a generator of ints that are bin numbers.
+    minima. Returns an array of ints that are bin numbers.
     """
-    from scipy.signal import argrelmin
-    from sklearn.neighbors import KernelDensity
-
     import numpy as np
 
     # http://stackoverflow.com/a/35151947
-    RESCALE = 100
-    values = np.array([int(v * RESCALE) for v in values]).reshape(-1, 1)
-    kde = KernelDensity().fit(values)
+    values = (np.asarray(values, dtype=np.float64) * RESCALE).astype(int)
 
     # Identify minima and use as break points
-    samples = np.linspace(0, RESCALE)
-    evaluations = kde.score_samples(samples.reshape(-1, 1))
-    minima = argrelmin(evaluations)
+    samples = np.linspace(0, RESCALE, N_SAMPLES)
+    evaluations = _log_density(values, samples)
+    inner = evaluations[1:-1]
+    minima = 1 + np.flatnonzero((inner < evaluations[:-2]) &
+                                (inner < evaluations[2:]))
 
     # The right-hand edges of bins
     bins = np.append(samples[minima], RESCALE)
 
     # Cut data
-    return np.digitize(values.reshape(len(values)), bins, right=True)
+    return np.digitize(values, bins, right=True)
 
 
 def sort_document_items(items, by_columns):
     """Returns items sorted either by columns or by rows
     """
+    import numpy as np
+
     if not items:
         # Algorithm is not tolerant of empty values
         return []
@@ -40,13 +64,13 @@ def sort_document_items(items, by_columns):
         # Breaks algorithm when using older numpy (< 10.1)
         return items
     else:
-        rects = [i['rect'] for i in items]
-        x_bins = _do_kde(r.x_centre for r in rects)
-        y_bins = _do_kde(r.y_centre for r in rects)
+        rects = RectArray(i['rect'] for i in items)
+        x_bins = _do_kde(rects.x_centre)
+        y_bins = _do_kde(rects.y_centre)
 
         if by_columns:
-            keys = zip(x_bins, y_bins, (r.left for r in rects))
+            keys = (rects.left, y_bins, x_bins)
         else:
-            keys = zip(y_bins, x_bins, (r.left for r in rects))
-        items_and_keys = sorted(zip(items, keys), key=itemgetter(1))
-        return [v[0] for v in items_and_keys]
+            keys = (rects.left, x_bins, y_bins)
+        # lexsort sorts by the last key first and, like sorted(), is stable
+        return [items[index] for index in np.lexsort(keys)]
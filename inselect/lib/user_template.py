@@ -8,6 +8,7 @@ from itertools import count, chain, repeat
 from pathlib import Path
 
 from . import persist_user_template
+from inselect.lib.rect import RectArray
 from inselect.lib.parse import parse_matches_regex
 from inselect.lib.utils import FormatDefault
 
@@ -140,43 +141,45 @@ class UserTemplate(object):
         """Generator of dicts of metadata values for boxes in document and
         the iterator of crop_fnames.
         """
-        # Document promises that either the thumbnail or scanned image will be
-        # available
+        boxes = document.boxes
+
+        # Coordinates of all boxes are computed at once. Document promises
+        # that either the thumbnail or scanned image will be available
         if document.scanned.available:
-            scanned_coords = document.scanned.from_normalised(
-                b['rect'] for b in document.items
-            )
+            scanned_coords = RectArray(
+                document.scanned.from_normalised_array(boxes.rects)
+            ).coordinates.astype(int).tolist()
         else:
             scanned_coords = repeat(None)
 
         if document.thumbnail.available:
-            thumbnail_coords = document.thumbnail.from_normalised(
-                b['rect'] for b in document.items
-            )
+            thumbnail_coords = RectArray(
+                document.thumbnail.from_normalised_array(boxes.rects)
+            ).coordinates.astype(int).tolist()
         else:
             thumbnail_coords = repeat(None)
 
         items = zip(
             count(start=1),
             crop_fnames,
-            (b['rect'] for b in document.items),
+            boxes.coordinates.tolist(),
             thumbnail_coords,
             scanned_coords,
-            document.items
+            boxes.fields
         )
 
-        for item_num, fname, normalised, thumbnail, scanned, box in items:
-            md = self.metadata(item_num, box['fields'])
+        for item_num, fname, normalised, thumbnail, scanned, fields in items:
+            md = self.metadata(item_num, fields)
 
             # Push these extra values into metadata
             md['Cropped_image_name'] = fname
             (md['NormalisedLeft'], md['NormalisedTop'],
-             md['NormalisedRight'], md['NormalisedBottom']) = normalised.coordinates
+             md['NormalisedRight'], md['NormalisedBottom']) = normalised
             if thumbnail:
                 (md['ThumbnailLeft'], md['ThumbnailTop'], md['ThumbnailRight'],
-                 md['ThumbnailBottom']) = thumbnail.coordinates
+                 md['ThumbnailBottom']) = thumbnail
             (md['OriginalLeft'], md['OriginalTop'], md['OriginalRight'],
-             md['OriginalBottom']) = scanned.coordinates
+             md['OriginalBottom']) = scanned
             yield md
 
     def format_label(self, index, metadata):
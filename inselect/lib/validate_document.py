@@ -18,7 +18,7 @@ def _validate_document(document, template, visitor):
 
 
 def _visit_boxes(document, template, visitor):
-    for index, box in enumerate(document.items):
+    for index, box in enumerate(document.items_view):
         _visit_box(template, visitor, index, box)
 
 
@@ -45,7 +45,7 @@ def _visit_box(template, visitor, index, box):
 def _visit_labels(document, template, visitor):
     labels = [
         template.format_label(1 + index, box['fields'])
-        for index, box in enumerate(document.items)
+        for index, box in enumerate(document.items_view)
     ]
 
     # Labels must be given
@@ -0,0 +1,133 @@
+"""Streaming discovery of files in directories and directory trees
+"""
+import os
+import queue
+import threading
+
+from fnmatch import fnmatchcase
+from pathlib import Path
+
+from .utils import debug_print
+
+
+# The default number of paths that are read ahead of the consumer
+DEFAULT_PREFETCH = 1000
+
+
+def _matches(name, patterns):
+    "True if name matches any of the glob patterns, ignoring case"
+    name = name.lower()
+    return any(fnmatchcase(name, p.lower()) for p in patterns)
+
+
+def _walk(dir, patterns, recursive, include, exclude):
+    # A stack of directories yet to be read, so that trees of any depth can be
+    # walked without recursion
+    stack = [str(dir)]
+    while stack:
+        subdirs = []
+        path = stack.pop()
+        try:
+            entries = os.scandir(path)
+        except OSError as e:
+            # Unreadable, or removed since it was listed
+            debug_print('Skipping [{0}]: [{1}]'.format(path, e))
+            continue
+        # Closes the directory if the consumer stops early
+        with entries:
+            for entry in entries:
+                if _matches(entry.name, exclude):
+                    pass
+                elif entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif (entry.is_file() and _matches(entry.name, patterns) and
+                        (not include or _matches(entry.name, include))):
+                    yield Path(entry.path)
+        if recursive:
+            stack.extend(sorted(subdirs, reverse=True))
+
+
+def prefetch(iterable, n=DEFAULT_PREFETCH):
+    """Generator function that yields the items of iterable, which is consumed
+    by a background thread that runs up to n items ahead of the caller.
+    Exceptions raised by iterable are re-raised in the caller's thread.
+    """
+    items = queue.Queue(maxsize=n)
+    stop = threading.Event()
+    done = object()
+
+    def put(item, error=None):
+        # Returns False if the caller has bailed out
+        while not stop.is_set():
+            try:
+                items.put((item, error), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(done)
+        except Exception as e:
+            put(done, e)
+        finally:
+            # Releases resources, such as open directories, held by iterable
+            close = getattr(iterable, 'close', None)
+            if close:
+                close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error:
+                raise error
+            elif item is done:
+                break
+            else:
+                yield item
+    finally:
+        # Tell the producer to exit if the caller bailed out
+        stop.set()
+
+
+def find_files(dir, patterns, recursive=False, include=None, exclude=None,
+               n_prefetch=DEFAULT_PREFETCH):
+    """Generator function of instances of Path of files in dir, and in its
+    subdirectories if recursive is True, whose names match any of the glob
+    patterns.
+
+    If include is given, file names must also match one of its patterns. Files
+    and directories whose names match any of the patterns in exclude are
+    ignored. Names are matched without regard to case.
+
+    Directories are read as paths are consumed - processing can begin before
+    the whole tree has been listed. If n_prefetch is non-zero, directories are
+    read by a background thread that runs up to n_prefetch paths ahead.
+    """
+    paths = _walk(dir, patterns, recursive, include or [], exclude or [])
+    return prefetch(paths, n_prefetch) if n_prefetch else paths
+
+
+def add_find_files_arguments(parser):
+    """Adds to the argparse parser the --recursive, --include and --exclude
+    arguments of find_files
+    """
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help='Look for files in subdirectories')
+    parser.add_argument(
+        '--include', action='append', metavar='PATTERN',
+        help='Process only files whose names match PATTERN. Can be given '
+             'more than once.'
+    )
+    parser.add_argument(
+        '--exclude', action='append', metavar='PATTERN',
+        help='Ignore files and directories whose names match PATTERN. Can be '
+             'given more than once.'
+    )
+
@@ -0,0 +1,220 @@
+"""Watching a directory for new files
+"""
+import time
+
+from pathlib import Path
+
+from .utils import debug_print
+from .walk import _matches, find_files
+
+# Warning: lazy load of inotify_simple via local imports
+
+# The number of seconds for which a file's size and modification time must be
+# unchanged before it is considered to have been completely written
+DEFAULT_SETTLE = 2.0
+
+# The number of seconds between scans of the directory if inotify is not
+# available
+DEFAULT_POLL_INTERVAL = 5.0
+
+
+def inotify_available():
+    "Returns True if inotify_simple is available"
+    try:
+        from inotify_simple import INotify
+    except ImportError:
+        return False
+    else:
+        return True
+
+
+class FolderWatcher(object):
+    """Iterating over an instance yields lists of instances of Path of files
+    in dir, and in its subdirectories if recursive is True, that match the
+    arguments of find_files. Each file is yielded once it has been completely
+    written - when its size and modification time have not changed for settle
+    seconds. A file is yielded again only if it is rewritten.
+
+    Files that are already in dir are yielded first. New files are detected
+    using inotify, if inotify_simple is available and use_inotify is True, or
+    by scanning dir every poll_interval seconds.
+    """
+
+    def __init__(self, dir, patterns, recursive=False, include=None,
+                 exclude=None, settle=DEFAULT_SETTLE,
+                 poll_interval=DEFAULT_POLL_INTERVAL, use_inotify=True):
+        self.dir = Path(dir)
+        self.patterns = patterns
+        self.recursive = recursive
+        self.include = include or []
+        self.exclude = exclude or []
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        # Instance of INotify and map from watch descriptor to directory
+        self._inotify = None
+        self._watches = {}
+        # Map from path to tuple (size, mtime) and the time at which the size
+        # and mtime were first seen
+        self._pending = {}
+        # Map from path to (size, mtime) of files that have been yielded
+        self._yielded = {}
+
+    def __repr__(self):
+        return "FolderWatcher('{0}')".format(self.dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+            self._watches = {}
+
+    @property
+    def inotify(self):
+        "True if changes are detected using inotify"
+        return self._inotify is not None
+
+    def _is_candidate(self, path):
+        name = path.name
+        return (_matches(name, self.patterns) and
+                (not self.include or _matches(name, self.include)) and
+                not _matches(name, self.exclude))
+
+    def _scan(self, dir):
+        "Adds files in dir to the pending files"
+        found = set()
+        for path in find_files(dir, self.patterns, self.recursive,
+                               self.include, self.exclude, n_prefetch=0):
+            found.add(path)
+            self._pending.setdefault(path, (None, None))
+        return found
+
+    def _rescan(self):
+        "Adds all files in self.dir to the pending files"
+        found = self._scan(self.dir)
+        # Forget files that have gone
+        self._yielded = {p: s for p, s in self._yielded.items() if p in found}
+
+    def _start_inotify(self):
+        try:
+            from inotify_simple import INotify
+        except ImportError:
+            debug_print('inotify_simple not available - will poll')
+        else:
+            try:
+                self._inotify = INotify()
+            except OSError as e:
+                debug_print('Unable to use inotify [{0}] - will poll'.format(e))
+            else:
+                self._watch(self.dir)
+
+    def _watch(self, dir):
+        "Watches dir and, if self.recursive, its subdirectories"
+        from inotify_simple import flags
+
+        mask = (flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM |
+                flags.DELETE | flags.CREATE | flags.ONLYDIR |
+                flags.DONT_FOLLOW)
+        stack = [dir]
+        while stack:
+            dir = stack.pop()
+            debug_print('Watching [{0}]'.format(dir))
+            try:
+                self._watches[self._inotify.add_watch(str(dir), mask)] = dir
+            except OSError as e:
+                # Directory might have been removed
+                debug_print('Unable to watch [{0}] [{1}]'.format(dir, e))
+            else:
+                if self.recursive:
+                    stack.extend(
+                        p for p in dir.iterdir()
+                        if (p.is_dir() and not p.is_symlink() and
+                            not _matches(p.name, self.exclude))
+                    )
+
+    def _read_events(self, timeout):
+        "Waits up to timeout seconds for inotify events"
+        from inotify_simple import flags
+
+        for event in self._inotify.read(timeout=int(1000 * timeout)):
+            dir = self._watches.get(event.wd)
+            if event.mask & flags.Q_OVERFLOW:
+                debug_print('inotify queue overflowed - rescanning')
+                self._rescan()
+            elif event.mask & flags.IGNORED:
+                self._watches.pop(event.wd, None)
+            elif dir is None:
+                pass
+            elif event.mask & flags.ISDIR:
+                path = dir / event.name
+                if (self.recursive and
+                        event.mask & (flags.CREATE | flags.MOVED_TO) and
+                        not _matches(event.name, self.exclude)):
+                    self._watch(path)
+                    # Files might have been written before the watch was added
+                    self._scan(path)
+            else:
+                path = dir / event.name
+                if event.mask & (flags.DELETE | flags.MOVED_FROM):
+                    self._pending.pop(path, None)
+                    self._yielded.pop(path, None)
+                elif self._is_candidate(path):
+                    self._pending.setdefault(path, (None, None))
+
+    def _ready(self):
+        """Returns a list of pending files whose size and modification time
+        have not changed for self.settle seconds
+        """
+        now = time.monotonic()
+        ready = []
+        for path, (signature, since) in list(self._pending.items()):
+            try:
+                stat = path.stat()
+            except OSError:
+                # Removed
+                del self._pending[path]
+                continue
+
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                self._pending[path] = (current, now)
+            elif now - since >= self.settle:
+                del self._pending[path]
+                if self._yielded.get(path) != current:
+                    self._yielded[path] = current
+                    ready.append(path)
+        return sorted(ready)
+
+    def __iter__(self):
+        if self.use_inotify and not self._inotify:
+            self._start_inotify()
+        # Watches are in place before the initial scan so that no files are
+        # missed
+        self._rescan()
+        last_scan = time.monotonic()
+        while True:
+            ready = self._ready()
+            if ready:
+                yield ready
+            else:
+                # Wake in time to check pending files
+                timeout = self.poll_interval
+                if self._pending:
+                    timeout = min(timeout, self.settle / 2)
+                if self._inotify:
+                    self._read_events(timeout)
+                else:
+                    # Sleep for timeout on every pass, waking early for the
+                    # next scan
+                    next_scan = last_scan + self.poll_interval
+                    time.sleep(max(0, min(timeout,
+                                          next_scan - time.monotonic())))
+                    if time.monotonic() - last_scan >= self.poll_interval:
+                        self._rescan()
+                        last_scan = time.monotonic()
@@ -16,18 +16,31 @@ import inselect.lib.utils
 
 from inselect.lib.document import InselectDocument
 from inselect.lib.document_export import DocumentExport
+from inselect.lib.manifest import Manifest, settings_digest
 from inselect.lib.templates.dwc import DWC
 from inselect.lib.user_template import UserTemplate
 from inselect.lib.utils import debug_print
 from inselect.lib.validate_document import format_validation_problems
+from inselect.lib.walk import add_find_files_arguments, find_files
 
 
-# TODO Recursive option
-
-def export_csv(dir, overwrite_existing, template):
+def export_csv(dir, overwrite_existing, template, manifest=None,
+               recursive=False, include=None, exclude=None):
     dir = Path(dir)
     export = DocumentExport(UserTemplate.load(template) if template else DWC)
-    for p in dir.glob('*' + InselectDocument.EXTENSION):
+    paths = find_files(dir, ['*' + InselectDocument.EXTENSION], recursive,
+                       include, exclude)
+    settings = settings_digest(template=template)
+    for p in paths:
+        # The document is not loaded, so its CSV file is found as
+        # DocumentExport.csv_path does. Metadata is exported again if the CSV
+        # file has been removed.
+        if (manifest and not overwrite_existing and
+                manifest.is_complete(p, 'csv', settings) and
+                p.with_suffix('.csv').is_file()):
+            print('Skipping [{0}] as it is unchanged since metadata was '
+                  'exported'.format(p))
+            continue
         try:
             debug_print('Loading [{0}]'.format(p))
             doc = InselectDocument.load(p)
@@ -45,6 +58,8 @@ def export_csv(dir, overwrite_existing, template):
             else:
                 print('Writing CSV for [{0}]'.format(p))
                 export.export_csv(doc)
+                if manifest:
+                    manifest.completed(p, 'csv', settings)
         except KeyboardInterrupt:
             raise
         except Exception:
@@ -65,6 +80,12 @@ def main(args=None):
         '-t', '--template', type=Path, help="Path to a '{0}' file that will be "
         'used to export the data'.format(UserTemplate.EXTENSION)
     )
+    parser.add_argument(
+        '--manifest', type=Path, help='Path to a manifest file that records '
+        'the documents from which metadata has been exported; unchanged '
+        'documents are skipped unless --overwrite is given'
+    )
+    add_find_files_arguments(parser)
     parser.add_argument('-d', '--debug', action='store_true')
     parser.add_argument('-v', '--version', action='version',
                         version='%(prog)s ' + inselect.__version__)
@@ -72,7 +93,17 @@ def main(args=None):
 
     inselect.lib.utils.DEBUG_PRINT = args.debug
 
-    export_csv(args.dir, args.overwrite, args.template)
+    find = {
+        'recursive': args.recursive,
+        'include': args.include,
+        'exclude': args.exclude,
+    }
+    if args.manifest:
+        with Manifest(args.manifest) as manifest:
+            export_csv(args.dir, args.overwrite, args.template, manifest,
+                       **find)
+    else:
+        export_csv(args.dir, args.overwrite, args.template, **find)
 
 
 if __name__ in ('__main__', 'export_metadata__main__'):
@@ -7,28 +7,53 @@ fix_frozen()
 
 import argparse
 import sys
+import time
 import traceback
 
+from functools import partial
 from pathlib import Path
 
 import inselect
 
 from inselect.lib.cookie_cutter import CookieCutter
 from inselect.lib.document import InselectDocument
-from inselect.lib.ingest import ingest_image, IMAGE_SUFFIXES_RE
+from inselect.lib.ingest import ingest_image, IMAGE_PATTERNS
 from inselect.lib.inselect_error import InselectError
-
-# TODO Recursive option
-
-
-def ingest_from_directory(inbox, docs,
-                          thumbnail_width_pixels=InselectDocument.THUMBNAIL_DEFAULT_WIDTH,
-                          cookie_cutter=None):
-    """Ingest images from the directory given by inbox to the directory given
-    by docs
+from inselect.lib.parallel import imap_completed, worker_pool
+from inselect.lib.segment_document import SegmentDocument
+from inselect.lib.utils import debug_print
+from inselect.lib.walk import add_find_files_arguments, find_files
+from inselect.lib.watch import (DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE,
+                                FolderWatcher)
+
+
+def _ingest(source, inbox, docs, thumbnail_width_pixels, cookie_cutter,
+            segment=False, sort_by_columns=False):
+    """Ingests the image at source, in inbox or one of its subdirectories, to
+    the equivalent directory in docs and, if segment is True, segments the new
+    document. Returns a tuple (path of the new document, number of boxes found
+    or None if the document was not segmented).
+    """
+    dest = docs / source.parent.relative_to(inbox)
+    # Other workers might be creating the same directory
+    dest.mkdir(parents=True, exist_ok=True)
+    doc = ingest_image(source, dest,
+                       thumbnail_width_pixels=thumbnail_width_pixels,
+                       cookie_cutter=cookie_cutter)
+    if segment and not doc.n_items:
+        segmented, display_image = SegmentDocument(sort_by_columns).segment(doc)
+        del display_image    # We don't use this
+        doc.set_items(segmented.items)
+        doc.save()
+        return doc.document_path, doc.n_items
+    else:
+        return doc.document_path, None
+
+
+def _prepare(inbox, docs, cookie_cutter):
+    """Checks inbox, creates docs if required and returns the instance of
+    CookieCutter at the path cookie_cutter, or None
     """
-    inbox, docs = Path(inbox), Path(docs)
-    cookie_cutter = Path(cookie_cutter) if cookie_cutter else None
     if not inbox.is_dir():
         raise InselectError('Inbox directory [{0}] does not exist'.format(inbox))
 
@@ -36,24 +61,97 @@ def ingest_from_directory(inbox, docs,
         print('Create document directory [{0}]'.format(docs))
         docs.mkdir(parents=True)
 
-    if cookie_cutter:
-        cookie_cutter = CookieCutter.load(cookie_cutter)
+    return CookieCutter.load(cookie_cutter) if cookie_cutter else None
+
 
-    for source in (p for p in inbox.iterdir() if IMAGE_SUFFIXES_RE.match(p.name)):
-        print('Ingesting [{0}]'.format(source))
+def _ingest_sources(sources, inbox, docs, jobs, pool=None, **kwargs):
+    """Ingests images in the iterable sources using jobs worker processes, in
+    pool, as yielded by worker_pool, if given. kwargs are passed to _ingest.
+    """
+    def images(sources):
+        for source in sources:
+            if InselectDocument.path_is_thumbnail_file(source):
+                # Thumbnails are created as images are ingested, so might be
+                # seen if inbox and docs are the same directory
+                debug_print('Ignoring thumbnail [{0}]'.format(source))
+            else:
+                print('Ingesting [{0}]'.format(source))
+                yield source
+
+    start = time.perf_counter()
+    n_ingested = n_errors = 0
+    fn = partial(_ingest, inbox=inbox, docs=docs, **kwargs)
+    for source, result in imap_completed(fn, images(sources), jobs, pool):
         try:
-            ingest_image(
-                source, docs,
-                thumbnail_width_pixels=thumbnail_width_pixels,
-                cookie_cutter=cookie_cutter
-            )
+            document_path, n_items = result.result()
         except KeyboardInterrupt:
             raise
         except Exception:
+            n_errors += 1
             print('Error ingesting [{0}]'.format(source))
             traceback.print_exc()
         else:
-            print('Ingested [{0}]'.format(source))
+            n_ingested += 1
+            if n_items is None:
+                print('Ingested [{0}] to [{1}]'.format(source, document_path))
+            else:
+                print('Ingested [{0}] to [{1}] [{2} items]'.format(
+                    source, document_path, n_items
+                ))
+
+    elapsed = time.perf_counter() - start
+    msg = ('Ingested [{0}] images, errors [{1}] in [{2:.1f}] seconds '
+           '([{3:.2f}] images per second)')
+    print(msg.format(n_ingested, n_errors, elapsed,
+                     n_ingested / elapsed if elapsed else 0))
+
+
+def ingest_from_directory(inbox, docs,
+                          thumbnail_width_pixels=InselectDocument.THUMBNAIL_DEFAULT_WIDTH,
+                          cookie_cutter=None, recursive=False, include=None,
+                          exclude=None, jobs=1, segment=False,
+                          sort_by_columns=False):
+    """Ingest images from the directory given by inbox to the directory given
+    by docs, using jobs worker processes. Images in subdirectories of inbox are
+    moved to the equivalent subdirectories of docs. recursive, include and
+    exclude are passed to find_files. If segment is True, new documents are
+    segmented.
+    """
+    inbox, docs = Path(inbox), Path(docs)
+    cookie_cutter = _prepare(inbox, docs, cookie_cutter)
+    sources = find_files(inbox, IMAGE_PATTERNS, recursive, include, exclude)
+    _ingest_sources(sources, inbox, docs, jobs,
+                    thumbnail_width_pixels=thumbnail_width_pixels,
+                    cookie_cutter=cookie_cutter, segment=segment,
+                    sort_by_columns=sort_by_columns)
+
+
+def watch_directory(inbox, docs,
+                    thumbnail_width_pixels=InselectDocument.THUMBNAIL_DEFAULT_WIDTH,
+                    cookie_cutter=None, recursive=False, include=None,
+                    exclude=None, jobs=1, segment=False, sort_by_columns=False,
+                    settle=DEFAULT_SETTLE, poll_interval=DEFAULT_POLL_INTERVAL):
+    """As ingest_from_directory but runs until interrupted, ingesting images
+    as they are written to inbox. Images are ingested once their size and
+    modification time have not changed for settle seconds. New images are
+    detected using inotify if it is available or by scanning inbox every
+    poll_interval seconds if not. One pool of jobs worker processes ingests
+    images for as long as inbox is watched.
+    """
+    inbox, docs = Path(inbox), Path(docs)
+    cookie_cutter = _prepare(inbox, docs, cookie_cutter)
+    watcher = FolderWatcher(inbox, IMAGE_PATTERNS, recursive, include, exclude,
+                            settle=settle, poll_interval=poll_interval)
+    with watcher, worker_pool(jobs) as pool:
+        print('Watching [{0}]'.format(inbox))
+        try:
+            for sources in watcher:
+                _ingest_sources(sources, inbox, docs, jobs, pool,
+                                thumbnail_width_pixels=thumbnail_width_pixels,
+                                cookie_cutter=cookie_cutter, segment=segment,
+                                sort_by_columns=sort_by_columns)
+        except KeyboardInterrupt:
+            print('Stopped watching [{0}]'.format(inbox))
 
 
 def main(args=None):
@@ -81,15 +179,59 @@ def main(args=None):
             InselectDocument.THUMBNAIL_DEFAULT_WIDTH
         )
     )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='The number of images to ingest in parallel; defaults to 1')
+    parser.add_argument(
+        '--segment', action='store_true',
+        help='Segment new documents')
+    parser.add_argument(
+        '--sort-by-columns', action='store_true', default=False,
+        help='Sort boxes by columns; default is to sort boxes by rows')
+    parser.add_argument(
+        '--watch', action='store_true',
+        help='Run until interrupted, ingesting images as they are written to '
+        'inbox')
+    parser.add_argument(
+        '--settle', type=float, default=DEFAULT_SETTLE,
+        help='With --watch, the number of seconds for which an image must be '
+        'unchanged before it is ingested; defaults to {0}'.format(
+            DEFAULT_SETTLE
+        )
+    )
+    parser.add_argument(
+        '--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+        help='With --watch, the number of seconds between scans of inbox if '
+        'inotify is not available; defaults to {0}'.format(
+            DEFAULT_POLL_INTERVAL
+        )
+    )
+    add_find_files_arguments(parser)
     parser.add_argument('--debug', action='store_true')
     parser.add_argument('-v', '--version', action='version',
                         version='%(prog)s ' + inselect.__version__)
     args = parser.parse_args(args)
 
+    if args.jobs < 1:
+        parser.error('--jobs should be at least 1')
+
     inselect.lib.utils.DEBUG_PRINT = args.debug
 
-    ingest_from_directory(args.inbox, args.docs, args.thumbnail_width,
-                          args.cookie_cutter)
+    kwargs = {
+        'recursive': args.recursive,
+        'include': args.include,
+        'exclude': args.exclude,
+        'jobs': args.jobs,
+        'segment': args.segment,
+        'sort_by_columns': args.sort_by_columns,
+    }
+    if args.watch:
+        watch_directory(args.inbox, args.docs, args.thumbnail_width,
+                        args.cookie_cutter, settle=args.settle,
+                        poll_interval=args.poll_interval, **kwargs)
+    else:
+        ingest_from_directory(args.inbox, args.docs, args.thumbnail_width,
+                              args.cookie_cutter, **kwargs)
 
 
 if __name__ in ('__main__', 'ingest__main__'):
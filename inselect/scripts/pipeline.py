@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""Ingests, segments, reads barcodes, saves crops and exports metadata in a
+single pass over each document
+"""
+from inselect.lib.fix_frozen import fix_frozen
+
+fix_frozen()
+
+import argparse
+import sys
+import time
+import traceback
+
+from collections import defaultdict
+from pathlib import Path
+
+import inselect
+import inselect.lib.utils
+
+from inselect.lib.cookie_cutter import CookieCutter
+from inselect.lib.document import InselectDocument
+from inselect.lib.document_export import DocumentExport
+from inselect.lib.ingest import ingest_image, IMAGE_PATTERNS
+from inselect.lib.inselect_error import InselectError
+from inselect.lib.parallel import imap_completed
+from inselect.lib.segment_document import SegmentDocument
+from inselect.lib.templates.dwc import DWC
+from inselect.lib.user_template import UserTemplate
+from inselect.lib.utils import debug_print
+from inselect.lib.walk import add_find_files_arguments, find_files
+
+# Warning: lazy load of gouda via local imports
+
+# Stages in the order in which they are run
+STAGES = ('ingest', 'segment', 'barcodes', 'crops', 'csv')
+
+DEFAULT_STAGES = ('ingest', 'segment', 'crops', 'csv')
+
+
+class Pipeline(object):
+    """Runs stages on a single document, keeping images in memory between
+    stages. Instances are picklable so that they can be called in worker
+    processes.
+    """
+    def __init__(self, stages, docs, sort_by_columns=False, engine=None,
+                 template=None, overwrite_existing=False,
+                 thumbnail_width_pixels=InselectDocument.THUMBNAIL_DEFAULT_WIDTH,
+                 cookie_cutter=None, inbox=None):
+        unknown = set(stages).difference(STAGES)
+        if unknown:
+            raise ValueError('Unknown stages [{0}]'.format(sorted(unknown)))
+        elif 'barcodes' in stages and not engine:
+            raise ValueError('The barcodes stage requires an engine')
+        else:
+            self.stages = [s for s in STAGES if s in stages]
+            self.docs = Path(docs)
+            self.sort_by_columns = sort_by_columns
+            self.engine = engine
+            self.template = template
+            self.overwrite_existing = overwrite_existing
+            self.thumbnail_width_pixels = thumbnail_width_pixels
+            # Loaded once rather than for each image
+            if cookie_cutter and not isinstance(cookie_cutter, CookieCutter):
+                cookie_cutter = CookieCutter.load(cookie_cutter)
+            self.cookie_cutter = cookie_cutter
+            self.inbox = Path(inbox) if inbox else self.docs
+            # Created on demand
+            self._export = None
+
+    def __call__(self, path):
+        """Runs stages on path - an image file if the 'ingest' stage is to be
+        run, an Inselect document if not. Returns a list of tuples
+        (stage, elapsed seconds, message).
+        """
+        if 'ingest' in self.stages:
+            doc = None
+        else:
+            debug_print('Loading [{0}]'.format(path))
+            # Items are read only if a stage needs them
+            doc = InselectDocument.load(path, lazy=True)
+
+        timings = []
+        for stage in self.stages:
+            start = time.perf_counter()
+            doc, message = getattr(self, '_' + stage)(path, doc)
+            timings.append((stage, time.perf_counter() - start, message))
+        return timings
+
+    @property
+    def export(self):
+        if not self._export:
+            template = UserTemplate.load(self.template) if self.template else DWC
+            self._export = DocumentExport(template)
+        return self._export
+
+    def _ingest(self, path, doc):
+        path = Path(path)
+        # Images in subdirectories of inbox are moved to the equivalent
+        # subdirectories of docs
+        dest = self.docs / path.parent.relative_to(self.inbox)
+        document_path = dest / path.with_suffix(InselectDocument.EXTENSION).name
+        if document_path.is_file():
+            # Ingested by an earlier run - later stages are run on the
+            # existing document
+            debug_print('Loading [{0}]'.format(document_path))
+            doc = InselectDocument.load(document_path, lazy=True)
+            return doc, 'Skipped - [{0}] exists'.format(document_path)
+        else:
+            # Other workers might be creating the same directory
+            dest.mkdir(parents=True, exist_ok=True)
+            doc = ingest_image(path, dest,
+                               thumbnail_width_pixels=self.thumbnail_width_pixels,
+                               cookie_cutter=self.cookie_cutter)
+            return doc, 'Created [{0}]'.format(doc.document_path)
+
+    def _segment(self, path, doc):
+        if doc.n_items:
+            return doc, 'Skipped - already contains items'
+        else:
+            segmented, display_image = SegmentDocument(
+                self.sort_by_columns
+            ).segment(doc)
+            del display_image    # We don't use this
+            doc.set_items(segmented.items)
+            doc.save()
+            return doc, 'Found [{0}] boxes'.format(doc.n_items)
+
+    def _barcodes(self, path, doc):
+        from gouda.engines.options import engine_options
+        from gouda.strategies.resize import resize
+        from gouda.strategies.roi.roi import roi
+
+        from inselect.scripts.read_barcodes import BarcodeReader
+
+        engine = engine_options()[self.engine]()
+        BarcodeReader(engine, (resize, roi)).read_barcodes_in_document(doc)
+        return doc, 'Read barcodes in [{0}] boxes'.format(doc.n_items)
+
+    def _crops(self, path, doc):
+        if self.export.validation_problems(doc).any_problems:
+            return doc, 'Skipped - validation problems'
+        elif not self.overwrite_existing and doc.crops_dir.is_dir():
+            return doc, 'Skipped - [{0}] exists'.format(doc.crops_dir)
+        else:
+            crops_dir = self.export.save_crops(doc)
+            return doc, 'Saved [{0}] crops to [{1}]'.format(doc.n_items, crops_dir)
+
+    def _csv(self, path, doc):
+        csv_path = self.export.csv_path(doc)
+        if self.export.validation_problems(doc).any_problems:
+            return doc, 'Skipped - validation problems'
+        elif not self.overwrite_existing and csv_path.is_file():
+            return doc, 'Skipped - [{0}] exists'.format(csv_path)
+        else:
+            return doc, 'Wrote [{0}]'.format(self.export.export_csv(doc))
+
+
+def pipeline(dir, inbox, stages, jobs=1, recursive=False, include=None,
+             exclude=None, **kwargs):
+    """Runs stages on documents in dir. If stages includes 'ingest', images in
+    inbox are ingested into dir and then processed. recursive, include and
+    exclude are passed to find_files.
+    """
+    dir = Path(dir)
+    inbox = Path(inbox) if inbox else dir
+    run = Pipeline(stages, dir, inbox=inbox, **kwargs)
+    if 'ingest' in run.stages:
+        if not inbox.is_dir():
+            raise InselectError('Inbox directory [{0}] does not exist'.format(inbox))
+        elif not dir.is_dir():
+            print('Create document directory [{0}]'.format(dir))
+            dir.mkdir(parents=True)
+        # A list, not a generator, because ingesting creates thumbnail images.
+        # Thumbnails are present if inbox and dir are the same directory.
+        paths = [
+            p for p in find_files(inbox, IMAGE_PATTERNS, recursive, include,
+                                  exclude)
+            if not InselectDocument.path_is_thumbnail_file(p)
+        ]
+    else:
+        paths = find_files(dir, ['*' + InselectDocument.EXTENSION], recursive,
+                           include, exclude)
+
+    start = time.perf_counter()
+    n_processed = n_errors = 0
+    # Map from stage to total elapsed time
+    totals = defaultdict(float)
+    for p, result in imap_completed(run, paths, jobs):
+        try:
+            timings = result.result()
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            n_errors += 1
+            print('Error processing [{0}]'.format(p))
+            traceback.print_exc()
+        else:
+            n_processed += 1
+            print('Processed [{0}]'.format(p))
+            for stage, elapsed, message in timings:
+                totals[stage] += elapsed
+                print('    {0:<10}{1:>8.2f}s  {2}'.format(stage, elapsed, message))
+
+    elapsed = time.perf_counter() - start
+    msg = ('Processed [{0}] documents, errors [{1}] in [{2:.1f}] seconds '
+           '([{3:.2f}] documents per second)')
+    print(msg.format(n_processed, n_errors, elapsed,
+                     n_processed / elapsed if elapsed else 0))
+    for stage in run.stages:
+        print('    {0:<10}{1:>8.2f}s total'.format(stage, totals[stage]))
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(
+        description='Ingests, segments, reads barcodes, saves crops and exports '
+                    'metadata in a single pass over each document'
+    )
+    parser.add_argument(
+        "dir", type=Path, help='Directory containing Inselect documents'
+    )
+    parser.add_argument(
+        '-i', '--inbox', type=Path, help='Directory containing scanned images '
+        'to be moved to dir and ingested; defaults to dir'
+    )
+    parser.add_argument(
+        '-s', '--stages', default=','.join(DEFAULT_STAGES),
+        help='Comma-separated stages to run, from {0}; defaults to {1}. If '
+        "'ingest' is given, images in inbox are processed; images that "
+        'already have a document are not ingested again.'.format(
+            ','.join(STAGES), ','.join(DEFAULT_STAGES)
+        )
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='The number of documents to process in parallel; defaults to 1')
+    parser.add_argument(
+        '-c', '--cookie-cutter', type=Path, help="Path to a '{0}' file "
+        'that will be applied to new Inselect '
+        'documents'.format(CookieCutter.EXTENSION)
+    )
+    parser.add_argument(
+        '-w', '--thumbnail-width', type=int,
+        default=InselectDocument.THUMBNAIL_DEFAULT_WIDTH,
+        help="The width of the thumbnail in pixels; defaults to {0}".format(
+            InselectDocument.THUMBNAIL_DEFAULT_WIDTH
+        )
+    )
+    parser.add_argument(
+        '--sort-by-columns', action='store_true', default=False,
+        help='Sort boxes by columns; default is to sort boxes by rows')
+    parser.add_argument(
+        '-e', '--engine', help='The barcode reading engine to use; required by '
+        "the 'barcodes' stage"
+    )
+    parser.add_argument(
+        '-t', '--template', type=Path, help="Path to a '{0}' file that will be "
+        'used to format crop filenames and to export the '
+        'data'.format(UserTemplate.EXTENSION)
+    )
+    parser.add_argument('-o', '--overwrite', action='store_true',
+                        help='Overwrite existing crops directories and '
+                        'metadata files')
+    add_find_files_arguments(parser)
+    parser.add_argument('-d', '--debug', action='store_true')
+    parser.add_argument('-v', '--version', action='version',
+                        version='%(prog)s ' + inselect.__version__)
+    args = parser.parse_args(args)
+
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    unknown = set(stages).difference(STAGES)
+    if unknown:
+        parser.error('Unknown stages [{0}]'.format(', '.join(sorted(unknown))))
+    elif args.jobs < 1:
+        parser.error('--jobs should be at least 1')
+    elif 'barcodes' in stages:
+        # Private import to avoid top-level import of cv2 (via gouda)
+        try:
+            from gouda.engines.options import engine_options
+        except ImportError:
+            raise InselectError('Barcode decoding not available')
+        options = engine_options()
+        if args.engine not in options:
+            parser.error("The 'barcodes' stage requires --engine, one of "
+                         "[{0}]".format(', '.join(sorted(options.keys()))))
+
+    inselect.lib.utils.DEBUG_PRINT = args.debug
+
+    pipeline(args.dir, args.inbox, stages, args.jobs,
+             sort_by_columns=args.sort_by_columns, engine=args.engine,
+             template=args.template, overwrite_existing=args.overwrite,
+             thumbnail_width_pixels=args.thumbnail_width,
+             cookie_cutter=args.cookie_cutter, recursive=args.recursive,
+             include=args.include, exclude=args.exclude)
+
+
+if __name__ in ('__main__', 'pipeline__main__'):
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Prunes the cache of decoded image pixels
+"""
+from inselect.lib.fix_frozen import fix_frozen
+
+fix_frozen()
+
+import argparse
+import os
+import sys
+
+from pathlib import Path
+
+import inselect
+import inselect.lib.utils
+
+from inselect.lib.pixel_cache import (CACHE_DIR_ENV, MAX_BYTES_ENV,
+                                      DEFAULT_MAX_BYTES, PixelCache)
+
+
+def prune_pixel_cache(dir, max_bytes):
+    cache = PixelCache(dir, max_bytes)
+    n_removed, bytes_removed = cache.prune()
+    print('Removed [{0}] entries ([{1}] bytes) from [{2}]'.format(
+        n_removed, bytes_removed, cache.directory
+    ))
+    print('[{0}] entries ([{1}] bytes) remain'.format(
+        len(cache.entries()), cache.size_bytes
+    ))
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(
+        description='Removes least recently used entries from the cache of '
+                    'decoded image pixels'
+    )
+    parser.add_argument(
+        'dir', type=Path, nargs='?', default=os.environ.get(CACHE_DIR_ENV),
+        help='The cache directory; defaults to the value of the {0} '
+             'environment variable'.format(CACHE_DIR_ENV)
+    )
+    parser.add_argument(
+        '-m', '--max-bytes', type=int,
+        default=int(os.environ.get(MAX_BYTES_ENV, DEFAULT_MAX_BYTES)),
+        help='The maximum size of the cache in bytes; defaults to the value of '
+             'the {0} environment variable or {1}. Use 0 to remove all '
+             'entries.'.format(MAX_BYTES_ENV, DEFAULT_MAX_BYTES)
+    )
+    parser.add_argument('-d', '--debug', action='store_true')
+    parser.add_argument('-v', '--version', action='version',
+                        version='%(prog)s ' + inselect.__version__)
+    args = parser.parse_args(args)
+
+    if not args.dir:
+        parser.error('No cache directory given and {0} is not set'.format(
+            CACHE_DIR_ENV
+        ))
+
+    inselect.lib.utils.DEBUG_PRINT = args.debug
+
+    prune_pixel_cache(args.dir, args.max_bytes)
+
+
+if __name__ in ('__main__', 'prune_pixel_cache__main__'):
+    main()
@@ -16,21 +16,32 @@ import inselect.lib.utils
 
 from inselect.lib.document import InselectDocument
 from inselect.lib.inselect_error import InselectError
+from inselect.lib.manifest import Manifest, settings_digest
 from inselect.lib.utils import debug_print
+from inselect.lib.walk import add_find_files_arguments, find_files
 
 # Warning: lazy load of gouda via local imports
 
 
 class BarcodeReader(object):
-    def __init__(self, engine, strategies):
+    def __init__(self, engine, strategies, manifest=None):
         self.engine = engine
         self.strategies = strategies
+        self.manifest = manifest
+        self.settings = settings_digest(engine=type(engine).__name__)
 
-    def process_dir(self, dir):
+    def process_dir(self, dir, recursive=False, include=None, exclude=None):
         # TODO LH Read image from crops dir, if it exists?
-        for p in Path(dir).glob('*' + InselectDocument.EXTENSION):
+        paths = find_files(dir, ['*' + InselectDocument.EXTENSION], recursive,
+                           include, exclude)
+        for p in paths:
             # TODO LH Do not overwrite existing object numbers, or whatever
             # field it is that barcodes are written to
+            if (self.manifest and
+                    self.manifest.is_complete(p, 'barcodes', self.settings)):
+                print('Skipping [{0}] as it is unchanged since barcodes were '
+                      'read'.format(p))
+                continue
             print(p)
             try:
                 self.read_barcodes_in_document(InselectDocument.load(p))
@@ -39,6 +50,9 @@ class BarcodeReader(object):
             except Exception:
                 print('Error reading barcodes in [{0}]'.format(p))
                 traceback.print_exc()
+            else:
+                if self.manifest:
+                    self.manifest.completed(p, 'barcodes', self.settings)
 
     def read_barcodes_in_document(self, doc):
         items = doc.items
@@ -72,8 +86,11 @@ class BarcodeReader(object):
         return None
 
 
-def read_barcodes(engine, dir, strategies):
-    BarcodeReader(engine, strategies).process_dir(dir)
+def read_barcodes(engine, dir, strategies, manifest=None, recursive=False,
+                  include=None, exclude=None):
+    BarcodeReader(engine, strategies, manifest).process_dir(
+        dir, recursive, include, exclude
+    )
 
 
 def main(args=None):
@@ -109,12 +126,27 @@ def main(args=None):
                         help='Directory containing inselect documents')
     parser.add_argument('engine', choices=sorted(options.keys()),
                         help='The barcode reading engine to use')
+    parser.add_argument(
+        '--manifest', type=Path, help='Path to a manifest file that records '
+        'the documents in which barcodes have been read; unchanged documents '
+        'are skipped'
+    )
+    add_find_files_arguments(parser)
     args = parser.parse_args(args)
 
     inselect.lib.utils.DEBUG_PRINT = args.debug
     gouda.util.DEBUG_PRINT = args.debug_barcodes
     engine = options[args.engine]()
-    read_barcodes(engine, args.dir, strategies=(resize, roi))
+    find = {
+        'recursive': args.recursive,
+        'include': args.include,
+        'exclude': args.exclude,
+    }
+    if args.manifest:
+        with Manifest(args.manifest) as manifest:
+            read_barcodes(engine, args.dir, (resize, roi), manifest, **find)
+    else:
+        read_barcodes(engine, args.dir, strategies=(resize, roi), **find)
 
 
 if __name__ in ('__main__', 'read_barcodes__main__'):
@@ -16,18 +16,31 @@ import inselect.lib.utils
 
 from inselect.lib.document import InselectDocument
 from inselect.lib.document_export import DocumentExport
+from inselect.lib.manifest import Manifest, settings_digest
 from inselect.lib.templates.dwc import DWC
 from inselect.lib.user_template import UserTemplate
 from inselect.lib.utils import debug_print
 from inselect.lib.validate_document import format_validation_problems
+from inselect.lib.walk import add_find_files_arguments, find_files
 
 
-# TODO Recursive option
-
-def save_crops(dir, overwrite_existing, template):
+def save_crops(dir, overwrite_existing, template, manifest=None,
+               recursive=False, include=None, exclude=None):
     dir = Path(dir)
     export = DocumentExport(UserTemplate.load(template) if template else DWC)
-    for p in dir.glob('*' + InselectDocument.EXTENSION):
+    paths = find_files(dir, ['*' + InselectDocument.EXTENSION], recursive,
+                       include, exclude)
+    settings = settings_digest(template=template)
+    for p in paths:
+        # The document is not loaded, so its crops dir is found as
+        # InselectDocument.crops_dir does. The crops are saved again if the
+        # crops dir has been removed.
+        if (manifest and not overwrite_existing and
+                manifest.is_complete(p, 'crops', settings) and
+                (p.parent / (p.stem + '_crops')).is_dir()):
+            print('Skipping [{0}] as it is unchanged since crops were '
+                  'saved'.format(p))
+            continue
         try:
             debug_print('Loading [{0}]'.format(p))
             doc = InselectDocument.load(p)
@@ -44,11 +57,15 @@ def save_crops(dir, overwrite_existing, template):
             else:
                 print('Will save crops for [{0}] to [{1}]'.format(p, doc.crops_dir))
 
-                debug_print('Loading full-resolution scanned image')
-                doc.scanned.array
+                if doc.scanned.mapped is None:
+                    # Crops cannot be read directly from the file
+                    debug_print('Loading full-resolution scanned image')
+                    doc.scanned.array
 
                 debug_print('Saving crops')
                 export.save_crops(doc)
+                if manifest:
+                    manifest.completed(p, 'crops', settings)
         except KeyboardInterrupt:
             raise
         except Exception:
@@ -71,6 +88,12 @@ def main(args=None):
         '-t', '--template', type=Path, help="Path to a '{0}' file that will be "
         'used to format the crop filenames'.format(UserTemplate.EXTENSION)
     )
+    parser.add_argument(
+        '--manifest', type=Path, help='Path to a manifest file that records '
+        'the documents from which crops have been saved; unchanged documents '
+        'are skipped unless --overwrite is given'
+    )
+    add_find_files_arguments(parser)
     parser.add_argument('-d', '--debug', action='store_true')
     parser.add_argument('-v', '--version', action='version',
                         version='%(prog)s ' + inselect.__version__)
@@ -78,7 +101,17 @@ def main(args=None):
 
     inselect.lib.utils.DEBUG_PRINT = args.debug
 
-    save_crops(args.dir, args.overwrite, args.template)
+    find = {
+        'recursive': args.recursive,
+        'include': args.include,
+        'exclude': args.exclude,
+    }
+    if args.manifest:
+        with Manifest(args.manifest) as manifest:
+            save_crops(args.dir, args.overwrite, args.template, manifest,
+                       **find)
+    else:
+        save_crops(args.dir, args.overwrite, args.template, **find)
 
 
 if __name__ in ('__main__', 'save_crops__main__'):
@@ -6,42 +6,122 @@ from inselect.lib.fix_frozen import fix_frozen
 fix_frozen()
 
 import argparse
+import os
 import sys
+import time
 import traceback
 
+from functools import partial
 from pathlib import Path
 
 import inselect.lib.utils
 
 from inselect.lib.document import InselectDocument
+from inselect.lib.manifest import Manifest
+from inselect.lib.parallel import imap_completed
+from inselect.lib.profiling import Profile
+from inselect.lib.segment import DEFAULT_TILE_OVERLAP
 from inselect.lib.segment_document import SegmentDocument
 from inselect.lib.utils import debug_print
+from inselect.lib.walk import add_find_files_arguments, find_files
 
-# TODO Recursive option
 # TODO Option to resegment documents with existing boxes
 
 
-def segment(dir, sort_by_columns):
+def _segment_document(path, sort_by_columns, tile_size=None, pyramid=False,
+                      profile=False, save_edge_maps=False, threads=None):
+    """Segments and saves the document at path. Returns a tuple
+    (n_items, events). n_items is the number of boxes found or None if the
+    document was skipped because it already contains items. events is a list
+    of the spans that were timed, if profile is True, otherwise None. threads
+    is the number of tiles segmented at once, if tile_size is given.
+    """
+    if InselectDocument.load_header(path).n_items:
+        return None, None
+    else:
+        debug_print('Will segment [{0}]'.format(path))
+        doc = InselectDocument.load(path)
+        callback = Profile() if profile else None
+        segment_doc = SegmentDocument(sort_by_columns,
+                                      save_edge_maps=save_edge_maps)
+        kwargs = {'threads': threads} if tile_size else {}
+        doc, display_image = segment_doc.segment(
+            doc, tile_size=tile_size, pyramid=pyramid, callback=callback,
+            **kwargs
+        )
+        del display_image    # We don't use this
+        doc.save()
+        return doc.n_items, callback.events if callback else None
+
+
+def segment(dir, sort_by_columns, jobs=1, manifest=None, recursive=False,
+            include=None, exclude=None, tile_size=None, pyramid=False,
+            profile=None, save_edge_maps=False):
+    """Segments documents in dir that do not contain any items, using jobs
+    worker processes. If manifest is given, documents that have not changed
+    since they were last segmented are skipped without being loaded.
+    recursive, include and exclude are passed to find_files. If tile_size is
+    given, full-resolution scans are segmented in tiles of that many pixels.
+    If pyramid is True, documents are segmented coarse to fine. If profile is
+    given, the stages of segmentation are timed and written to a JSON file
+    at that path in the Trace Event Format. If save_edge_maps is True, edge
+    maps are written alongside each document, for use by subsegmentation.
+    """
     dir = Path(dir)
-    segment_doc = SegmentDocument(sort_by_columns)
-    for p in dir.glob('*' + InselectDocument.EXTENSION):
-        doc = InselectDocument.load(p)
-        if not doc.items:
-            print('Segmenting [{0}]'.format(p))
-            try:
-                debug_print('Will segment [{0}]'.format(p))
-                doc, display_image = segment_doc.segment(doc)
-                del display_image    # We don't use this
-                doc.save()
-            except KeyboardInterrupt:
-                raise
-            except Exception:
-                print('Error segmenting [{0}]'.format(p))
-                traceback.print_exc()
+    start = time.perf_counter()
+    n_segmented = n_skipped = n_errors = 0
+
+    def incomplete(paths):
+        nonlocal n_skipped
+        for p in paths:
+            if manifest and manifest.is_complete(p, 'segment'):
+                n_skipped += 1
+                print('Skipping [{0}] as it is unchanged since it was '
+                      'segmented'.format(p))
             else:
-                print('Segmented [{0}]'.format(doc))
+                yield p
+
+    paths = find_files(dir, ['*' + InselectDocument.EXTENSION], recursive,
+                       include, exclude)
+    paths = incomplete(paths)
+    # Worker processes share the CPUs between their threads, rather than each
+    # starting a thread per CPU
+    threads = max(1, (os.cpu_count() or 1) // jobs)
+    fn = partial(_segment_document, sort_by_columns=sort_by_columns,
+                 tile_size=tile_size, pyramid=pyramid, profile=bool(profile),
+                 save_edge_maps=save_edge_maps, threads=threads)
+    spans = Profile()
+    for p, result in imap_completed(fn, paths, jobs):
+        try:
+            n_items, events = result.result()
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            n_errors += 1
+            print('Error segmenting [{0}]'.format(p))
+            traceback.print_exc()
         else:
-            print('Skipping [{0}] as it already contains items'.format(p))
+            if n_items is None:
+                n_skipped += 1
+                print('Skipping [{0}] as it already contains items'.format(p))
+            else:
+                n_segmented += 1
+                print('Segmented [{0}] [{1} items]'.format(p, n_items))
+                if events:
+                    spans.extend(events)
+            if manifest:
+                manifest.completed(p, 'segment')
+
+    elapsed = time.perf_counter() - start
+    msg = ('Segmented [{0}] documents, skipped [{1}], errors [{2}] in '
+           '[{3:.1f}] seconds ([{4:.2f}] documents per second)')
+    print(msg.format(n_segmented, n_skipped, n_errors, elapsed,
+                     n_segmented / elapsed if elapsed else 0))
+
+    if profile:
+        print(spans.summary())
+        spans.write(profile)
+        print('Wrote profile to [{0}]'.format(profile))
 
 
 def main(args=None):
@@ -54,15 +134,70 @@ def main(args=None):
     parser.add_argument(
         '--sort-by-columns', action='store_true', default=False,
         help='Sort boxes by columns; default is to sort boxes by rows')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='The number of documents to segment in parallel; defaults to 1')
+    parser.add_argument(
+        '--manifest', type=Path, help='Path to a manifest file that records '
+        'which documents have been segmented; unchanged documents are skipped')
+    parser.add_argument(
+        '--tile-size', type=int, metavar='PIXELS',
+        help='Segment full-resolution scans in overlapping tiles of this '
+        'many pixels, using all CPUs, shared between --jobs; suited to large '
+        'images of small specimens')
+    parser.add_argument(
+        '--pyramid', action='store_true',
+        help='Segment a low-resolution image first and then refine the '
+        'regions that contain objects; faster for sparsely populated images. '
+        'Images that contain large objects, such as drawer subdivisions, are '
+        'segmented at full resolution.')
+    parser.add_argument(
+        '--save-edge-maps', action='store_true',
+        help='Write the edge maps of each image alongside the document, '
+        'which makes subsequent subsegmentation faster; the maps take about '
+        '2 bytes per pixel of the scanned image - around 50MB for a '
+        '25 megapixel scan. Gradients are stored at reduced precision, so '
+        'subsegmentation from saved maps might, rarely, differ slightly '
+        'from that of a freshly segmented image. Not used with --tile-size '
+        'or --pyramid')
+    parser.add_argument(
+        '--profile', type=Path, metavar='PATH',
+        help='Time the stages of segmentation and write them to a JSON file '
+        'in the Trace Event Format, which can be viewed in '
+        "https://ui.perfetto.dev or Chrome's about:tracing")
+    add_find_files_arguments(parser)
     parser.add_argument(
         '-v', '--version', action='version',
         version='%(prog)s ' + inselect.__version__
     )
     args = parser.parse_args(args)
 
+    if args.jobs < 1:
+        parser.error('--jobs should be at least 1')
+    elif args.tile_size and args.pyramid:
+        parser.error('--tile-size and --pyramid cannot be used together')
+    elif args.tile_size is not None and args.tile_size <= DEFAULT_TILE_OVERLAP:
+        parser.error('--tile-size should be greater than {0}'.format(
+            DEFAULT_TILE_OVERLAP
+        ))
+
     inselect.lib.utils.DEBUG_PRINT = args.debug
 
-    segment(args.dir, args.sort_by_columns)
+    kwargs = {
+        'recursive': args.recursive,
+        'include': args.include,
+        'exclude': args.exclude,
+        'tile_size': args.tile_size,
+        'pyramid': args.pyramid,
+        'profile': args.profile,
+        'save_edge_maps': args.save_edge_maps,
+    }
+    if args.manifest:
+        with Manifest(args.manifest) as manifest:
+            segment(args.dir, args.sort_by_columns, args.jobs, manifest,
+                    **kwargs)
+    else:
+        segment(args.dir, args.sort_by_columns, args.jobs, **kwargs)
 
 
 if __name__ in ('__main__', 'segment__main__'):
@@ -0,0 +1,67 @@
+import unittest
+
+from pathlib import Path
+
+from inselect.lib.boxes import Boxes
+from inselect.lib.document import InselectDocument
+from inselect.lib.inselect_error import InselectError
+from inselect.lib.rect import Rect
+
+
+TESTDATA = Path(__file__).parent.parent / 'test_data'
+
+
+class TestBoxes(unittest.TestCase):
+    def test_from_items(self):
+        "Columns are as items"
+        items = [{'rect': Rect(0.1, 0.2, 0.3, 0.4), 'rotation': 90,
+                  'fields': {'catalogNumber': '1'}},
+                 {'rect': Rect(0.5, 0.6, 0.1, 0.2), 'fields': {}}]
+        boxes = Boxes.from_items(items)
+        self.assertEqual(2, len(boxes))
+        self.assertEqual([[0.1, 0.2, 0.3, 0.4], [0.5, 0.6, 0.1, 0.2]],
+                         boxes.rects.tolist())
+        self.assertEqual([90, 0], boxes.rotation.tolist())
+        self.assertEqual([{'catalogNumber': '1'}, {}],
+                         [dict(f) for f in boxes.fields])
+        self.assertEqual([Rect(0.1, 0.2, 0.3, 0.4), Rect(0.5, 0.6, 0.1, 0.2)],
+                         [i['rect'] for i in boxes.items()])
+        self.assertEqual(8 * 2 * 4 + 8 * 2, boxes.nbytes)
+
+    def test_empty(self):
+        boxes = Boxes.from_items([])
+        self.assertEqual(0, len(boxes))
+        self.assertEqual((0, 4), boxes.rects.shape)
+        self.assertEqual([], boxes.items())
+
+    def test_read_only(self):
+        boxes = Boxes([(0, 0, 1, 1)], [0], [{'a': 'b'}])
+        with self.assertRaises(ValueError):
+            boxes.rects[0, 0] = 1
+        with self.assertRaises(ValueError):
+            boxes.rotation[0] = 90
+        with self.assertRaises(TypeError):
+            boxes.fields[0]['a'] = 'c'
+
+    def test_lengths_differ(self):
+        self.assertRaises(InselectError, Boxes, [(0, 0, 1, 1)], [0, 90],
+                          [{}])
+
+    def test_coordinates(self):
+        boxes = Boxes([(0.1, 0.2, 0.3, 0.4)], [0], [{}])
+        self.assertEqual([list(Rect(0.1, 0.2, 0.3, 0.4).coordinates)],
+                         boxes.coordinates.tolist())
+
+    def test_document_boxes(self):
+        "Document boxes are cached and replaced by set_items"
+        doc = InselectDocument.load(TESTDATA / 'shapes.inselect')
+        boxes = doc.boxes
+        self.assertIs(boxes, doc.boxes)
+        self.assertEqual([tuple(i['rect']) for i in doc.items],
+                         [tuple(r) for r in boxes.rects.tolist()])
+        doc.set_items([{'fields': {}, 'rect': Rect(0, 0, 0.5, 0.5)}])
+        self.assertEqual([[0, 0, 0.5, 0.5]], doc.boxes.rects.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
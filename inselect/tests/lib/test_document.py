@@ -1,4 +1,6 @@
 # -*- coding: UTF-8 -*-
+import hashlib
+import json
 import os
 import pytz
 import shutil
@@ -12,7 +14,10 @@ from pathlib import Path
 
 import numpy as np
 
+from mock import patch
+
 from inselect.lib.document import InselectDocument
+from inselect.lib.image import InselectImage
 from inselect.lib.inselect_error import InselectError
 from inselect.lib.rect import Rect
 from inselect.lib.utils import make_readonly
@@ -172,6 +177,170 @@ class TestDocument(unittest.TestCase):
             saved_on = d.properties['Saved on']
             self.assertLessEqual((now - saved_on).seconds, 2)
 
+    def test_load_header(self):
+        "Read the header of a document without its items or images"
+        path = TESTDATA / 'shapes.inselect'
+        doc = InselectDocument.load(path)
+        # Items are not parsed
+        self.assertIsNotNone(InselectDocument._members(path.read_bytes()))
+        header = InselectDocument.load_header(path)
+        self.assertEqual(path, header.path)
+        self.assertEqual(2, header.version)
+        self.assertEqual(doc.scanned.path, header.scanned_path)
+        self.assertEqual(5, header.n_items)
+        self.assertEqual(doc.properties, header.properties)
+
+        # Images are not examined
+        with temp_directory_with_files(path) as tempdir:
+            header = InselectDocument.load_header(tempdir / path.name)
+            self.assertEqual(5, header.n_items)
+
+    def test_load_header_as_saved(self):
+        "Documents written by save are read without parsing their items"
+        awkward = {
+            'catalogNumber': '\n    "items": [',
+            'scientificName': 'Quoted "name" \\ \u00e9\u4e2d\t',
+            'otherCatalogNumbers': '\n        },\n        {',
+        }
+        items = [{'fields': {}, 'rect': Rect(0.1, 0.1, 0.2, 0.2)},
+                 {'fields': awkward, 'rect': Rect(0.5, 0.5, 0.1, 0.1),
+                  'rotation': 90}]
+        with temp_directory_with_files(TESTDATA / 'shapes.inselect',
+                                       TESTDATA / 'shapes.png') as tempdir:
+            path = tempdir / 'shapes.inselect'
+            for n in (0, 1, 2, 500):
+                doc = InselectDocument.load(path)
+                doc.set_items((items * 250)[:n])
+                doc.properties['Notes'] = awkward
+                doc.save()
+
+                self.assertIsNotNone(
+                    InselectDocument._members(path.read_bytes())
+                )
+                with patch('inselect.lib.document.json.loads',
+                           wraps=json.loads) as loads:
+                    header = InselectDocument.load_header(path)
+                # Items are not parsed
+                parsed = [args[0] for args, kwargs in loads.call_args_list]
+                self.assertFalse(any('"rect"' in str(v) for v in parsed))
+                self.assertEqual(n, header.n_items)
+                self.assertEqual(awkward, header.properties['Notes'])
+
+                expected = InselectDocument.load(path).items
+                lazy = InselectDocument.load(path, lazy=True)
+                self.assertEqual(n, lazy.n_items)
+                self.assertEqual(expected, lazy.items)
+
+    def test_load_header_not_as_saved(self):
+        "Read the header of a document that is not laid out as save writes"
+        with temp_directory_with_files(TESTDATA / 'shapes.png') as tempdir:
+            path = tempdir / 'shapes.inselect'
+            with path.open('w') as outfile:
+                outfile.write(json.dumps({
+                    'inselect version': 2,
+                    'scanned extension': '.png',
+                    'items': [{'fields': {}, 'rect': [0, 0, 0.5, 0.5]}] * 3,
+                }))
+
+            self.assertIsNone(
+                InselectDocument._members(path.read_bytes())
+            )
+            self.assertEqual(3, InselectDocument.load_header(path).n_items)
+            doc = InselectDocument.load(path, lazy=True)
+            self.assertEqual(3, doc.n_items)
+            self.assertEqual(3, len(doc.items))
+
+    def test_load_header_crlf(self):
+        "Read the header of a document with '\\r\\n' line endings"
+        source = TESTDATA / 'shapes.inselect'
+        with temp_directory_with_files(TESTDATA / 'shapes.png') as tempdir:
+            path = tempdir / source.name
+            path.write_bytes(source.read_bytes().replace(b'\n', b'\r\n'))
+
+            self.assertIsNone(InselectDocument._members(path.read_bytes()))
+            self.assertEqual(5, InselectDocument.load_header(path).n_items)
+            doc = InselectDocument.load(path, lazy=True)
+            self.assertEqual(5, doc.n_items)
+            self.assertEqual(InselectDocument.load(source).items, doc.items)
+
+    def test_load_lazy(self):
+        "Items are read when first needed"
+        for name in ('shapes.inselect', 'pinned.inselect'):
+            path = TESTDATA / name
+            expected = InselectDocument.load(path)
+            doc = InselectDocument.load(path, lazy=True)
+            self.assertIsNotNone(doc._read_items)
+            self.assertEqual(expected.n_items, doc.n_items)
+            self.assertEqual(expected.properties, doc.properties)
+            self.assertEqual(repr(expected), repr(doc))
+            self.assertIsNotNone(doc._read_items)
+
+            self.assertEqual(expected.items, doc.items)
+            self.assertIsNone(doc._read_items)
+            self.assertEqual(expected.n_items, doc.n_items)
+
+    def test_load_lazy_set_items(self):
+        "Items that have not been read are replaced by set_items"
+        doc = InselectDocument.load(TESTDATA / 'shapes.inselect', lazy=True)
+        items = [{'fields': {}, 'rect': Rect(0, 0, 0.5, 0.5)}]
+        doc.set_items(items)
+        self.assertEqual(1, doc.n_items)
+        self.assertEqual(items, doc.items)
+
+    def test_save_records_images(self):
+        "Saved documents record their images, which are not then opened"
+        with temp_directory_with_files(TESTDATA / 'shapes.inselect',
+                                       TESTDATA / 'shapes.png') as tempdir:
+            path = tempdir / 'shapes.inselect'
+            InselectDocument.load(path).save()
+
+            header = InselectDocument.load_header(path)
+            self.assertEqual(['scanned'], list(header.images))
+            expected = InselectImage(tempdir / 'shapes.png').info
+            self.assertEqual(expected, header.images['scanned'])
+
+            doc = InselectDocument.load(path)
+            with patch('inselect.lib.image.Image.open',
+                       side_effect=AssertionError):
+                self.assertEqual(expected, doc.scanned.recorded_info)
+                self.assertEqual((459, 437), doc.scanned.dimensions)
+                self.assertEqual(
+                    [Rect(0, 0, 189, 189)],
+                    list(doc.scanned.from_normalised([doc.items[0]['rect']]))
+                )
+
+    def test_save_records_verified_digest(self):
+        "Digests are recorded only once computed by verify"
+        with temp_directory_with_files(TESTDATA / 'shapes.inselect',
+                                       TESTDATA / 'shapes.png') as tempdir:
+            path = tempdir / 'shapes.inselect'
+            doc = InselectDocument.load(path)
+            doc.save()
+            header = InselectDocument.load_header(path)
+            self.assertIsNone(header.images['scanned'].sha256)
+
+            self.assertTrue(doc.scanned.verify())
+            doc.save()
+            header = InselectDocument.load_header(path)
+            self.assertEqual(doc.scanned.info.sha256,
+                             header.images['scanned'].sha256)
+
+            # Altering the file without changing its size or modification
+            # time is detected only by verify
+            scanned = tempdir / 'shapes.png'
+            stat = scanned.stat()
+            data = bytearray(scanned.read_bytes())
+            data[-1] ^= 0xff
+            scanned.write_bytes(bytes(data))
+            os.utime(str(scanned), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            doc = InselectDocument.load(path)
+            self.assertIsNotNone(doc.scanned.recorded_info)
+            self.assertFalse(doc.scanned.verify())
+
+    def test_load_invalid_images(self):
+        "Invalid image info is ignored"
+        self.assertEqual({}, InselectDocument._images({'scanned': {'x': 1}}))
+
     def test_repr(self):
         path = TESTDATA / 'shapes.inselect'
         doc = InselectDocument.load(path)
@@ -201,6 +370,28 @@ class TestDocument(unittest.TestCase):
         doc.set_items(items)
         self.assertEqual(items, doc.items)
 
+    def test_items_view(self):
+        "items_view is read-only, shared and replaced by set_items"
+        doc = InselectDocument.load(TESTDATA / 'shapes.inselect')
+
+        view = doc.items_view
+        self.assertEqual(doc.items, [dict(i, fields=dict(i['fields']))
+                                     for i in view])
+        self.assertIs(view, doc.items_view)
+        with self.assertRaises(TypeError):
+            view[0]['rect'] = Rect(0, 0, 1, 1)
+        with self.assertRaises(TypeError):
+            view[0]['fields']['catalogNumber'] = 'x'
+
+        items = [{'fields': {'catalogNumber': '1'},
+                  'rect': Rect(0, 0, 0.5, 0.5)}]
+        doc.set_items(items)
+        items[0]['fields']['catalogNumber'] = '2'
+        self.assertEqual(1, len(doc.items_view))
+        self.assertEqual('1', doc.items_view[0]['fields']['catalogNumber'])
+        # The previous view is unaffected
+        self.assertEqual(5, len(view))
+
     def test_new_from_scan(self):
         "New document is created and saved"
         with temp_directory_with_files(TESTDATA / 'shapes.png') as tempdir:
@@ -213,6 +404,33 @@ class TestDocument(unittest.TestCase):
             created_on = doc.properties['Created on']
             self.assertLessEqual((now - created_on).seconds, 2)
 
+            # Digests of both images are recorded
+            header = InselectDocument.load_header(doc.document_path)
+            for name, path in (('scanned', doc.scanned.path),
+                               ('thumbnail', doc.thumbnail.path)):
+                self.assertEqual(hashlib.sha256(path.read_bytes()).hexdigest(),
+                                 header.images[name].sha256)
+
+    def test_new_from_large_jpeg(self):
+        "Thumbnail is created from a JPEG decoded at reduced scale"
+        import cv2
+        with temp_directory_with_files() as tempdir:
+            scanned = tempdir / 'large.jpg'
+            image = InselectDocument.load(TESTDATA / 'shapes.inselect').scanned
+            image = cv2.resize(image.array, (4590, 4370))
+            self.assertTrue(cv2.imwrite(str(scanned), image))
+
+            doc = InselectDocument.new_from_scan(scanned, 1024)
+
+            # Full-resolution image was not decoded
+            self.assertIsNone(doc.scanned._array)
+
+            # Thumbnail array was retained and matches the file that was written
+            self.assertEqual((975, 1024, 3), doc.thumbnail._array.shape)
+            self.assertEqual((1024, 975), InselectDocument.load(
+                doc.document_path
+            ).thumbnail.dimensions)
+
     def test_new_from_scan_doc_exists(self):
         "Document of scanned image already exists"
         path = TESTDATA / 'shapes.png'
@@ -177,7 +177,9 @@ class TestCropFnameCollision(unittest.TestCase):
     def test_fname_collison(self):
         "Duplicated crop fnames have numerical suffixes to avoid collisions"
         class FakeDocument(object):
-            pass
+            @property
+            def items_view(self):
+                return self.items
 
         document = FakeDocument()
         document.items = [
@@ -218,6 +220,16 @@ class TestCropFnameCollision(unittest.TestCase):
             fnames
         )
 
+    def test_fname_collison_document(self):
+        "Crop fnames are read from the read-only items of a document"
+        document = InselectDocument(
+            scanned_path=TESTDATA / 'shapes.png',
+            items=[{'fields': {'scientificName': name},
+                    'rect': (0, 0, 0.5, 0.5)} for name in 'AAB']
+        )
+        fnames = list(DocumentExport(self.TEMPLATE).crop_fnames(document))
+        self.assertEqual(['A.png', 'A-1.png', 'B.png'], fnames)
+
 
 if __name__ == '__main__':
     unittest.main()
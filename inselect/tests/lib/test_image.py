@@ -1,24 +1,67 @@
+import hashlib
 import shutil
+import struct
 import sys
 import tempfile
 import unittest
 
 from itertools import repeat
-from mock import Mock
+from mock import Mock, patch
 from pathlib import Path
 
 import numpy as np
 
 import cv2
 
-from inselect.lib.image import InselectImage
+from inselect.lib.image import ImageInfo, InselectImage
 from inselect.lib.inselect_error import InselectError
 from inselect.lib.rect import Rect
 from inselect.lib.utils import make_readonly, rmtree_readonly
 
+from inselect.tests.utils import temp_directory_with_files
+
 TESTDATA = Path(__file__).parent.parent / 'test_data'
 
 
+def write_strips_tiff(path, bgr, rows_per_strip, reverse=False):
+    """Writes the array bgr to path as an uncompressed RGB TIFF of strips of
+    rows_per_strip rows. If reverse is True, the strips are written to the
+    file in reverse order.
+    """
+    height, width = bgr.shape[:2]
+    rgb = np.ascontiguousarray(bgr[:, :, ::-1])
+    strips = [rgb[top:top + rows_per_strip].tobytes()
+              for top in range(0, height, rows_per_strip)]
+    offsets, data, position = [None] * len(strips), b'', 8
+    order = range(len(strips))
+    for index in (reversed(order) if reverse else order):
+        offsets[index] = position + len(data)
+        data += strips[index]
+
+    def array(fmt, values):
+        return struct.pack('<{0}{1}'.format(len(values), fmt), *values)
+
+    extra = (array('H', [8, 8, 8]), array('I', offsets),
+             array('I', [len(strip) for strip in strips]))
+    extra_offsets = [position + len(data)]
+    for e in extra[:-1]:
+        extra_offsets.append(extra_offsets[-1] + len(e))
+    ifd = extra_offsets[-1] + len(extra[-1])
+    # (tag, type, count, value or offset); types 3 - SHORT, 4 - LONG
+    entries = [(256, 4, 1, width), (257, 4, 1, height),
+               (258, 3, 3, extra_offsets[0]), (259, 3, 1, 1),
+               (262, 3, 1, 2), (273, 4, len(strips), extra_offsets[1]),
+               (277, 3, 1, 3), (278, 4, 1, rows_per_strip),
+               (279, 4, len(strips), extra_offsets[2]), (284, 3, 1, 1)]
+    with path.open('wb') as outfile:
+        outfile.write(b'II*\x00' + struct.pack('<I', ifd) + data)
+        outfile.write(b''.join(extra))
+        outfile.write(struct.pack('<H', len(entries)))
+        for tag, type, count, value in entries:
+            outfile.write(struct.pack('<HHII', tag, type, count, value))
+        outfile.write(struct.pack('<I', 0))
+
+
 class TestImage(unittest.TestCase):
     def test_path(self):
         "Test path attribute"
@@ -66,6 +109,85 @@ class TestImage(unittest.TestCase):
         with self.assertRaises(AttributeError):
             i.array = ''
 
+    def test_array_not_writeable(self):
+        "Pixels cannot be altered, however the array was obtained"
+        decoded = InselectImage(TESTDATA / 'shapes.png')
+        source = np.zeros((10, 10, 3), dtype=np.uint8)
+        given = InselectImage(TESTDATA / 'shapes.png', source)
+        for image in (decoded, given):
+            with self.assertRaises(ValueError):
+                image.array[0, 0] = 1
+        # The array given to the constructor is not altered
+        self.assertTrue(source.flags.writeable)
+
+    def test_mapped(self):
+        "Crops are read from a memory map of an uncompressed image"
+        boxes = [Rect(0, 0, 1, 1), Rect(0.1, 0.2, 0.4, 0.3),
+                 Rect(-0.1, -0.1, 0.4, 0.3)]
+        temp = tempfile.mkdtemp()
+        try:
+            p = Path(temp) / 'shapes.bmp'
+            expected = InselectImage(TESTDATA / 'shapes.png')
+            self.assertTrue(cv2.imwrite(str(p), expected.array))
+
+            i = InselectImage(p)
+            self.assertEqual(expected.array.shape, i.mapped.shape)
+            self.assertTrue(np.all(expected.array == i.mapped))
+            for actual, crop in zip(i.crops(boxes, 90),
+                                    expected.crops(boxes, 90)):
+                self.assertTrue(np.all(crop == actual))
+
+            # The file was not decoded
+            self.assertIsNone(i._array)
+        finally:
+            shutil.rmtree(temp)
+
+    def test_mapped_strips(self):
+        "Uncompressed TIFFs of contiguous strips are memory mapped"
+        boxes = [Rect(0, 0, 1, 1), Rect(0.1, 0.2, 0.4, 0.3)]
+        expected = InselectImage(TESTDATA / 'shapes.png')
+        temp = tempfile.mkdtemp()
+        try:
+            for p in (Path(temp) / 'opencv.tiff', Path(temp) / 'strips.tiff'):
+                if 'opencv' in p.name:
+                    # OpenCV writes strips of a few rows
+                    self.assertTrue(cv2.imwrite(
+                        str(p), expected.array,
+                        [cv2.IMWRITE_TIFF_COMPRESSION, 1]
+                    ))
+                else:
+                    write_strips_tiff(p, expected.array, 100)
+
+                i = InselectImage(p)
+                self.assertLess(1, len(i.pil_image.tile))
+                self.assertEqual(expected.array.shape, i.mapped.shape)
+                self.assertTrue(np.all(expected.array == i.mapped))
+                for actual, crop in zip(i.crops(boxes), expected.crops(boxes)):
+                    self.assertTrue(np.all(crop == actual))
+                self.assertIsNone(i._array)
+        finally:
+            shutil.rmtree(temp)
+
+    def test_not_mapped_strips(self):
+        "Uncompressed TIFFs of strips that are out of order are decoded"
+        boxes = [Rect(0, 0, 1, 1), Rect(0.1, 0.2, 0.4, 0.3)]
+        expected = InselectImage(TESTDATA / 'shapes.png')
+        temp = tempfile.mkdtemp()
+        try:
+            p = Path(temp) / 'reversed.tiff'
+            write_strips_tiff(p, expected.array, 100, reverse=True)
+
+            i = InselectImage(p)
+            self.assertIsNone(i.mapped)
+            for actual, crop in zip(i.crops(boxes), expected.crops(boxes)):
+                self.assertTrue(np.all(crop == actual))
+        finally:
+            shutil.rmtree(temp)
+
+    def test_not_mapped(self):
+        "PNG images cannot be memory mapped"
+        self.assertIsNone(InselectImage(TESTDATA / 'shapes.png').mapped)
+
     def test_from_normalised(self):
         "Crops from normalised coordinates are as expected"
         i = InselectImage(TESTDATA / 'shapes.png')
@@ -80,6 +202,29 @@ class TestImage(unittest.TestCase):
         self.assertEqual([Rect(0, 0, 1, 1), Rect(0, 0, 1.0/3, 1.0/19)],
                          list(i.to_normalised(boxes)))
 
+    def test_from_normalised_array(self):
+        "Vectorised conversion matches from_normalised"
+        i = InselectImage(TESTDATA / 'shapes.png')
+        boxes = np.random.RandomState(0).uniform(-0.5, 1.5, (1000, 4))
+        pixels = i.from_normalised_array(boxes)
+        self.assertEqual((1000, 4), pixels.shape)
+        self.assertEqual(list(i.from_normalised(boxes)),
+                         [Rect(*b) for b in pixels.tolist()])
+        self.assertEqual(
+            [[0, 0, 459, 437], [0, 87, 46, 350]],
+            i.from_normalised_array(
+                iter([Rect(0, 0, 1, 1), Rect(0, 0.2, 0.1, 0.8)])
+            ).tolist()
+        )
+        self.assertEqual((0, 4), i.from_normalised_array([]).shape)
+
+    def test_to_normalised_array(self):
+        i = InselectImage(TESTDATA / 'shapes.png')
+        boxes = [Rect(0, 0, 459, 437), Rect(0, 0, 153, 23)]
+        self.assertEqual(list(i.to_normalised(boxes)),
+                         [Rect(*b) for b in
+                          i.to_normalised_array(boxes).tolist()])
+
     def test_overwrite_existing_crop(self):
         "Overwrite an existing file with a crop that is the entire image"
         i = InselectImage(TESTDATA / 'shapes.png')
@@ -221,6 +366,34 @@ class TestImage(unittest.TestCase):
         finally:
             shutil.rmtree(temp)
 
+    def test_save_crops_threads(self):
+        "Crops are written by more than one thread"
+        i = InselectImage(TESTDATA / 'shapes.png')
+        temp = tempfile.mkdtemp()
+        try:
+            boxes = [Rect(0, 0, 1, 1), Rect(0.1, 0.2, 0.4, 0.3)] * 5
+            paths = [Path(temp) / '{0}.png'.format(n) for n in range(0, 10)]
+            progress = Mock(return_value=None)
+            i.save_crops(boxes, paths, progress=progress, threads=3)
+            self.assertEqual(10, progress.call_count)
+            for crop, path in zip(i.crops(boxes), paths):
+                self.assertTrue(np.all(crop == cv2.imread(str(path))))
+        finally:
+            shutil.rmtree(temp)
+
+    def test_save_crops_first_error(self):
+        "The error for the first crop that could not be written is raised"
+        i = InselectImage(TESTDATA / 'shapes.png')
+        temp = tempfile.mkdtemp()
+        try:
+            paths = [Path(temp) / 'x.png',
+                     Path(temp) / 'missing' / 'a.png',
+                     Path(temp) / 'missing' / 'b.png']
+            with self.assertRaisesRegex(InselectError, 'a.png'):
+                i.save_crops(repeat(Rect(0, 0, 1, 1), 3), paths, threads=2)
+        finally:
+            shutil.rmtree(temp)
+
     def test_crops_bad_rotation(self):
         "Generate crops with an illegal rotation"
         i = InselectImage(TESTDATA / 'shapes.png')
@@ -256,5 +429,61 @@ class TestImage(unittest.TestCase):
         i = InselectImage(TESTDATA / 'shapes.png')
         self.assertEqual((459, 437), i.dimensions)
 
+    def test_info(self):
+        "Info is computed without reading the file's contents"
+        path = TESTDATA / 'shapes.png'
+        i = InselectImage(path)
+        self.assertIsNone(i.recorded_info)
+        expected = ImageInfo(459, 437, 18153, path.stat().st_mtime, None)
+        with patch('inselect.lib.image.hashlib.sha256',
+                   side_effect=AssertionError):
+            self.assertEqual(expected, i.info)
+        self.assertEqual(expected, i.recorded_info)
+
+    def test_verify(self):
+        "The digest is computed by verify and then checked"
+        path = TESTDATA / 'shapes.png'
+        sha256 = hashlib.sha256(path.read_bytes()).hexdigest()
+        i = InselectImage(path)
+        self.assertTrue(i.verify())
+        self.assertEqual(sha256, i.info.sha256)
+        self.assertTrue(i.verify())
+
+        i = InselectImage(path, info=i.info._replace(sha256='0' * 64))
+        self.assertFalse(i.verify())
+
+    def test_recorded_info(self):
+        "Recorded info is used without opening the file"
+        path = TESTDATA / 'shapes.png'
+        info = InselectImage(path).info
+        i = InselectImage(path, info=info)
+        with patch('inselect.lib.image.Image.open',
+                   side_effect=AssertionError):
+            self.assertEqual(info, i.recorded_info)
+            self.assertEqual(info, i.info)
+            self.assertEqual((459, 437), i.dimensions)
+
+    def test_recorded_info_out_of_date(self):
+        "Recorded info that is not consistent with the file is not used"
+        path = TESTDATA / 'shapes.png'
+        info = InselectImage(path).info
+        i = InselectImage(path, info=info._replace(width=1, mtime=0))
+        self.assertIsNone(i.recorded_info)
+        self.assertEqual((459, 437), i.dimensions)
+        self.assertEqual(info, i.info)
+
+    def test_recorded_info_file_replaced(self):
+        "A file replaced after recorded info was checked is detected"
+        with temp_directory_with_files(TESTDATA / 'shapes.png') as tempdir:
+            path = tempdir / 'shapes.png'
+            info = InselectImage(path).info
+            i = InselectImage(path, info=info)
+            self.assertEqual(info, i.recorded_info)
+
+            path.write_bytes(path.read_bytes() + b'x')
+            self.assertIsNone(i.recorded_info)
+            self.assertEqual(info.size_bytes + 1, i.info.size_bytes)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import unittest
+
+from pathlib import Path
+
+from inselect.lib.document import InselectDocument
+from inselect.lib.manifest import fingerprint, Manifest, settings_digest
+
+from inselect.tests.utils import temp_directory_with_files
+
+
+TESTDATA = Path(__file__).parent.parent / 'test_data'
+
+
+class TestManifest(unittest.TestCase):
+    def test_fingerprint(self):
+        "Fingerprint of document and images"
+        p = TESTDATA / 'shapes.inselect'
+        f = fingerprint(p)
+        self.assertEqual(40, len(f.document_hash))
+        self.assertEqual((TESTDATA / 'shapes.png').stat().st_mtime_ns,
+                         f.scanned_mtime)
+        self.assertIsNone(f.thumbnail_mtime)
+        self.assertIsNone(f.settings)
+
+    def test_settings_digest(self):
+        "Digest of template file contents and engine name"
+        template = TESTDATA / 'test.inselect_template'
+        self.assertEqual(settings_digest(), settings_digest())
+        self.assertNotEqual(settings_digest(),
+                            settings_digest(template=template))
+        self.assertNotEqual(settings_digest(engine='LibDMTXEngine'),
+                            settings_digest(engine='ZbarEngine'))
+        with temp_directory_with_files(template) as tempdir:
+            copy = tempdir / template.name
+            digest = settings_digest(template=copy)
+            self.assertEqual(settings_digest(template=template), digest)
+            copy.write_text(copy.read_text() + '\n')
+            self.assertNotEqual(digest, settings_digest(template=copy))
+
+    def test_complete(self):
+        "Stages are complete until the document or image changes"
+        with temp_directory_with_files(TESTDATA / 'shapes.inselect',
+                                       TESTDATA / 'shapes.png') as tempdir:
+            doc_path = tempdir / 'shapes.inselect'
+            with Manifest(tempdir / 'manifest.sqlite') as manifest:
+                self.assertFalse(manifest.is_complete(doc_path, 'crops'))
+                manifest.completed(doc_path, 'crops')
+                self.assertTrue(manifest.is_complete(doc_path, 'crops'))
+                self.assertFalse(manifest.is_complete(doc_path, 'csv'))
+
+                # Image modified
+                os.utime(str(tempdir / 'shapes.png'), (0, 0))
+                self.assertFalse(manifest.is_complete(doc_path, 'crops'))
+                manifest.completed(doc_path, 'crops')
+
+                # Document modified
+                doc = InselectDocument.load(doc_path)
+                doc.set_items(doc.items[:1])
+                doc.save()
+                self.assertFalse(manifest.is_complete(doc_path, 'crops'))
+
+            # Persisted
+            with Manifest(tempdir / 'manifest.sqlite') as manifest:
+                self.assertFalse(manifest.is_complete(doc_path, 'crops'))
+                manifest.completed(doc_path, 'crops')
+            with Manifest(tempdir / 'manifest.sqlite') as manifest:
+                self.assertTrue(manifest.is_complete(doc_path, 'crops'))
+
+    def test_complete_settings(self):
+        "Stages are complete only with the settings that were recorded"
+        with temp_directory_with_files(TESTDATA / 'shapes.inselect',
+                                       TESTDATA / 'shapes.png') as tempdir:
+            doc_path = tempdir / 'shapes.inselect'
+            template = settings_digest(
+                template=TESTDATA / 'test.inselect_template'
+            )
+            with Manifest(tempdir / 'manifest.sqlite') as manifest:
+                manifest.completed(doc_path, 'csv', settings_digest())
+                self.assertTrue(
+                    manifest.is_complete(doc_path, 'csv', settings_digest())
+                )
+                self.assertFalse(
+                    manifest.is_complete(doc_path, 'csv', template)
+                )
+                manifest.completed(doc_path, 'csv', template)
+                self.assertTrue(
+                    manifest.is_complete(doc_path, 'csv', template)
+                )
+
+    def test_upgrade(self):
+        "Manifests written before settings were recorded are upgraded"
+        with temp_directory_with_files(TESTDATA / 'shapes.inselect',
+                                       TESTDATA / 'shapes.png') as tempdir:
+            doc_path = tempdir / 'shapes.inselect'
+            path = tempdir / 'manifest.sqlite'
+            connection = sqlite3.connect(str(path))
+            with connection:
+                connection.execute(
+                    'CREATE TABLE stages ('
+                    'document TEXT NOT NULL, '
+                    'stage TEXT NOT NULL, '
+                    'document_hash TEXT NOT NULL, '
+                    'scanned_mtime INTEGER, '
+                    'thumbnail_mtime INTEGER, '
+                    'completed_on TEXT NOT NULL, '
+                    'PRIMARY KEY (document, stage))'
+                )
+                connection.execute(
+                    'INSERT INTO stages VALUES (?, ?, ?, ?, ?, ?)',
+                    (str(doc_path.resolve()), 'csv') +
+                    fingerprint(doc_path)[:3] + ('2016-01-01 00:00:00',)
+                )
+            connection.close()
+
+            with Manifest(path) as manifest:
+                # Settings are not known so the stage is not complete
+                self.assertFalse(
+                    manifest.is_complete(doc_path, 'csv', settings_digest())
+                )
+                manifest.completed(doc_path, 'csv', settings_digest())
+                self.assertTrue(
+                    manifest.is_complete(doc_path, 'csv', settings_digest())
+                )
+
+
+if __name__ == '__main__':
+    unittest.main()
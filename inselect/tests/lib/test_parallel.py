@@ -0,0 +1,58 @@
+import os
+import unittest
+
+from inselect.lib.parallel import imap_completed, worker_pool
+
+
+def _square(v):
+    if v < 0:
+        raise ValueError('Negative')
+    else:
+        return v * v
+
+
+def _pid(v):
+    return os.getpid()
+
+
+class TestImapCompleted(unittest.TestCase):
+    def _results(self, jobs):
+        results = {}
+        for arg, future in imap_completed(_square, [-1, 1, 2, 3, 4], jobs):
+            try:
+                results[arg] = future.result()
+            except ValueError:
+                results[arg] = None
+        return results
+
+    def test_serial(self):
+        "Calls are made in this process"
+        self.assertEqual({-1: None, 1: 1, 2: 4, 3: 9, 4: 16}, self._results(1))
+
+    def test_parallel(self):
+        "Calls are made in worker processes"
+        self.assertEqual({-1: None, 1: 1, 2: 4, 3: 9, 4: 16}, self._results(2))
+
+    def test_invalid_jobs(self):
+        with self.assertRaises(ValueError):
+            list(imap_completed(_square, [1], 0))
+        with self.assertRaises(ValueError):
+            with worker_pool(0):
+                pass
+
+    def test_worker_pool(self):
+        "A pool of workers is reused by many calls"
+        with worker_pool(1) as pool:
+            self.assertIsNone(pool)
+
+        with worker_pool(2) as pool:
+            pids = set()
+            for batch in range(3):
+                results = imap_completed(_pid, range(4), 2, pool)
+                pids.update(future.result() for arg, future in results)
+            self.assertNotIn(os.getpid(), pids)
+            self.assertLessEqual(len(pids), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
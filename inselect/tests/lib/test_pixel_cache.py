@@ -0,0 +1,180 @@
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+from pathlib import Path
+
+import numpy as np
+
+from mock import patch
+
+from inselect.lib import pixel_cache
+from inselect.lib.image import InselectImage
+from inselect.lib.pixel_cache import PixelCache
+
+from inselect.tests.utils import temp_directory_with_files
+
+
+TESTDATA = Path(__file__).parent.parent / 'test_data'
+
+
+class TestPixelCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(str(self.dir))
+
+    def test_get_put(self):
+        "Array is cached and loaded as a read-only memory map"
+        cache = PixelCache(self.dir / 'cache')
+        p = TESTDATA / 'shapes.png'
+        self.assertIsNone(cache.get(p))
+
+        expected = InselectImage(p).array
+        cache.put(p, expected)
+        actual = cache.get(p)
+        self.assertIsInstance(actual, np.memmap)
+        self.assertFalse(actual.flags.writeable)
+        self.assertTrue(np.all(expected == actual))
+
+    def test_modified(self):
+        "Entry is not used if the image file is modified"
+        with temp_directory_with_files(TESTDATA / 'shapes.png') as tempdir:
+            p = tempdir / 'shapes.png'
+            cache = PixelCache(self.dir)
+            cache.put(p, InselectImage(p).array)
+            self.assertIsNotNone(cache.get(p))
+            with p.open('ab') as outfile:
+                outfile.write(b'x')
+            self.assertIsNone(cache.get(p))
+
+    def test_prune(self):
+        "Least recently used entries are removed"
+        cache = PixelCache(self.dir)
+        a, b = TESTDATA / 'shapes.png', TESTDATA / 'pinned.jpg'
+        cache.put(a, np.zeros((10, 10, 3), dtype=np.uint8))
+        cache.put(b, np.zeros((10, 10, 3), dtype=np.uint8))
+
+        # Make a the least recently used
+        entry_a, entry_b = cache._entry(a), cache._entry(b)
+        os.utime(str(entry_a), (0, 0))
+
+        size = entry_b.stat().st_size
+        self.assertEqual(2 * size, cache.size_bytes)
+        self.assertEqual((1, size), cache.prune(size))
+        self.assertEqual([(entry_b, size)], cache.entries())
+        self.assertEqual((1, size), cache.prune(0))
+        self.assertEqual([], cache.entries())
+
+    def test_put_prunes(self):
+        "Cache is pruned to max_bytes when an entry is added"
+        cache = PixelCache(self.dir, max_bytes=0)
+        cache.put(TESTDATA / 'shapes.png',
+                  np.zeros((10, 10, 3), dtype=np.uint8))
+        self.assertEqual([], cache.entries())
+
+    def test_put_prunes_over_limit(self):
+        "The cache directory is scanned only when the limit is exceeded"
+        array = np.zeros((10, 10, 3), dtype=np.uint8)
+        cache = PixelCache(self.dir)
+        cache.put(TESTDATA / 'shapes.png', array)
+        size = cache.size_bytes
+        cache.max_bytes = size + size // 2
+        with patch.object(cache, 'entries',
+                          wraps=cache.entries) as entries:
+            cache.put(TESTDATA / 'pinned.jpg', array)
+            self.assertEqual(1, entries.call_count)
+            self.assertEqual(1, len(cache.entries()))
+            entries.reset_mock()
+
+            # Space was freed by pruning
+            cache.max_bytes = 3 * size
+            cache.put(TESTDATA / 'shapes.png', array)
+            cache.put(TESTDATA / 'barcodes.jpg', array)
+            self.assertEqual(0, entries.call_count)
+        self.assertEqual(3, len(cache.entries()))
+
+    def test_put_replaces(self):
+        "An entry that is replaced is counted once"
+        array = np.zeros((10, 10, 3), dtype=np.uint8)
+        cache = PixelCache(self.dir)
+        a, b = TESTDATA / 'shapes.png', TESTDATA / 'pinned.jpg'
+
+        # A corrupt entry that get() cannot read
+        self.dir.mkdir(exist_ok=True)
+        cache._entry(a).write_bytes(b'corrupt')
+        self.assertIsNone(cache.get(a))
+        cache.put(b, array)
+        cache.put(a, array)
+        self.assertEqual(cache.size_bytes, cache._recorded_bytes)
+
+        # A valid entry
+        cache.put(a, array)
+        self.assertEqual(cache.size_bytes, cache._recorded_bytes)
+        self.assertEqual(2, len(cache.entries()))
+
+    def test_put_errors(self):
+        "Errors writing to the cache are ignored"
+        p = TESTDATA / 'shapes.png'
+        array = np.zeros((10, 10, 3), dtype=np.uint8)
+
+        # The cache directory cannot be created
+        (self.dir / 'file').touch()
+        self.assertFalse(PixelCache(self.dir / 'file' / 'cache').put(p, array))
+
+        # Disk full
+        cache = PixelCache(self.dir)
+        error = OSError(errno.ENOSPC, 'No space left on device')
+        with patch('inselect.lib.pixel_cache.os.replace', side_effect=error):
+            self.assertFalse(cache.put(p, array))
+        self.assertIsNone(cache.get(p))
+        # The temporary file is removed
+        self.assertEqual(['file'], [f.name for f in self.dir.iterdir()])
+
+    def test_get_utime_error(self):
+        "Entries are returned if their use cannot be recorded"
+        cache = PixelCache(self.dir)
+        p = TESTDATA / 'shapes.png'
+        cache.put(p, np.zeros((10, 10, 3), dtype=np.uint8))
+        with patch('inselect.lib.pixel_cache.os.utime',
+                   side_effect=PermissionError(errno.EACCES, 'Denied')):
+            self.assertIsNotNone(cache.get(p))
+
+    def _with_default_cache(self, directory, fn):
+        os.environ[pixel_cache.CACHE_DIR_ENV] = str(directory)
+        pixel_cache._DEFAULT = False
+        try:
+            return fn()
+        finally:
+            del os.environ[pixel_cache.CACHE_DIR_ENV]
+            pixel_cache._DEFAULT = False
+
+    def test_image_array(self):
+        "InselectImage.array uses the default cache"
+        def arrays():
+            return [InselectImage(TESTDATA / 'shapes.png').array
+                    for _ in range(2)]
+
+        expected, actual = self._with_default_cache(self.dir, arrays)
+        self.assertEqual(1, len(PixelCache(self.dir).entries()))
+        # Decoded and cached arrays are of the same type and read-only
+        for array in (expected, actual):
+            self.assertIs(np.ndarray, type(array))
+            self.assertFalse(array.flags.writeable)
+        self.assertTrue(np.all(expected == actual))
+
+    def test_image_array_cache_error(self):
+        "InselectImage.array decodes the image if the cache cannot be used"
+        (self.dir / 'file').touch()
+        array = self._with_default_cache(
+            self.dir / 'file' / 'cache',
+            lambda: InselectImage(TESTDATA / 'shapes.png').array
+        )
+        self.assertEqual((437, 459, 3), array.shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
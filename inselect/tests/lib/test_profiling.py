@@ -0,0 +1,129 @@
+import json
+import threading
+import unittest
+
+from pathlib import Path
+
+import cv2
+
+from inselect.lib.profiling import Profile, span, spans_only
+from inselect.lib.segment import segment_edges, segment_edges_tiled
+
+from inselect.tests.utils import temp_directory_with_files
+
+
+TESTDATA = Path(__file__).parent.parent / 'test_data'
+
+
+class TestProfile(unittest.TestCase):
+    def test_span(self):
+        "Spans are recorded with their args"
+        import numpy as np
+        profile = Profile()
+        with span(profile, 'outer', a=1) as s:
+            with span(profile, 'inner'):
+                pass
+            s.array('image', np.zeros((4, 5, 3), dtype=np.uint8))
+            s.set(b=2)
+
+        inner, outer = profile.events
+        self.assertEqual('inner', inner['name'])
+        self.assertEqual('outer', outer['name'])
+        self.assertEqual(
+            {'a': 1, 'b': 2,
+             'image': {'shape': [4, 5, 3], 'dtype': 'uint8', 'bytes': 60}},
+            outer['args']
+        )
+        self.assertLessEqual(outer['ts'], inner['ts'])
+        self.assertGreaterEqual(outer['dur'], inner['dur'])
+        self.assertEqual(['outer', 'inner'],
+                         [name for name, count, seconds in profile.totals()])
+
+    def test_no_span(self):
+        "span() does nothing if the callback does not have a span method"
+        with span(lambda *args: None, 'stage') as s:
+            s.set(a=1)
+        with span(None, 'stage') as s:
+            s.array('a', None)
+        self.assertIsNone(spans_only(lambda *args: None))
+
+    def test_callback(self):
+        "Calls are passed to the wrapped callback"
+        messages = []
+        profile = Profile(messages.append)
+        profile('Message')
+        spans_only(profile)('Ignored')
+        with span(spans_only(profile), 'stage'):
+            pass
+        self.assertEqual(['Message'], messages)
+        self.assertEqual(['stage'], [e['name'] for e in profile.events])
+
+    def test_threads(self):
+        "Spans recorded in other threads"
+        profile = Profile()
+        # All threads are alive at once, so have distinct identifiers
+        barrier = threading.Barrier(4)
+
+        def work():
+            barrier.wait()
+            for _ in range(100):
+                with span(profile, 'work'):
+                    pass
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([('work', 400)],
+                         [total[:2] for total in profile.totals()])
+        self.assertEqual(4, len(set(e['tid'] for e in profile.events)))
+
+    def test_write(self):
+        profile = Profile()
+        with span(profile, 'stage'):
+            pass
+        profile.extend([{'name': 'other', 'ph': 'X', 'ts': 0, 'dur': 10,
+                         'pid': 1, 'tid': 1, 'args': {}}])
+        with temp_directory_with_files() as tempdir:
+            path = tempdir / 'profile.json'
+            profile.write(path)
+            trace = json.loads(path.read_text())
+        self.assertEqual(['stage', 'other'],
+                         [e['name'] for e in trace['traceEvents']])
+
+
+class TestProfileSegment(unittest.TestCase):
+    def test_segment_edges(self):
+        "The stages of segment_edges are timed"
+        image = cv2.imread(str(TESTDATA / 'shapes.png'))
+        profile = Profile()
+        rects, display = segment_edges(image, resize=(1000, 500),
+                                       callback=profile)
+        events = {e['name']: e for e in profile.events}
+        self.assertEqual(
+            {'resize', 'blur', 'lab', 'sobel', 'line removal', 'findContours',
+             'contour processing', 'variance filter'},
+            set(events)
+        )
+        self.assertEqual({'shape': [500, 1000, 3], 'dtype': 'uint8',
+                          'bytes': 1500000},
+                         events['resize']['args']['image'])
+        self.assertEqual(len(rects),
+                         events['variance filter']['args']['rects'])
+
+    def test_segment_edges_tiled(self):
+        "Tiles, which are segmented in other threads, are timed"
+        image = cv2.imread(str(TESTDATA / 'shapes.png'))
+        messages = []
+        profile = Profile(messages.append)
+        segment_edges_tiled(image, 400, 100, threads=2, callback=profile)
+        names = [e['name'] for e in profile.events]
+        self.assertEqual(names.count('tile'), names.count('findContours'))
+        self.assertIn('merge tiles', names)
+        # Progress is reported only by the calling thread
+        self.assertNotIn('Detecting contours', messages)
+
+
+if __name__ == '__main__':
+    unittest.main()
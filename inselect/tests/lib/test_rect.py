@@ -1,6 +1,8 @@
 import unittest
 
-from inselect.lib.rect import Coordinates, Point, Rect
+import numpy as np
+
+from inselect.lib.rect import Coordinates, Point, Rect, RectArray
 
 
 class TestCoordinates(unittest.TestCase):
@@ -71,5 +73,78 @@ class TestRect(unittest.TestCase):
             a == Point(1, 1)
 
 
+class TestRectArray(unittest.TestCase):
+    RECTS = [Rect(0, 1, 2, 3), Rect(-10, -10, 110, 110), Rect(5, 5, 10, 20)]
+
+    def test_construct(self):
+        a = RectArray(self.RECTS)
+        self.assertEqual((3, 4), a.array.shape)
+        self.assertEqual(3, len(a))
+        self.assertEqual(self.RECTS, list(a))
+        self.assertEqual(self.RECTS, list(RectArray(iter(self.RECTS))))
+        self.assertEqual(self.RECTS, list(RectArray(a)))
+        self.assertEqual(self.RECTS[1], a[1])
+        self.assertEqual(self.RECTS[1], a[np.int64(1)])
+        self.assertEqual(self.RECTS[1:], list(a[1:]))
+        self.assertEqual((0, 4), RectArray([]).array.shape)
+
+    def test_as_rect(self):
+        "Operations are as those of Rect"
+        a = RectArray(self.RECTS)
+        self.assertEqual([r.left for r in self.RECTS], a.left.tolist())
+        self.assertEqual([r.top for r in self.RECTS], a.top.tolist())
+        self.assertEqual([r.width for r in self.RECTS], a.width.tolist())
+        self.assertEqual([r.height for r in self.RECTS], a.height.tolist())
+        self.assertEqual([r.area for r in self.RECTS], a.area.tolist())
+        self.assertEqual([list(r.coordinates) for r in self.RECTS],
+                         a.coordinates.tolist())
+        self.assertEqual([r.x_centre for r in self.RECTS], a.x_centre.tolist())
+        self.assertEqual([r.y_centre for r in self.RECTS], a.y_centre.tolist())
+        self.assertEqual([list(r.centre) for r in self.RECTS],
+                         a.centres.tolist())
+        self.assertEqual([r.padded(10.0) for r in self.RECTS],
+                         list(a.padded(10.0)))
+        bounds = Rect(0, 0, 100, 100)
+        self.assertEqual([r.intersect(bounds) for r in self.RECTS],
+                         list(a.intersect(bounds)))
+        with self.assertRaises(TypeError):
+            a.intersect((0, 0, 1, 1))
+
+    def test_intersect_pairwise(self):
+        "Rects are intersected pairwise with those of a RectArray or array"
+        a = RectArray(self.RECTS)
+        others = [Rect(1, 2, 10, 10), Rect(0, 0, 5, 5), Rect(0, 0, 10, 10)]
+        expected = [r.intersect(o) for r, o in zip(self.RECTS, others)]
+        self.assertEqual(expected, list(a.intersect(RectArray(others))))
+        self.assertEqual(expected, list(a.intersect(np.array(others))))
+        with self.assertRaises(ValueError):
+            a.intersect(RectArray(others[:2]))
+
+    def test_not_altered(self):
+        "Operations return new instances"
+        a = RectArray(self.RECTS)
+        a.padded(10).intersect(Rect(0, 0, 1, 1)).to_normalised(10, 10)
+        a.coordinates
+        self.assertEqual(self.RECTS, list(a))
+
+    def test_normalise(self):
+        a = RectArray([Rect(0, 0, 459, 437), Rect(0, 0, 153, 23)])
+        normalised = a.to_normalised(459, 437)
+        self.assertEqual([Rect(0, 0, 1, 1), Rect(0, 0, 1.0 / 3, 23 / 437.0)],
+                         list(normalised))
+        self.assertEqual(list(a), list(normalised.from_normalised(459, 437)))
+        self.assertEqual([Rect(0, 0, 2, 2)],
+                         list(RectArray([(0, 0, 0.125, 0.175)]).
+                              from_normalised(20, 10)))
+
+    def test_iou(self):
+        a = RectArray([Rect(0, 0, 10, 10), Rect(100, 100, 10, 10)])
+        b = [Rect(5, 0, 10, 10), Rect(0, 0, 10, 10), Rect(10, 0, 10, 10)]
+        self.assertTrue(np.allclose([[50 / 150.0, 1, 0], [0, 0, 0]],
+                                    a.iou(b)))
+        self.assertEqual((2, 0), a.iou([]).shape)
+        self.assertEqual((0, 3), RectArray([]).iou(b).shape)
+
+
 if __name__ == '__main__':
     unittest.main()
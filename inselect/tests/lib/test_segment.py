@@ -1,9 +1,23 @@
 import unittest
 from pathlib import Path
 
+import cv2
+import numpy as np
+
+from mock import patch
+
 from inselect.lib.document import InselectDocument
+from inselect.lib.segment import (EdgeMaps, _find_contours, _integrals, _iou,
+                                  _merge_windows, _process_contours,
+                                  _tile_cores, _tile_starts, _variances,
+                                  edge_map, edge_maps, segment_edges,
+                                  segment_edges_pyramid, segment_edges_tiled,
+                                  segment_grabcut)
+from inselect.lib import segment_document
 from inselect.lib.segment_document import SegmentDocument
 
+from inselect.tests.utils import temp_directory_with_files
+
 
 TESTDATA = Path(__file__).parent.parent / 'test_data'
 
@@ -39,5 +53,331 @@ class TestSegment(unittest.TestCase):
         self._segment(doc, True, expected)
 
 
+def _reference_process_contours(image, contours, hierarchy, index=0,
+                                size_filter=True):
+    """The original, recursive implementation of _process_contours, against
+    which the vectorised implementation is checked
+    """
+    result = []
+    while index >= 0:
+        next, previous, child, parent = hierarchy[0][index]
+        x, y, w, h = rect = cv2.boundingRect(contours[index])
+        area = image.shape[0] * image.shape[1]
+        ratio = float(max(w, h)) / min(w, h)
+        fill_ratio = cv2.contourArea(contours[index]) / (w * h)
+        is_right_shape = ratio < 8 and w * h > area / 8E3
+        is_container = (not 0.1 < fill_ratio < 0.8 and
+                        (w > image.shape[1] * 0.35 or
+                         h > image.shape[0] * 0.35))
+        is_too_large = (w > image.shape[1] * 0.85 and
+                        h > image.shape[0] * 0.85)
+        if (is_right_shape and not is_container and
+                not (size_filter and is_too_large)):
+            result.append(rect)
+        elif child != -1:
+            result.extend(_reference_process_contours(
+                image, contours, hierarchy, child, size_filter
+            ))
+        index = next
+    return result
+
+
+class TestProcessContours(unittest.TestCase):
+    def _compare(self, image, edges):
+        contours, hierarchy = _find_contours(edges, cv2.RETR_TREE,
+                                             cv2.CHAIN_APPROX_SIMPLE)
+        self.assertTrue(contours)
+        for size_filter in (True, False):
+            expected = _reference_process_contours(
+                image, contours, hierarchy, size_filter=size_filter
+            )
+            actual = _process_contours(image, contours, hierarchy,
+                                       lambda *args: None, size_filter)
+            self.assertTrue(expected)
+            self.assertEqual(expected, [r[:4] for r in actual])
+
+    def test_images(self):
+        "Same rects, in the same order, as the recursive implementation"
+        for name in ('shapes.png', 'pinned.jpg', 'barcodes.jpg'):
+            image = cv2.imread(str(TESTDATA / name))
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            for low, high in ((10, 50), (50, 150)):
+                self._compare(image, cv2.Canny(gray, low, high))
+
+    def test_no_contours(self):
+        image = cv2.imread(str(TESTDATA / 'shapes.png'))
+        contours, hierarchy = _find_contours(
+            cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) * 0, cv2.RETR_TREE,
+            cv2.CHAIN_APPROX_SIMPLE
+        )
+        self.assertEqual(
+            [], _process_contours(image, contours, hierarchy, lambda: None)
+        )
+
+
+class TestEdgeMaps(unittest.TestCase):
+    def test_edges(self):
+        "Edges from maps are those of edge_map"
+        image = cv2.imread(str(TESTDATA / 'shapes.png'))
+        maps = edge_maps(image)
+        self.assertEqual(image.shape[:2], maps.shape)
+        expected, gray = edge_map(image, line_filter=0)
+        self.assertTrue((expected == maps.edges()).all())
+        self.assertTrue((gray == maps.gray).all())
+
+    def test_segment_edges(self):
+        "segment_edges finds the same objects using maps"
+        image = cv2.imread(str(TESTDATA / 'shapes.png'))
+        maps = edge_maps(image)
+        expected, _ = segment_edges(image)
+        actual, _ = segment_edges(image, maps=maps)
+        self.assertEqual([r[:4] for r in expected], [r[:4] for r in actual])
+
+        window = (50, 50, 300, 300)
+        expected, _ = segment_edges(image, window=window)
+        actual, _ = segment_edges(image, window=window, maps=maps)
+        self.assertEqual(expected, actual)
+
+        self.assertRaises(ValueError, segment_edges, image, maps=maps,
+                          resize=(200, 200))
+        self.assertRaises(ValueError, segment_edges, image,
+                          maps=maps.crop(window))
+
+    def test_save_load(self):
+        image = cv2.imread(str(TESTDATA / 'shapes.png'))
+        maps = edge_maps(image)
+        with temp_directory_with_files() as tempdir:
+            path = str(tempdir / 'maps.npz')
+            maps.save(path, (1, 2))
+            loaded = EdgeMaps.load(path, (1, 2))
+            self.assertIsNone(EdgeMaps.load(path, (1, 3)))
+            # Magnitudes are written as compressed uint16
+            self.assertLess(Path(path).stat().st_size,
+                            2 * image.shape[0] * image.shape[1])
+        self.assertEqual(maps.thresholds, loaded.thresholds)
+        self.assertEqual(maps.magnitudes.shape, loaded.magnitudes.shape)
+        self.assertEqual(np.float32, loaded.magnitudes.dtype)
+        self.assertTrue((maps.edges() == loaded.edges()).all())
+        self.assertTrue((maps.gray == loaded.gray).all())
+
+    def test_save_load_windows(self):
+        "Windows of loaded maps give the rects of windows of the originals"
+        for name in ('shapes.png', 'pinned.jpg'):
+            image = cv2.imread(str(TESTDATA / name))
+            maps = edge_maps(image)
+            with temp_directory_with_files() as tempdir:
+                path = str(tempdir / 'maps.npz')
+                maps.save(path)
+                loaded = EdgeMaps.load(path)
+            height, width = image.shape[:2]
+            for x in range(0, width - 100, width // 4):
+                for y in range(0, height - 100, height // 4):
+                    window = (x, y, min(200, width - x), min(200, height - y))
+                    expected, _ = segment_edges(image, window=window,
+                                                maps=maps)
+                    actual, _ = segment_edges(image, window=window,
+                                              maps=loaded)
+                    self.assertEqual([r[:4] for r in expected],
+                                     [r[:4] for r in actual])
+
+    def test_subsegment(self):
+        "subsegment uses the edge maps kept or saved by segment"
+        files = (TESTDATA / 'pinned.inselect', TESTDATA / 'pinned.jpg')
+        with temp_directory_with_files(*files) as tempdir:
+            doc = InselectDocument.load(tempdir / 'pinned.inselect')
+            seeds = [(290, 145), (586, 276), (272, 453)]
+            expected, _ = SegmentDocument().subsegment(doc, 0, seeds)
+
+            segment_document._EDGE_MAPS.clear()
+            segment = SegmentDocument(cache_edge_maps=True,
+                                      save_edge_maps=True)
+            segment.segment(doc, resize=False)
+            self.assertTrue(doc.edge_maps_path.is_file())
+            self.assertEqual(1, len(segment_document._EDGE_MAPS))
+            self.assertIsNotNone(segment._edge_maps(doc, doc.scanned))
+
+            actual, _ = segment.subsegment(doc, 0, seeds)
+            self.assertEqual(len(expected), len(actual))
+
+            # Read from the file
+            segment_document._EDGE_MAPS.clear()
+            self.assertIsNotNone(segment._edge_maps(doc, doc.scanned))
+
+            # Out of date if the image is altered
+            path = doc.scanned.path
+            path.write_bytes(path.read_bytes())
+            self.assertIsNone(segment._edge_maps(doc, doc.scanned))
+
+            # Truncated maps are ignored and computed afresh
+            data = doc.edge_maps_path.read_bytes()
+            for truncated in (data[:len(data) // 2], data[:10], b''):
+                doc.edge_maps_path.write_bytes(truncated)
+                segment_document._EDGE_MAPS.clear()
+                self.assertIsNone(segment._edge_maps(doc, doc.scanned))
+            actual, _ = segment.subsegment(doc, 0, seeds)
+            self.assertEqual(len(expected), len(actual))
+
+
+class TestSegmentGrabcut(unittest.TestCase):
+    WINDOW = (8, 33, 790, 576)
+    SEEDS = [(282, 112), (578, 243), (264, 420)]
+
+    def test_seeds(self):
+        "One box for each seed"
+        image = cv2.imread(str(TESTDATA / 'pinned.jpg'))
+        rects, display = segment_grabcut(image, self.WINDOW, self.SEEDS)
+        self.assertEqual((576, 790, 3), display.shape)
+        self.assertEqual(3, len(rects))
+        for (sx, sy), (x, y, w, h) in zip(self.SEEDS, rects):
+            self.assertTrue(x <= sx + 8 < x + w and y <= sy + 33 < y + h)
+
+    def test_max_pixels(self):
+        "Large windows are reduced"
+        image = cv2.imread(str(TESTDATA / 'pinned.jpg'))
+        expected, _ = segment_grabcut(image, self.WINDOW, self.SEEDS)
+        actual, display = segment_grabcut(image, self.WINDOW, self.SEEDS,
+                                          max_pixels=300000)
+        self.assertEqual((576, 790, 3), display.shape)
+        self.assertEqual(len(expected), len(actual))
+        for rect, other in zip(expected, actual):
+            self.assertGreater(_iou(rect, other), 0.8)
+
+
+class TestVariances(unittest.TestCase):
+    def test_variances(self):
+        "Variances from integral images are those given by np.var"
+        image = cv2.imread(str(TESTDATA / 'shapes.png'))
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        height, width = gray.shape
+        rects = [(0, 0, width, height), (10, 20, 30, 40), (5, 5, 1, 1),
+                 (width - 10, height - 10, 50, 50)]
+        expected = [np.var(gray[y:y + h, x:x + w]) for x, y, w, h in rects]
+        np.testing.assert_allclose(
+            expected, _variances(_integrals(gray), rects), atol=1e-6
+        )
+
+    def test_empty(self):
+        image = cv2.imread(str(TESTDATA / 'shapes.png'))
+        integrals = _integrals(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+        self.assertEqual(0, len(_variances(integrals, [])))
+        self.assertTrue(np.isnan(_variances(integrals, [(5, 5, 0, 10)])[0]))
+
+
+class TestSegmentTiled(unittest.TestCase):
+    def test_tiles(self):
+        self.assertEqual([0], _tile_starts(100, 200, 50))
+        self.assertEqual([0, 150, 300, 400], _tile_starts(600, 200, 50))
+        self.assertEqual([(0, 175), (175, 325), (325, 450), (450, 600)],
+                         _tile_cores([0, 150, 300, 400], 600, 200))
+
+    def _assert_as_untiled(self, image, tile_size, **kwargs):
+        "Tiled segmentation finds the same boxes as untiled segmentation"
+        expected, _ = segment_edges(image)
+        actual, display = segment_edges_tiled(image, tile_size, threads=2,
+                                              **kwargs)
+        self.assertEqual(image.shape, display.shape)
+        self.assertEqual(len(expected), len(actual),
+                         msg='{0} != {1}'.format(expected, actual))
+        for rect in sorted(r[:4] for r in expected):
+            self.assertTrue(
+                any(all(abs(a - b) <= 1 for a, b in zip(rect, other))
+                    for other in actual),
+                msg='{0} not in {1}'.format(rect, actual)
+            )
+
+    def test_segment_edges_tiled(self):
+        "Same boxes as untiled segmentation, including those across seams"
+        image = cv2.imread(str(TESTDATA / 'shapes.png'))
+        image = cv2.resize(image, None, fx=4, fy=4)
+        self._assert_as_untiled(image, 1024)
+
+    def test_segment_edges_tiled_details(self):
+        "Details within objects that straddle tiles are not boxed"
+        image = np.full((2000, 2000, 3), 235, dtype=np.uint8)
+        # Tiles of 1024 pixels start at 0, 768 and 976 and their cores meet
+        # at 896 and 1384
+        objects = [(700, 150, 400, 300), (150, 700, 300, 420),
+                   (820, 820, 360, 360), (1250, 1300, 500, 350),
+                   (300, 1500, 450, 300)]
+        for index, (x, y, w, h) in enumerate(objects):
+            cv2.ellipse(image, (x + w // 2, y + h // 2), (w // 2, h // 2), 0,
+                        0, 360, (40 * index, 90, 150 - 20 * index), -1)
+            for dx, dy in ((1, 1), (3, 1), (2, 3)):
+                cv2.circle(image, (x + dx * w // 4, y + dy * h // 4),
+                           min(w, h) // 10, (250, 250 - 40 * index, 40), -1)
+        self._assert_as_untiled(image, 1024)
+
+    def test_segment_edges_tiled_nested(self):
+        "Objects within the box of another object in the same tile are kept"
+        image = np.full((3000, 3000, 3), 235, dtype=np.uint8)
+        # A C-shaped ring containing a disc. Tiles of 2048 pixels start at 0
+        # and 952 - the first contains both whole, the second cuts both.
+        cv2.ellipse(image, (700, 700), (500, 500), 0, 60, 360, (60, 90, 150),
+                    40)
+        cv2.circle(image, (900, 700), 90, (150, 60, 40), -1)
+        self._assert_as_untiled(image, 2048)
+
+    def test_segment_edges_tiled_grow_overlap(self):
+        "Objects larger than the overlap that cross tiles cause a retile"
+        image = cv2.imread(str(TESTDATA / 'shapes.png'))
+        image = cv2.resize(image, None, fx=4, fy=4)
+        with patch('inselect.lib.segment.segment_edges_tiled',
+                   wraps=segment_edges_tiled) as tiled:
+            self._assert_as_untiled(image, 1024, overlap=32)
+        self.assertEqual(1, tiled.call_count)
+        self.assertGreater(tiled.call_args[0][2], 32)
+
+    def test_segment_edges_tiled_too_large(self):
+        "Objects larger than tiles cause the whole image to be segmented"
+        image = cv2.imread(str(TESTDATA / 'shapes.png'))
+        image = cv2.resize(image, None, fx=4, fy=4)
+        with patch('inselect.lib.segment.segment_edges',
+                   wraps=segment_edges) as untiled:
+            self._assert_as_untiled(image, 600, overlap=100)
+        self.assertIn(image.shape,
+                      [c[0][0].shape for c in untiled.call_args_list])
+
+    def test_overlap(self):
+        image = cv2.imread(str(TESTDATA / 'shapes.png'))
+        self.assertRaises(ValueError, segment_edges_tiled, image, 100, 100)
+
+
+class TestSegmentPyramid(unittest.TestCase):
+    def test_merge_windows(self):
+        self.assertEqual(
+            [(0, 0, 30, 30), (50, 50, 10, 10)],
+            _merge_windows([(0, 0, 10, 10), (50, 50, 10, 10), (5, 5, 10, 10),
+                            (20, 20, 10, 10), (12, 12, 10, 10)])
+        )
+
+    def test_sparse(self):
+        "Objects in a sparsely populated image are found by refining regions"
+        shapes = cv2.imread(str(TESTDATA / 'shapes.png'))
+        image = np.full((2000, 2000, 3), 255, dtype=np.uint8)
+        image[100:100 + shapes.shape[0], 1200:1200 + shapes.shape[1]] = shapes
+
+        expected, _ = segment_edges(image)
+        actual, display = segment_edges_pyramid(image, coarse_width=500)
+        self.assertEqual(image.shape, display.shape)
+        self.assertEqual(5, len(expected))
+        self.assertEqual(sorted(r[:4] for r in expected), sorted(actual))
+
+    def test_drawer(self):
+        "Recall on a drawer of pinned specimens matches segment_edges"
+        image = cv2.imread(str(TESTDATA / 'pinned.jpg'))
+        expected, _ = segment_edges(image)
+        actual, display = segment_edges_pyramid(image)
+        self.assertEqual(image.shape, display.shape)
+        self.assertEqual(sorted(r[:4] for r in expected),
+                         sorted(r[:4] for r in actual))
+
+    def test_empty(self):
+        "The whole image is segmented if the coarse level has no objects"
+        image = np.full((2000, 2000, 3), 255, dtype=np.uint8)
+        actual, display = segment_edges_pyramid(image, coarse_width=500)
+        self.assertEqual([], actual)
+        self.assertEqual(image.shape, display.shape)
+
+
 if __name__ == '__main__':
     unittest.main()
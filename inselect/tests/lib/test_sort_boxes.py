@@ -2,7 +2,8 @@ import unittest
 from pathlib import Path
 
 from inselect.lib.document import InselectDocument
-from inselect.lib.sort_document_items import sort_document_items
+from inselect.lib.rect import Rect
+from inselect.lib.sort_document_items import _do_kde, sort_document_items
 
 
 TESTDATA = Path(__file__).parent.parent / 'test_data'
@@ -26,6 +27,27 @@ class TestSortBoxes(unittest.TestCase):
             [item['fields']['catalogNumber'] for item in items]
         )
 
+    def test_empty_and_single(self):
+        self.assertEqual([], sort_document_items([], by_columns=False))
+        items = [{'rect': Rect(0.1, 0.1, 0.1, 0.1)}]
+        self.assertEqual(items, sort_document_items(items, by_columns=False))
+
+    def test_kde_bins(self):
+        "Values in well-separated clusters are assigned to the same bins"
+        self.assertEqual(
+            [0, 0, 1, 1, 2],
+            list(_do_kde([0.05, 0.07, 0.5, 0.52, 0.95]))
+        )
+
+    def test_ties_preserve_order(self):
+        "Items with identical boxes keep their original order"
+        items = [{'rect': Rect(0.1, 0.1, 0.1, 0.1), 'id': i} for i in range(5)]
+        items.insert(0, {'rect': Rect(0.6, 0.6, 0.1, 0.1), 'id': 5})
+        self.assertEqual(
+            [0, 1, 2, 3, 4, 5],
+            [i['id'] for i in sort_document_items(items, by_columns=False)]
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from mock import patch
+
+from inselect.lib.walk import find_files, prefetch
+
+
+class TestFindFiles(unittest.TestCase):
+    def setUp(self):
+        self.dir = Path(tempfile.mkdtemp())
+        for p in ('a.inselect', 'b.INSELECT', 'c.txt',
+                  'x/d.inselect', 'x/y/e.inselect', 'z/f.inselect'):
+            p = self.dir / p
+            if not p.parent.is_dir():
+                p.parent.mkdir(parents=True)
+            p.touch()
+
+    def tearDown(self):
+        shutil.rmtree(str(self.dir))
+
+    def _names(self, *args, **kwargs):
+        return sorted(p.name for p in find_files(self.dir, *args, **kwargs))
+
+    def test_flat(self):
+        "Files in dir only, with names matched without regard to case"
+        self.assertEqual(['a.inselect', 'b.INSELECT'],
+                         self._names(['*.inselect']))
+
+    def test_recursive(self):
+        self.assertEqual(
+            ['a.inselect', 'b.INSELECT', 'd.inselect', 'e.inselect',
+             'f.inselect'],
+            self._names(['*.inselect'], recursive=True)
+        )
+
+    def test_include_exclude(self):
+        self.assertEqual(
+            ['a.inselect', 'f.inselect'],
+            self._names(['*.inselect'], recursive=True, include=['[af]*'])
+        )
+        self.assertEqual(
+            ['a.inselect', 'b.INSELECT', 'f.inselect'],
+            self._names(['*.inselect'], recursive=True, exclude=['x'])
+        )
+        self.assertEqual(
+            ['a.inselect', 'b.INSELECT', 'd.inselect'],
+            self._names(['*.inselect'], recursive=True, exclude=['y', 'z'])
+        )
+
+    def test_no_prefetch(self):
+        self.assertEqual(['a.inselect', 'b.INSELECT'],
+                         self._names(['*.inselect'], n_prefetch=0))
+
+    def test_unreadable_dirs(self):
+        "Directories that cannot be read are skipped"
+        scandir = os.scandir
+        errors = {'x': PermissionError, 'z': FileNotFoundError}
+
+        def failing_scandir(path):
+            error = errors.get(Path(path).name)
+            if error:
+                raise error(path)
+            else:
+                return scandir(path)
+
+        with patch('inselect.lib.walk.os.scandir', new=failing_scandir):
+            self.assertEqual(['a.inselect', 'b.INSELECT'],
+                             self._names(['*.inselect'], recursive=True))
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_prefetch(self):
+        self.assertEqual(list(range(100)), list(prefetch(range(100), 3)))
+
+    def test_error(self):
+        "Errors are raised in the caller's thread"
+        def fail():
+            yield 1
+            raise ValueError('Failed')
+
+        with self.assertRaises(ValueError):
+            list(prefetch(fail(), 3))
+
+    def test_bail_out(self):
+        "Caller stops consuming before the end"
+        items = prefetch(iter(range(100)), 3)
+        self.assertEqual(0, next(items))
+        items.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
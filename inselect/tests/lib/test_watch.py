@@ -0,0 +1,65 @@
+import shutil
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from mock import patch
+
+from inselect.lib.watch import FolderWatcher, inotify_available
+
+
+class TestFolderWatcher(unittest.TestCase):
+    USE_INOTIFY = False
+
+    def setUp(self):
+        self.dir = Path(tempfile.mkdtemp())
+        (self.dir / 'a.jpg').write_bytes(b'a')
+        (self.dir / 'b.txt').write_bytes(b'b')
+        self.watcher = FolderWatcher(self.dir, ['*.jpg'], recursive=True,
+                                     settle=0.1, poll_interval=0.1,
+                                     use_inotify=self.USE_INOTIFY)
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(str(self.dir))
+
+    def test_watch(self):
+        "Existing, new and rewritten files are yielded"
+        batches = iter(self.watcher)
+        self.assertEqual([self.dir / 'a.jpg'], next(batches))
+        self.assertEqual(self.USE_INOTIFY, self.watcher.inotify)
+
+        (self.dir / 'x').mkdir()
+        (self.dir / 'x' / 'c.jpg').write_bytes(b'c')
+        self.assertEqual([self.dir / 'x' / 'c.jpg'], next(batches))
+
+        (self.dir / 'a.jpg').write_bytes(b'rewritten')
+        self.assertEqual([self.dir / 'a.jpg'], next(batches))
+
+
+class TestFolderWatcherPolling(unittest.TestCase):
+    def setUp(self):
+        self.dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(str(self.dir))
+
+    def test_no_busy_wait(self):
+        "Pending files are checked every settle / 2 seconds"
+        (self.dir / 'a.jpg').write_bytes(b'a')
+        watcher = FolderWatcher(self.dir, ['*.jpg'], settle=0.5,
+                                poll_interval=10, use_inotify=False)
+        with patch.object(watcher, '_ready', wraps=watcher._ready) as ready:
+            self.assertEqual([self.dir / 'a.jpg'], next(iter(watcher)))
+        # Checked on being found, then every 0.25s until settled
+        self.assertLessEqual(ready.call_count, 6)
+
+
+@unittest.skipUnless(inotify_available(), 'inotify_simple not available')
+class TestFolderWatcherInotify(TestFolderWatcher):
+    USE_INOTIFY = True
+
+
+if __name__ == '__main__':
+    unittest.main()
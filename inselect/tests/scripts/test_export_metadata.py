@@ -1,6 +1,8 @@
 import sys
 import unittest
 
+from contextlib import redirect_stdout
+from io import StringIO
 from itertools import count
 from pathlib import Path
 
@@ -70,6 +72,55 @@ class TestExportCSV(unittest.TestCase):
                     }
                     self.assertEqual(expected, actual)
 
+    def test_export_csv_manifest_overwrite(self):
+        "Unchanged documents in the manifest are exported with --overwrite"
+        with temp_directory_with_files(TESTDATA / 'shapes.inselect',
+                                       TESTDATA / 'shapes.png') as tempdir:
+            manifest = '--manifest={0}'.format(tempdir / 'manifest.sqlite')
+            main([str(tempdir), manifest])
+
+            csv = tempdir / 'shapes.csv'
+            with csv.open('w') as outfile:
+                outfile.write('This is only a test\n')
+
+            # Skipped as the document is unchanged
+            main([str(tempdir), manifest])
+            with csv.open('r') as infile:
+                self.assertEqual('This is only a test\n', infile.read())
+
+            main([str(tempdir), manifest, '--overwrite'])
+            with csv.open('r') as infile:
+                self.assertNotEqual('This is only a test\n', infile.read())
+
+    def test_export_csv_manifest_removed(self):
+        "Documents in the manifest are exported if the CSV file was removed"
+        with temp_directory_with_files(TESTDATA / 'shapes.inselect',
+                                       TESTDATA / 'shapes.png') as tempdir:
+            manifest = '--manifest={0}'.format(tempdir / 'manifest.sqlite')
+            main([str(tempdir), manifest])
+
+            csv = tempdir / 'shapes.csv'
+            csv.unlink()
+            main([str(tempdir), manifest])
+            self.assertTrue(csv.is_file())
+
+    def test_export_csv_manifest_template(self):
+        "Documents in the manifest are exported again with a new template"
+        with temp_directory_with_files(TESTDATA / 'shapes.inselect',
+                                       TESTDATA / 'shapes.png') as tempdir:
+            manifest = '--manifest={0}'.format(tempdir / 'manifest.sqlite')
+            main([str(tempdir), manifest])
+
+            template = '--template={0}'.format(
+                TESTDATA / 'test.inselect_template'
+            )
+            stdout = StringIO()
+            with redirect_stdout(stdout):
+                main([str(tempdir), manifest, template])
+            self.assertNotIn('as it is unchanged', stdout.getvalue())
+            self.assertIn('because there are validation problems',
+                          stdout.getvalue())
+
     def test_export_csv_with_template(self):
         "Export metadata to CSV using a metadata template"
         with temp_directory_with_files(TESTDATA / 'shapes.inselect',
@@ -8,9 +8,12 @@ import cv2
 
 import numpy as np
 
+from mock import patch
+
 from inselect.lib.document import InselectDocument
 from inselect.lib.ingest import IMAGE_SUFFIXES_RE
 from inselect.lib.inselect_error import InselectError
+from inselect.lib.parallel import worker_pool
 from inselect.lib.utils import rmtree_readonly
 from inselect.scripts.ingest import main
 
@@ -112,6 +115,82 @@ class TestIngest(unittest.TestCase):
         self.assertTrue((self.docs / upper).is_file())
         self.assertTrue((self.docs / title).is_file())
 
+    def test_recursive(self):
+        "Images in subdirectories are ingested into equivalent subdirectories"
+        (self.inbox / 'a' / 'b').mkdir(parents=True)
+        shutil.copy(str(TESTDATA / 'shapes.png'), str(self.inbox / 'x.png'))
+        shutil.copy(str(TESTDATA / 'shapes.png'),
+                    str(self.inbox / 'a' / 'b' / 'y.png'))
+
+        main([str(self.inbox), str(self.docs)])
+        self.assertTrue((self.docs / 'x.inselect').is_file())
+        self.assertTrue((self.inbox / 'a' / 'b' / 'y.png').is_file())
+
+        main(['--recursive', str(self.inbox), str(self.docs)])
+        self.assertTrue((self.docs / 'a' / 'b' / 'y.inselect').is_file())
+        self.assertFalse((self.inbox / 'a' / 'b' / 'y.png').is_file())
+
+    def test_jobs(self):
+        "Images are ingested by worker processes"
+        for name in ('a.png', 'b.png', 'c.png'):
+            shutil.copy(str(TESTDATA / 'shapes.png'), str(self.inbox / name))
+
+        main(['--jobs=2', str(self.inbox), str(self.docs)])
+
+        for name in ('a', 'b', 'c'):
+            self.assertTrue((self.docs / (name + '.inselect')).is_file())
+            self.assertFalse((self.inbox / (name + '.png')).is_file())
+
+    def test_watch_one_pool(self):
+        "One pool of workers ingests every batch of images that is watched"
+        inbox = self.inbox
+
+        class FakeWatcher(object):
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            def __iter__(self):
+                for name in ('a.png', 'b.png'):
+                    shutil.copy(str(TESTDATA / 'shapes.png'),
+                                str(inbox / name))
+                    yield [inbox / name]
+                raise KeyboardInterrupt()
+
+        with patch('inselect.scripts.ingest.FolderWatcher', new=FakeWatcher), \
+                patch('inselect.scripts.ingest.worker_pool',
+                      wraps=worker_pool) as pool:
+            main(['--watch', '--jobs=2', str(self.inbox), str(self.docs)])
+
+        pool.assert_called_once_with(2)
+        for name in ('a', 'b'):
+            self.assertTrue((self.docs / (name + '.inselect')).is_file())
+
+    def test_segment(self):
+        "New document is segmented"
+        shutil.copy(str(TESTDATA / 'shapes.png'), str(self.inbox / 'x.png'))
+
+        main(['--segment', str(self.inbox), str(self.docs)])
+
+        doc = InselectDocument.load(self.docs / 'x.inselect')
+        self.assertEqual(5, len(doc.items))
+
+    def test_document_exists(self):
+        "Image is left in the inbox if its document already exists"
+        shutil.copy(str(TESTDATA / 'shapes.png'), str(self.inbox / 'x.png'))
+        shutil.copy(str(TESTDATA / 'shapes.inselect'),
+                    str(self.docs / 'x.inselect'))
+
+        main([str(self.inbox), str(self.docs)])
+
+        self.assertTrue((self.inbox / 'x.png').is_file())
+        self.assertFalse((self.docs / 'x.png').is_file())
+
     def test_cookie_cutter(self):
         "Ingested image with cookie cutter applied"
         shutil.copy(str(TESTDATA / 'shapes.png'),
@@ -0,0 +1,92 @@
+import io
+import shutil
+import tempfile
+import unittest
+
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from inselect.lib.document import InselectDocument
+from inselect.lib.utils import rmtree_readonly
+from inselect.scripts.pipeline import main, Pipeline
+
+from inselect.tests.utils import temp_directory_with_files
+
+
+TESTDATA = Path(__file__).parent.parent / 'test_data'
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.inbox = Path(tempfile.mkdtemp())
+        self.docs = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        try:
+            rmtree_readonly(self.inbox)
+        finally:
+            rmtree_readonly(self.docs)
+
+    def test_ingest_and_segment(self):
+        "Images are ingested and segmented"
+        shutil.copy(str(TESTDATA / 'shapes.png'), str(self.inbox / 'x.png'))
+        shutil.copy(str(TESTDATA / 'shapes.png'), str(self.inbox / 'y.png'))
+
+        main([str(self.docs), '--inbox={0}'.format(self.inbox),
+              '--stages=ingest,segment', '--jobs=2'])
+
+        self.assertFalse((self.inbox / 'x.png').is_file())
+        for name in ('x', 'y'):
+            doc = InselectDocument.load(self.docs / (name + '.inselect'))
+            self.assertEqual(5, doc.n_items)
+            self.assertIn('Created by', doc.properties)
+
+    def test_rerun_in_place(self):
+        "Thumbnails and images that already have documents are not ingested"
+        shutil.copy(str(TESTDATA / 'shapes.png'), str(self.docs / 'x.png'))
+
+        main([str(self.docs), '--stages=ingest,segment'])
+        self.assertTrue((self.docs / 'x_thumbnail.jpg').is_file())
+
+        run = Pipeline(['ingest', 'segment'], self.docs)
+        timings = run(self.docs / 'x.png')
+        self.assertEqual(
+            ['Skipped - [{0}] exists'.format(self.docs / 'x.inselect'),
+             'Skipped - already contains items'],
+            [message for stage, elapsed, message in timings]
+        )
+
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            main([str(self.docs), '--stages=ingest,segment'])
+        self.assertIn('Processed [1] documents, errors [0]', stdout.getvalue())
+
+    def test_segment_skips_existing(self):
+        "Documents that contain items are not segmented"
+        with temp_directory_with_files(TESTDATA / 'shapes.inselect',
+                                       TESTDATA / 'shapes.png') as tempdir:
+            timings = Pipeline(['segment'], tempdir)(tempdir / 'shapes.inselect')
+            self.assertEqual(1, len(timings))
+            stage, elapsed, message = timings[0]
+            self.assertEqual('segment', stage)
+            self.assertEqual('Skipped - already contains items', message)
+
+    def test_crops_and_csv(self):
+        "Crops and CSV are written"
+        with temp_directory_with_files(TESTDATA / 'shapes.inselect',
+                                       TESTDATA / 'shapes.png') as tempdir:
+            main([str(tempdir), '--stages=crops,csv'])
+            self.assertEqual(5, len(list((tempdir / 'shapes_crops').glob('*jpg'))))
+            self.assertTrue((tempdir / 'shapes.csv').is_file())
+
+    def test_unknown_stage(self):
+        "Unknown stages are rejected"
+        self.assertRaises(ValueError, Pipeline, ['segment', 'x'], self.docs)
+        self.assertRaises(SystemExit, main, [str(self.docs), '--stages=x'])
+
+    def test_barcodes_requires_engine(self):
+        self.assertRaises(ValueError, Pipeline, ['barcodes'], self.docs)
+
+
+if __name__ == '__main__':
+    unittest.main()
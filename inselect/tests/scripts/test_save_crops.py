@@ -1,3 +1,4 @@
+import shutil
 import unittest
 import sys
 
@@ -34,6 +35,36 @@ class TestSaveCrops(unittest.TestCase):
             crops = tempdir / 'shapes_crops'
             self.assertEqual(5, len(list(crops.glob('*jpg'))))
 
+    def test_save_crops_manifest_overwrite(self):
+        "Unchanged documents in the manifest are cropped with --overwrite"
+        with temp_directory_with_files(TESTDATA / 'shapes.inselect',
+                                       TESTDATA / 'shapes.png') as tempdir:
+            manifest = '--manifest={0}'.format(tempdir / 'manifest.sqlite')
+            main([str(tempdir), manifest])
+
+            crops = tempdir / 'shapes_crops'
+            for crop in crops.glob('*jpg'):
+                crop.unlink()
+
+            # Skipped as the document is unchanged
+            main([str(tempdir), manifest])
+            self.assertEqual(0, len(list(crops.glob('*jpg'))))
+
+            main([str(tempdir), manifest, '--overwrite'])
+            self.assertEqual(5, len(list(crops.glob('*jpg'))))
+
+    def test_save_crops_manifest_removed(self):
+        "Documents in the manifest are cropped if the crops dir was removed"
+        with temp_directory_with_files(TESTDATA / 'shapes.inselect',
+                                       TESTDATA / 'shapes.png') as tempdir:
+            manifest = '--manifest={0}'.format(tempdir / 'manifest.sqlite')
+            main([str(tempdir), manifest])
+
+            crops = tempdir / 'shapes_crops'
+            shutil.rmtree(str(crops))
+            main([str(tempdir), manifest])
+            self.assertEqual(5, len(list(crops.glob('*jpg'))))
+
     def test_save_crops_with_template(self):
         "Save crops using a metadata template"
         with temp_directory_with_files(TESTDATA / 'shapes.inselect',
@@ -1,9 +1,13 @@
+import json
 import unittest
 
 from pathlib import Path
 
+from mock import patch
+
 from inselect.lib.ingest import ingest_image
 from inselect.lib.document import InselectDocument
+from inselect.lib.manifest import Manifest
 from inselect.scripts.segment import main
 
 from inselect.tests.utils import temp_directory_with_files
@@ -31,6 +35,70 @@ class TestSegment(unittest.TestCase):
 
             # TODO LH assert that segment again does not touch this document
 
+    def test_shapes_jobs(self):
+        "Segment documents in worker processes"
+        shapes = TESTDATA / 'shapes.png'
+        with temp_directory_with_files(shapes) as tempdir:
+            for name in ('a.png', 'b.png', 'c.png'):
+                (tempdir / name).write_bytes(shapes.read_bytes())
+                ingest_image(tempdir / name, tempdir)
+
+            main([str(tempdir), '--jobs=2'])
+
+            for name in ('a', 'b', 'c'):
+                doc = InselectDocument.load(tempdir / (name + '.inselect'))
+                self.assertEqual(5, len(doc.items))
+
+    def test_tile_size(self):
+        "Segment the full-resolution scan in tiles"
+        with temp_directory_with_files(TESTDATA / 'shapes.png') as tempdir:
+            ingest_image(tempdir / 'shapes.png', tempdir)
+
+            main([str(tempdir), '--tile-size=400'])
+
+            doc = InselectDocument.load(tempdir / 'shapes.inselect')
+            self.assertEqual(5, len(doc.items))
+
+    def test_tile_threads(self):
+        "Worker processes share the CPUs between their threads"
+        with temp_directory_with_files() as tempdir, \
+                patch('inselect.scripts.segment.os.cpu_count', return_value=8), \
+                patch('inselect.scripts.segment.imap_completed',
+                      return_value=[]) as imap_completed:
+            main([str(tempdir), '--tile-size=400', '--jobs=3'])
+            fn = imap_completed.call_args[0][0]
+            self.assertEqual(2, fn.keywords['threads'])
+
+    def test_profile(self):
+        "The stages of segmentation are written to a trace file"
+        with temp_directory_with_files(TESTDATA / 'shapes.png') as tempdir:
+            ingest_image(tempdir / 'shapes.png', tempdir)
+            profile = tempdir / 'profile.json'
+
+            main([str(tempdir), '--profile={0}'.format(profile)])
+
+            trace = json.loads(profile.read_text())
+            names = set(e['name'] for e in trace['traceEvents'])
+            self.assertIn('findContours', names)
+            self.assertIn('variance filter', names)
+
+    def test_manifest(self):
+        "Segmented documents are recorded in the manifest"
+        with temp_directory_with_files(TESTDATA / 'shapes.png') as tempdir:
+            ingest_image(tempdir / 'shapes.png', tempdir)
+            manifest = tempdir / 'manifest.sqlite'
+
+            main([str(tempdir), '--manifest={0}'.format(manifest)])
+
+            doc_path = tempdir / 'shapes.inselect'
+            with Manifest(manifest) as m:
+                self.assertTrue(m.is_complete(doc_path, 'segment'))
+
+            # Not altered by a second run
+            mtime = doc_path.stat().st_mtime_ns
+            main([str(tempdir), '--manifest={0}'.format(manifest)])
+            self.assertEqual(mtime, doc_path.stat().st_mtime_ns)
+
 
 if __name__ == '__main__':
     unittest.main()
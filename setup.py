@@ -13,13 +13,12 @@ REQUIREMENTS = [
     'pytz>=2016.7',
     'PyYAML>=3.12,<3.2',
     'schematics>=1.1.1,<1.2',
-    'scikit-learn>=0.18.1,<0.19',
-    'scipy>=0.18.1,<0.19',
     'unicodecsv>=0.14.1,<0.15',
 ]
 
 
-SCRIPTS = ('export_metadata', 'ingest', 'read_barcodes', 'save_crops', 'segment')
+SCRIPTS = ('export_metadata', 'ingest', 'pipeline', 'prune_pixel_cache',
+           'read_barcodes', 'save_crops', 'segment')
 
 
 setup_data = {
@@ -49,6 +48,7 @@ setup_data = {
             'PyQt5>=5.6.0'
         ],
         'barcodes': ['gouda>=0.1.13', 'pylibdmtx>=0.1.6', 'pyzbar>=0.1.3'],
+        'watch': ['inotify_simple>=1.1; sys_platform == "linux"'],
         'windows': ['pywin32>=220'],
         'development': ['coveralls>=1.1', 'mock>=2.0.0', 'nose>=1.3.7'],
     },
@@ -112,8 +112,6 @@ def _qt_files(site_packages):
 
 def cx_setup():
     """cx_Freeze setup. Used for building Windows installers"""
-    import scipy
-
     from pathlib import Path
     from distutils.sysconfig import get_python_lib
 
@@ -151,13 +149,6 @@ def cx_setup():
     # Convert instances of Path to strs
     include_files = [(str(source), str(dest)) for source, dest in include_files]
 
-    # Directories as strings
-    include_files += [
-        # Fixes scipy freeze
-        # http://stackoverflow.com/a/32822431/1773758
-        str(Path(scipy.__file__).parent),
-    ]
-
     # Packages to exclude.
     exclude_packages = [
         str(p.relative_to(site_packages)).replace('\\', '.') for p in
@@ -171,16 +162,14 @@ def cx_setup():
             'build_exe': {
                 'packages':
                     setup_data.get('packages', []) + [
-                        'urllib', 'sklearn.neighbors', 'win32com.gen_py',
+                        'urllib', 'win32com.gen_py',
                         'win32timezone',
                     ],
                 'excludes': [
-                    # '_bz2',    # Required by sklearn
-                    '_decimal', '_elementtree', '_hashlib', '_lzma',
+                    '_bz2', '_decimal', '_elementtree', '_hashlib', '_lzma',
                     '_ssl', 'curses',
                     'distutils', 'email', 'http', 'lib2to3', 'mock', 'nose',
-                    'PyQt5',
-                    # 'pydoc',    # Required by sklearn
+                    'PyQt5', 'pydoc',
                     'tcl', 'Tkinter', 'ttk', 'Tkconstants',
                     # 'unittest',    # Required by numpy.core.multiarray
                     'win32com.HTML', 'win32com.test', 'win32evtlog', 'win32pdh',